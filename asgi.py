@@ -0,0 +1,775 @@
+"""ASGI entry point with async Firestore handlers for the hot polling routes.
+
+``/control`` GET, the printer status ingestion routes, the
+``/api/recipients/<id>/status*`` reads and the status event stream run here on
+Firestore's async client, so a waiting Firestore round trip no longer pins a
+worker thread. Every other
+route is forwarded to the Flask app in ``main`` through a WSGI bridge.
+
+Input validation, response payloads and claim rules come from ``main``; this
+module only swaps the blocking Firestore calls for awaited ones. ``/control``
+long-polls wait on an ``asyncio.Event`` woken by main's shared command
+listener.
+
+Run with ``uvicorn asgi:app`` or ``SERVER_MODE=asgi gunicorn -c gunicorn.conf.py``.
+Flask-Limiter never sees the async routes, so each one counts its requests
+against the same ``RATE_LIMIT_*`` limit as its Flask view, in the limiter's
+storage, under the same key and endpoint scope.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl
+
+import main
+
+try:  # pragma: no cover - optional dependency handling
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # pragma: no cover - fallback when a2wsgi is unavailable
+    WSGIMiddleware = None  # type: ignore[assignment]
+try:  # pragma: no cover - optional dependency handling
+    from limits import parse_many as parseRateLimits
+except ImportError:  # pragma: no cover - fallback when flask-limiter is unavailable
+    parseRateLimits = None  # type: ignore[assignment]
+try:  # pragma: no cover - optional dependency handling
+    from google.cloud.firestore import async_transactional as firestoreAsyncTransactional
+except ImportError:  # pragma: no cover - fallback for environments without async_transactional
+    def firestoreAsyncTransactional(function):
+        async def runInTransaction(transaction, *args, **kwargs):
+            return await function(transaction, *args, **kwargs)
+
+        return runInTransaction
+
+
+asyncFirestoreClient = None
+asyncFirestoreClientLock: Optional[asyncio.Lock] = None
+printerApiKeyPollSeconds = 0.05
+
+
+class AsgiRequest:
+    """Request object exposing the attributes main's validation helpers read."""
+
+    def __init__(self, scope: dict, body: bytes):
+        self.method = scope.get('method', 'GET').upper()
+        self.path = scope.get('path', '/')
+        self.remoteAddr = (scope.get('client') or ('127.0.0.1',))[0]
+        queryString = scope.get('query_string', b'').decode('latin-1')
+        self.args: Dict[str, str] = {}
+        for key, value in parse_qsl(queryString, keep_blank_values=True):
+            self.args.setdefault(key, value)
+        self.headers = AsgiHeaders(scope.get('headers', []))
+        self.body = body
+
+    @property
+    def is_json(self) -> bool:  # pylint: disable=invalid-name
+        contentType = (self.headers.get('Content-Type') or '').split(';', 1)[0].strip().lower()
+        return contentType == 'application/json' or (
+            contentType.startswith('application/') and contentType.endswith('+json')
+        )
+
+    def get_json(self, silent: bool = False):  # pylint: disable=invalid-name
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            if silent:
+                return None
+            raise
+
+
+class AsgiHeaders:
+    def __init__(self, rawHeaders):
+        self._values: Dict[str, str] = {}
+        for rawName, rawValue in rawHeaders:
+            self._values.setdefault(rawName.decode('latin-1').lower(), rawValue.decode('latin-1'))
+
+    def get(self, name: str, default=None):
+        return self._values.get(name.lower(), default)
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self._values
+
+
+async def getAsyncFirestoreClient():
+    global asyncFirestoreClient, asyncFirestoreClientLock  # pylint: disable=global-statement
+
+    if asyncFirestoreClient is not None:
+        return asyncFirestoreClient
+
+    if asyncFirestoreClientLock is None:
+        asyncFirestoreClientLock = asyncio.Lock()
+
+    async with asyncFirestoreClientLock:
+        if asyncFirestoreClient is None:
+            gcpProjectId = os.environ.get('GCP_PROJECT_ID')
+            if not gcpProjectId:
+                raise main.MissingEnvironmentError(['GCP_PROJECT_ID'])
+            try:
+                clientKwargs: Dict[str, object] = {'project': gcpProjectId}
+                if main.googleAuthDefault is not None:
+                    credentials, _ = main.googleAuthDefault(
+                        scopes=['https://www.googleapis.com/auth/cloud-platform']
+                    )
+                    clientKwargs['credentials'] = credentials
+                asyncFirestoreClient = main.firestore.AsyncClient(**clientKwargs)
+            except Exception as error:  # pylint: disable=broad-except
+                raise main.ClientInitializationError('Firestore async client', error) from error
+            logging.info('Initialized async Firestore client for project %s', gcpProjectId)
+
+    return asyncFirestoreClient
+
+
+async def _loadAsyncFirestoreClientOrError():
+    try:
+        return await getAsyncFirestoreClient(), None
+    except Exception as error:  # pylint: disable=broad-except
+        logging.exception('Failed to load async Firestore client for request handling.')
+        return None, main._handleClientInitializationErrors(error)  # pylint: disable=protected-access
+
+
+async def _streamQuery(query) -> list:
+    return [snapshot async for snapshot in query.stream()]
+
+
+@firestoreAsyncTransactional
+async def _claimPrinterCommandAsync(transaction, documentReference, recipientId, claimUpdate, currentTime):
+    snapshot = await documentReference.get(transaction=transaction)
+    commandData = snapshot.to_dict() or {}
+
+    claimDecision = main._evaluatePrinterCommandClaim(  # pylint: disable=protected-access
+        commandData, recipientId, currentTime
+    )
+    if claimDecision == 'skip':
+        return False, None
+
+    if claimDecision == 'expire':
+        transaction.update(
+            documentReference,
+            {'status': 'expired', 'expiredAt': main.firestore.SERVER_TIMESTAMP},
+        )
+        return False, None
+
+    transaction.update(documentReference, claimUpdate)
+    return True, commandData
+
+
+async def ensureValidApiKey(asgiRequest: AsgiRequest):
+    # main.ensureValidApiKey waits for the first Secret Manager load on a
+    # threading.Event, which would stall every request on this event loop.
+    keyStore = main.printerApiKeyStore
+    if not keyStore.isLoaded():
+        keyStore.start()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + main.printerApiKeyInitialWaitSeconds
+        while not keyStore.isLoaded() and loop.time() < deadline:
+            await asyncio.sleep(printerApiKeyPollSeconds)
+    return main.ensureValidApiKey(asgiRequest, waitSeconds=0)
+
+
+async def _startPrinterCommandListener() -> bool:
+    # Firestore's async client has no snapshot listeners; the shared watcher
+    # runs on the synchronous client from main's bundle.
+    clients, clientError = await asyncio.to_thread(main._loadClientsOrError)  # pylint: disable=protected-access
+    if clientError:
+        return False
+    return await asyncio.to_thread(main.printerCommandWatcher.ensureListening, clients.firestoreClient)
+
+
+async def listPendingPrinterControlCommands(asgiRequest: AsgiRequest):
+    apiKeyError = await ensureValidApiKey(asgiRequest)
+    if apiKeyError:
+        return apiKeyError
+
+    queryParameters, validationError = main.parsePrinterCommandQueryParameters(asgiRequest.args)
+    if validationError:
+        return validationError
+
+    firestoreClient, clientError = await _loadAsyncFirestoreClientOrError()
+    if clientError:
+        return clientError
+
+    waitSeconds = queryParameters['waitSeconds']
+    if waitSeconds <= 0 or not await _startPrinterCommandListener():
+        claimedCommands, claimError = await _claimPendingPrinterControlCommands(firestoreClient, queryParameters)
+        return claimError or main.makeJsonResponse({'commands': claimedCommands}, 200)
+
+    eventLoop = asyncio.get_running_loop()
+    commandQueued = asyncio.Event()
+    deadline = eventLoop.time() + waitSeconds
+    with main.printerCommandWatcher.subscribe(
+        queryParameters, lambda: eventLoop.call_soon_threadsafe(commandQueued.set)
+    ):
+        while True:
+            commandQueued.clear()
+            claimedCommands, claimError = await _claimPendingPrinterControlCommands(firestoreClient, queryParameters)
+            if claimError:
+                return claimError
+            remainingSeconds = deadline - eventLoop.time()
+            if claimedCommands or remainingSeconds <= 0:
+                return main.makeJsonResponse({'commands': claimedCommands}, 200)
+            try:
+                await asyncio.wait_for(commandQueued.wait(), remainingSeconds)
+            except asyncio.TimeoutError:
+                return main.makeJsonResponse({'commands': claimedCommands}, 200)
+
+
+async def _claimPendingPrinterControlCommands(firestoreClient, queryParameters: dict):
+    sanitizedRecipientId = queryParameters['recipientId']
+    limitSize = queryParameters['limit']
+
+    baseQuery = main.buildPendingPrinterCommandQuery(firestoreClient, queryParameters)
+    fetchLimit = main.pendingCommandFetchLimit(limitSize)
+
+    try:
+        snapshotCandidates: List[Tuple[datetime, object]] = []
+        seenDocumentIds: Set[str] = set()
+        try:
+            # The three status queries are independent; issue them together.
+            statusSnapshotGroups = await asyncio.gather(
+                *(
+                    _streamQuery(
+                        baseQuery.where(
+                            filter=main.FieldFilter('status', '==', statusFilter)
+                        ).limit(fetchLimit)
+                    )
+                    for statusFilter in ('queued', 'pending', None)
+                )
+            )
+            for statusSnapshots in statusSnapshotGroups:
+                main.appendPendingCommandCandidates(snapshotCandidates, seenDocumentIds, statusSnapshots)
+
+            if len(snapshotCandidates) < limitSize:
+                additionalSnapshots = await _streamQuery(baseQuery.limit(fetchLimit))
+                main.appendPendingCommandCandidates(snapshotCandidates, seenDocumentIds, additionalSnapshots)
+        except main.FailedPrecondition as error:
+            logging.warning(
+                'Falling back to application-side filtering for pending printer control '
+                'commands because the Firestore composite index is missing.',
+                exc_info=error,
+            )
+            snapshotCandidates = []
+            fallbackDocuments = await _streamQuery(baseQuery.limit(fetchLimit))
+            main.appendPendingCommandCandidates(snapshotCandidates, set(), fallbackDocuments)
+
+        documents = main.selectOldestPendingCommands(snapshotCandidates, limitSize)
+    except Exception as error:  # pylint: disable=broad-except
+        logging.exception('Failed to fetch pending printer control commands.')
+        return None, main.makeErrorResponse(
+            500,
+            'ServerError',
+            'Failed to fetch pending printer control commands',
+            str(error),
+        )
+
+    currentTime = datetime.now(timezone.utc)
+    claimedCommands: List[Dict[str, object]] = []
+
+    for document in documents:
+        documentId = getattr(document, 'id', None)
+        commandData = document.to_dict() or {}
+
+        commandId = commandData.get('commandId') or documentId
+        if not commandId or documentId is None:
+            logging.warning('Skipping printer control command without a commandId during claiming.')
+            continue
+
+        expirationTime = main._parseExpirationTimestampValue(  # pylint: disable=protected-access
+            commandData.get('expiresAt')
+        )
+        if expirationTime is not None and expirationTime <= currentTime:
+            try:
+                await document.reference.update(
+                    {'status': 'expired', 'expiredAt': main.firestore.SERVER_TIMESTAMP}
+                )
+            except Exception:  # pylint: disable=broad-except
+                logging.exception('Failed to mark printer control command %s as expired.', commandId)
+            main.logExpiredPrinterCommand(commandId, commandData, sanitizedRecipientId, expirationTime)
+            continue
+
+        claimUpdate = main.buildPrinterCommandClaimUpdate(queryParameters)
+
+        try:
+            succeeded, snapshotData = await _claimPrinterCommandAsync(
+                firestoreClient.transaction(),
+                document.reference,
+                sanitizedRecipientId,
+                claimUpdate,
+                currentTime,
+            )
+        except main.GoogleAPICallError as error:
+            logging.debug(
+                'Transaction error while claiming printer control command %s: %s',
+                commandId,
+                error,
+            )
+            continue
+        except Exception:  # pylint: disable=broad-except
+            logging.exception('Unexpected error while claiming printer control command %s.', commandId)
+            continue
+
+        if not succeeded or snapshotData is None:
+            continue
+
+        claimedCommands.append(
+            main.buildClaimedPrinterCommandPayload(snapshotData, commandId, queryParameters)
+        )
+
+    logging.info(
+        'Recipient %s: fetched=%d, claimed=%d',
+        sanitizedRecipientId,
+        len(documents),
+        len(claimedCommands),
+    )
+
+    return claimedCommands, None
+
+
+async def handlePrinterStatusUpdate(asgiRequest: AsgiRequest, appId: Optional[str]):
+    logging.info('Received printer status update for app %s', appId or 'default')
+
+    apiKeyError = await ensureValidApiKey(asgiRequest)
+    if apiKeyError:
+        return apiKeyError
+
+    payload, payloadError = main.getJsonPayload(asgiRequest)
+    if payloadError:
+        return payloadError
+
+    firestoreClient, clientError = await _loadAsyncFirestoreClientOrError()
+    if clientError:
+        return clientError
+
+    statusRecord, validationError = main.buildPrinterStatusRecord(payload, appId)
+    if validationError:
+        return validationError
+
+    try:
+        documentReference = await _addPrinterStatusRecord(firestoreClient, statusRecord)
+    except Exception as error:  # pylint: disable=broad-except
+        logging.exception('Failed to store printer status update.')
+        return main.makeErrorResponse(500, 'ServerError', 'Failed to store printer status update', str(error))
+
+    return main.makeJsonResponse(main.buildPrinterStatusResponsePayload(documentReference, statusRecord), 200)
+
+
+async def simpleUpdatePrinterStatus(asgiRequest: AsgiRequest):
+    logging.info('Received simple printer status update')
+
+    apiKeyError = await ensureValidApiKey(asgiRequest)
+    if apiKeyError:
+        return apiKeyError
+
+    payload, payloadError = main.getJsonPayload(asgiRequest)
+    if payloadError:
+        return payloadError
+
+    firestoreClient, clientError = await _loadAsyncFirestoreClientOrError()
+    if clientError:
+        return clientError
+
+    statusData, validationError = main.buildSimplePrinterStatusRecord(payload)
+    if validationError:
+        return validationError
+
+    try:
+        documentReference = await _addPrinterStatusRecord(firestoreClient, statusData)
+    except Exception as error:  # pylint: disable=broad-except
+        logging.exception('Failed to store printer status update')
+        return main.makeErrorResponse(500, 'ServerError', 'Failed to store printer status update', str(error))
+
+    return main.makeJsonResponse({
+        'ok': True,
+        'success': True,
+        'message': 'Printer status updated successfully',
+        'statusId': getattr(documentReference, 'id', None),
+    }, 200)
+
+
+async def _addPrinterStatusRecord(firestoreClient, statusRecord: dict):
+    # Same single write batch as main.addPrinterStatusRecord.
+    documentReference = firestoreClient.collection(main.firestoreCollectionPrinterStatus).document()
+    writeBatch = firestoreClient.batch()
+    writeBatch.set(documentReference, statusRecord)
+    for scope, key, channel in main.listStatusPollVersionBumps(statusRecord):
+        main.bumpPollVersion(firestoreClient, scope, key, channel, writeBatch=writeBatch)
+    await writeBatch.commit()
+    return documentReference
+
+
+async def _readPollVersion(firestoreClient, scope: str, key: str, channel: str) -> Optional[int]:
+    try:
+        shardReferences = main.getPollVersionShardReferences(firestoreClient, scope, key, channel)
+        versionSnapshots = await asyncio.gather(*(shardReference.get() for shardReference in shardReferences))
+    except Exception:  # pylint: disable=broad-except
+        logging.exception('Failed to read %s poll version for %s %s.', channel, scope, key)
+        return None
+    return main.sumPollVersionSnapshots(versionSnapshots, channel)
+
+
+async def _loadRecipientStatusSnapshots(asgiRequest: AsgiRequest, recipientId: str, pollChannel: Optional[str] = None):
+    """Return (snapshots, error or 304 response, poll ETag arguments)."""
+    apiKeyError = await ensureValidApiKey(asgiRequest)
+    if apiKeyError:
+        return None, apiKeyError, None
+
+    if not recipientId.strip():
+        logging.warning('Missing recipientId when querying printer status.')
+        return None, main.makeErrorResponse(400, 'ValidationError', 'recipientId is required'), None
+
+    queryParameters, validationError = main.parsePrinterStatusQueryParameters(asgiRequest.args)
+    if validationError:
+        return None, validationError, None
+
+    firestoreClient, clientError = await _loadAsyncFirestoreClientOrError()
+    if clientError:
+        return None, clientError, None
+
+    pollEtagArguments = None
+    if pollChannel:
+        statusQueryArgs = main.buildStatusPollQueryArgs(recipientId.strip(), queryParameters)
+        statusVersion = await _readPollVersion(firestoreClient, 'recipient', recipientId.strip(), pollChannel)
+        matchingEtag = main.findMatchingPollEtag(asgiRequest.headers, pollChannel, statusVersion, statusQueryArgs)
+        if matchingEtag:
+            return None, main.makeNotModifiedResponse(matchingEtag), None
+        pollEtagArguments = (pollChannel, statusVersion, statusQueryArgs)
+
+    query = main.buildRecipientPrinterStatusQuery(
+        firestoreClient,
+        recipientId.strip(),
+        queryParameters['printerSerial'],
+        queryParameters['since'],
+        queryParameters['limit'],
+    )
+    try:
+        return await _streamQuery(query), None, pollEtagArguments
+    except Exception as error:  # pylint: disable=broad-except
+        logging.exception('Failed to load printer status history for %s.', recipientId)
+        return None, main.makeErrorResponse(
+            500,
+            'ServerError',
+            'Failed to load printer status updates',
+            str(error),
+        ), None
+
+
+async def listRecipientPrinterStatusHistory(asgiRequest: AsgiRequest, recipientId: str):
+    documentSnapshots, loadError, _ = await _loadRecipientStatusSnapshots(asgiRequest, recipientId)
+    if loadError:
+        return loadError
+
+    updates = [main.serializePrinterStatusDocument(snapshot) for snapshot in documentSnapshots]
+    return main.makeJsonResponse({'ok': True, 'updates': updates}, 200)
+
+
+async def listLatestRecipientPrinterStatuses(asgiRequest: AsgiRequest, recipientId: str):
+    documentSnapshots, loadError, pollEtagArguments = await _loadRecipientStatusSnapshots(
+        asgiRequest, recipientId, pollChannel='status'
+    )
+    if loadError:
+        return loadError
+
+    printerStatuses = main.buildLatestPrinterStatusMap(documentSnapshots)
+    return main.attachPollEtag(main.makeJsonResponse({'ok': True, 'printers': printerStatuses}, 200), *pollEtagArguments)
+
+
+class AsgiEventStream:
+    """Handler result sent as a text/event-stream body, chunk by chunk.
+
+    ``release`` is a blocking cleanup run in a worker thread once the stream
+    ends, whether or not the body was ever started.
+    """
+
+    def __init__(self, events, release=None):
+        self.events = events
+        self.release = release
+
+
+async def streamRecipientPrinterStatuses(asgiRequest: AsgiRequest, recipientId: str):
+    apiKeyError = await ensureValidApiKey(asgiRequest)
+    if apiKeyError:
+        return apiKeyError
+
+    if not recipientId.strip():
+        logging.warning('Missing recipientId when streaming printer status.')
+        return main.makeErrorResponse(400, 'ValidationError', 'recipientId is required')
+    sanitizedRecipientId = recipientId.strip()
+
+    queryParameters, validationError = main.parsePrinterStatusQueryParameters(asgiRequest.args)
+    if validationError:
+        return validationError
+
+    firestoreClient, clientError = await _loadAsyncFirestoreClientOrError()
+    if clientError:
+        return clientError
+    # The listener needs the synchronous client, as for /control long-polls.
+    clients, clientError = await asyncio.to_thread(main._loadClientsOrError)  # pylint: disable=protected-access
+    if clientError:
+        return clientError
+
+    resumeKey = main.parseStatusEventId(asgiRequest.headers.get('Last-Event-ID') or asgiRequest.args.get('lastEventId'))
+    statusStream = main.PrinterStatusStream(sanitizedRecipientId, queryParameters['printerSerial'], resumeKey)
+
+    eventLoop = asyncio.get_running_loop()
+    updateQueue: asyncio.Queue = asyncio.Queue()
+    subscription = await asyncio.to_thread(
+        main.printerStatusBroadcaster.subscribe,
+        clients.firestoreClient,
+        sanitizedRecipientId,
+        lambda documentSnapshot: eventLoop.call_soon_threadsafe(updateQueue.put_nowait, documentSnapshot),
+    )
+    if subscription is None:
+        return main.makeErrorResponse(
+            503, 'ServiceUnavailable', 'Live printer status is unavailable; poll status/latest'
+        )
+
+    try:
+        initialEvents = statusStream.buildInitialEvents(
+            await _streamQuery(statusStream.buildInitialQuery(firestoreClient, queryParameters))
+        )
+    except Exception as error:  # pylint: disable=broad-except
+        await asyncio.to_thread(main.printerStatusBroadcaster.unsubscribe, subscription)
+        logging.exception('Failed to load printer status history for %s.', sanitizedRecipientId)
+        return main.makeErrorResponse(500, 'ServerError', 'Failed to load printer status updates', str(error))
+
+    async def generateStatusEvents():
+        for initialEvent in initialEvents:
+            yield initialEvent
+        deadline = eventLoop.time() + main.statusStreamMaxSeconds
+        while True:
+            remainingSeconds = deadline - eventLoop.time()
+            if remainingSeconds <= 0 or not main.printerStatusBroadcaster.isActive(subscription):
+                return
+            try:
+                documentSnapshot = await asyncio.wait_for(
+                    updateQueue.get(), min(main.statusStreamHeartbeatSeconds, remainingSeconds)
+                )
+            except asyncio.TimeoutError:
+                yield main.statusStreamHeartbeat
+                continue
+            statusEvent = statusStream.eventForUpdate(documentSnapshot)
+            if statusEvent:
+                yield statusEvent
+
+    return AsgiEventStream(
+        generateStatusEvents(), release=lambda: main.printerStatusBroadcaster.unsubscribe(subscription)
+    )
+
+
+asyncRoutes = [
+    (
+        'GET',
+        re.compile(r'^/control$'),
+        'queuePrinterControlCommand',
+        lambda asgiRequest, _match: listPendingPrinterControlCommands(asgiRequest),
+    ),
+    (
+        'POST',
+        re.compile(r'^/printer-status$'),
+        'printerStatusUpdate',
+        lambda asgiRequest, _match: handlePrinterStatusUpdate(asgiRequest, None),
+    ),
+    (
+        'POST',
+        re.compile(r'^/api/apps/(?P<appId>[^/]+)/functions/updatePrinterStatus$'),
+        'updatePrinterStatus',
+        lambda asgiRequest, match: handlePrinterStatusUpdate(asgiRequest, match.group('appId')),
+    ),
+    (
+        'POST',
+        re.compile(r'^/updatePrinterStatus$'),
+        'simpleUpdatePrinterStatus',
+        lambda asgiRequest, _match: simpleUpdatePrinterStatus(asgiRequest),
+    ),
+    (
+        'GET',
+        re.compile(r'^/api/recipients/(?P<recipientId>[^/]+)/status$'),
+        'listRecipientPrinterStatusHistory',
+        lambda asgiRequest, match: listRecipientPrinterStatusHistory(asgiRequest, match.group('recipientId')),
+    ),
+    (
+        'GET',
+        re.compile(r'^/api/recipients/(?P<recipientId>[^/]+)/status/latest$'),
+        'listLatestRecipientPrinterStatuses',
+        lambda asgiRequest, match: listLatestRecipientPrinterStatuses(asgiRequest, match.group('recipientId')),
+    ),
+    (
+        'GET',
+        re.compile(r'^/api/recipients/(?P<recipientId>[^/]+)/status/stream$'),
+        'streamRecipientPrinterStatuses',
+        lambda asgiRequest, match: streamRecipientPrinterStatuses(asgiRequest, match.group('recipientId')),
+    ),
+]
+# Every async route's Flask view is limited to RATE_LIMIT_AUTH.
+asyncRouteRateLimit = main.RATE_LIMIT_AUTH
+
+
+def matchAsyncRoute(method: str, path: str):
+    for routeMethod, routePattern, endpoint, handler in asyncRoutes:
+        if routeMethod != method:
+            continue
+        match = routePattern.match(path)
+        if match:
+            return handler, match, endpoint
+    return None, None, None
+
+
+def getRateLimitKey(asgiRequest: AsgiRequest) -> str:
+    # Same key as main's Flask-Limiter key function.
+    apiKey = asgiRequest.headers.get('X-API-Key') or asgiRequest.args.get('apiKey')
+    if apiKey:
+        return f'apikey:{apiKey[:16]}'
+    return asgiRequest.remoteAddr
+
+
+async def enforceRateLimit(asgiRequest: AsgiRequest, endpoint: str, limitString: str):
+    if main.limiter is None or parseRateLimits is None:
+        return None
+    rateLimitKey = getRateLimitKey(asgiRequest)
+    for rateLimit in parseRateLimits(limitString):
+        # Shared storage such as Redis is a network round trip.
+        if not await asyncio.to_thread(main.limiter.limiter.hit, rateLimit, rateLimitKey, endpoint):
+            main.logEvent(
+                'rate_limit_exceeded',
+                level='WARNING',
+                remote_addr=asgiRequest.remoteAddr,
+                endpoint=endpoint,
+                method=asgiRequest.method,
+            )
+            return main.makeRateLimitExceededResponse()
+    return None
+
+
+def encodeHandlerResult(result) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    response, statusCode = result
+    if hasattr(response, 'get_data'):
+        body = response.get_data()
+    else:
+        body = json.dumps(main._to_jsonable(response), ensure_ascii=False).encode('utf-8')  # pylint: disable=protected-access
+    if statusCode == 304:
+        body = b''
+        headers = []
+    else:
+        headers = [
+            (b'content-type', b'application/json; charset=utf-8'),
+            (b'content-length', str(len(body)).encode('ascii')),
+        ]
+    responseHeaders = getattr(response, 'headers', None)
+    if responseHeaders is not None:
+        for headerName in ('ETag', 'Cache-Control'):
+            headerValue = responseHeaders.get(headerName)
+            if headerValue:
+                headers.append((headerName.lower().encode('latin-1'), headerValue.encode('latin-1')))
+    return statusCode, headers, body
+
+
+async def _sendEventStream(eventStream: AsgiEventStream, receive, send) -> None:
+    disconnected = asyncio.Event()
+
+    async def watchForDisconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    disconnectWatcher = asyncio.create_task(watchForDisconnect())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        # A closed connection is noticed at the next event or heartbeat.
+        async for eventText in eventStream.events:
+            if disconnected.is_set():
+                return
+            await send({'type': 'http.response.body', 'body': eventText.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        disconnectWatcher.cancel()
+        await eventStream.events.aclose()
+        # aclose() skips the body of a generator that never started, so the
+        # subscription is released here rather than in the generator.
+        if eventStream.release is not None:
+            await asyncio.to_thread(eventStream.release)
+
+
+async def _readRequestBody(receive) -> bytes:
+    bodyChunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        bodyChunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(bodyChunks)
+
+
+async def _handleLifespan(receive, send) -> None:
+    global asyncFirestoreClient  # pylint: disable=global-statement
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            main.startClientWarmup()
+            main.printerApiKeyStore.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            main.printerCommandWatcher.stop()
+            main.printerStatusBroadcaster.stop()
+            main.commandPushPublisher.stop()
+            if asyncFirestoreClient is not None and hasattr(asyncFirestoreClient, 'close'):
+                closeResult = asyncFirestoreClient.close()
+                if asyncio.iscoroutine(closeResult):
+                    await closeResult
+                asyncFirestoreClient = None
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+wsgiFallbackApp = WSGIMiddleware(main.app) if WSGIMiddleware is not None else None
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _handleLifespan(receive, send)
+        return
+
+    if scope['type'] != 'http':
+        return
+
+    handler, match, endpoint = matchAsyncRoute(scope.get('method', 'GET').upper(), scope.get('path', '/'))
+    if handler is None:
+        if wsgiFallbackApp is None:
+            result = main.makeErrorResponse(404, 'NotFound', 'Route is not served by the ASGI app')
+            statusCode, headers, body = encodeHandlerResult(result)
+            await send({'type': 'http.response.start', 'status': statusCode, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        await wsgiFallbackApp(scope, receive, send)
+        return
+
+    asgiRequest = AsgiRequest(scope, await _readRequestBody(receive))
+    with main.app.app_context():
+        result = await enforceRateLimit(asgiRequest, endpoint, asyncRouteRateLimit)
+        if result is None:
+            result = await handler(asgiRequest, match)
+        if isinstance(result, AsgiEventStream):
+            eventStream = result
+        else:
+            eventStream = None
+            statusCode, headers, body = encodeHandlerResult(result)
+
+    if eventStream is not None:
+        await _sendEventStream(eventStream, receive, send)
+        return
+
+    await send({'type': 'http.response.start', 'status': statusCode, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
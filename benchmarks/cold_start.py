@@ -0,0 +1,343 @@
+"""Cold-start and first-request latency benchmark for the Cloud Printer API.
+
+Each run starts a fresh interpreter, so import and client setup costs are
+measured the way a new Cloud Run instance pays them. Each run times:
+
+- ``import main``
+- ``loadPrinterApiKeys`` against a fake Secret Manager
+- ``getClients``
+- the first and second ``GET /control``, ``POST /upload`` and
+  ``GET /fetch/<token>``, plus the time from process spawn to each first
+  success
+
+Google Cloud is replaced by the in-process fakes in ``gcp_fakes``.
+``--rpc-latency-ms`` adds a simulated round trip to every fake RPC.
+``--encryption-mode envelope`` measures uploads and fetches with cached data
+keys instead of one KMS call each.
+
+Usage::
+
+    python benchmarks/cold_start.py --runs 5 --output cold-start.json
+    python benchmarks/cold_start.py --baseline cold-start.json --max-regression-pct 25
+
+The report is JSON. With ``--baseline``, the process exits with status 1 when
+any phase median regresses by more than ``--max-regression-pct``.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+benchmarkDirectory = Path(__file__).resolve().parent
+repositoryRoot = benchmarkDirectory.parent
+
+benchmarkEnvironment = {
+    'GCP_PROJECT_ID': 'benchmark-project',
+    'GCS_BUCKET_NAME': 'benchmark-bucket',
+    'KMS_KEY_RING': 'benchmark-ring',
+    'KMS_KEY_NAME': 'benchmark-key',
+    'KMS_LOCATION': 'europe-north1',
+    'API_KEYS_PRINTER_STATUS': 'benchmark-key',
+    # Every request shares one API key; keep the per-key limits out of the timings.
+    'RATE_LIMIT_DEFAULT': '1000000 per minute',
+    'RATE_LIMIT_AUTH': '1000000 per minute',
+    'RATE_LIMIT_UPLOAD': '1000000 per minute',
+    'RATE_LIMIT_FETCH': '1000000 per minute',
+}
+benchmarkApiKey = 'benchmark-key'
+benchmarkRecipientId = 'benchmark-recipient'
+benchmarkPrinterSerial = 'BENCH-0001'
+benchmarkSecretPath = 'projects/benchmark-project/secrets/printer-api-keys/versions/latest'
+
+# Phases compared against a baseline; everything else in a run is context.
+reportedPhases = (
+    'importMainMs',
+    'loadPrinterApiKeysMs',
+    'getClientsMs',
+    'firstControlGetMs',
+    'firstUploadMs',
+    'firstFetchMs',
+    'warmControlGetMs',
+    'warmUploadMs',
+    'warmFetchMs',
+    'spawnToFirstControlGetMs',
+    'spawnToFirstUploadMs',
+    'spawnToFirstFetchMs',
+)
+
+
+def _elapsedMilliseconds(startTime: float) -> float:
+    return round((time.perf_counter() - startTime) * 1000.0, 3)
+
+
+def _millisecondsSince(wallClockStart: float) -> float:
+    return round((time.time() - wallClockStart) * 1000.0, 3)
+
+
+def _seedPendingCommand(firestoreClient, collectionName: str) -> None:
+    firestoreClient.collection(collectionName).document(uuid.uuid4().hex).set(
+        {
+            'commandId': uuid.uuid4().hex,
+            'recipientId': benchmarkRecipientId,
+            'printerSerial': benchmarkPrinterSerial,
+            'commandType': 'pause',
+            'status': 'pending',
+        }
+    )
+
+
+def _timeRequest(measurements: Dict[str, object], phaseName: str, sendRequest, spawnWallClock: Optional[float]):
+    startTime = time.perf_counter()
+    response = sendRequest()
+    measurements[phaseName] = _elapsedMilliseconds(startTime)
+    if response.status_code != 200:
+        raise RuntimeError(
+            f'{phaseName} returned HTTP {response.status_code}: {response.get_data(as_text=True)[:500]}'
+        )
+    if spawnWallClock is not None:
+        spawnPhaseName = 'spawnTo' + phaseName[0].upper() + phaseName[1:]
+        measurements[spawnPhaseName] = _millisecondsSince(spawnWallClock)
+    return response.get_json()
+
+
+def runChild(spawnWallClock: float, rpcLatencyMs: float, gcodeSizeBytes: int) -> Dict[str, object]:
+    sys.path.insert(0, str(repositoryRoot))
+    sys.path.insert(0, str(benchmarkDirectory))
+    measurements: Dict[str, object] = {'interpreterStartMs': _millisecondsSince(spawnWallClock)}
+
+    importStartTime = time.perf_counter()
+    import main  # pylint: disable=import-outside-toplevel
+    measurements['importMainMs'] = _elapsedMilliseconds(importStartTime)
+    measurements['importTiming'] = main.getImportTimingReport()
+
+    import gcp_fakes  # pylint: disable=import-outside-toplevel
+
+    fakes = gcp_fakes.installFakeGoogleCloud(
+        main, rpcLatencyMs=rpcLatencyMs, secretPayload=benchmarkApiKey
+    )
+    gcp_fakes.installFakeDownloads(main, b'G1 X0 Y0\n' * max(1, gcodeSizeBytes // 9), fakes.clock)
+
+    # Time the Secret Manager path, which is the one production uses.
+    os.environ.pop('API_KEYS_PRINTER_STATUS', None)
+    os.environ['SECRET_MANAGER_API_KEYS_PATH'] = benchmarkSecretPath
+    loadStartTime = time.perf_counter()
+    main.validPrinterApiKeys = main.loadPrinterApiKeys()
+    measurements['loadPrinterApiKeysMs'] = _elapsedMilliseconds(loadStartTime)
+
+    clientsStartTime = time.perf_counter()
+    main.getClients()
+    measurements['getClientsMs'] = _elapsedMilliseconds(clientsStartTime)
+
+    _seedPendingCommand(fakes.firestoreClient, main.firestoreCollectionPrinterCommands)
+    _seedPendingCommand(fakes.firestoreClient, main.firestoreCollectionPrinterCommands)
+
+    testClient = main.app.test_client()
+    controlQuery = {'recipientId': benchmarkRecipientId, 'printerSerial': benchmarkPrinterSerial}
+    apiKeyHeaders = {'X-API-Key': benchmarkApiKey}
+
+    def sendControlGet():
+        return testClient.get('/control', query_string=controlQuery, headers=apiKeyHeaders)
+
+    def sendUpload():
+        return testClient.post(
+            '/upload',
+            json={
+                'recipientId': benchmarkRecipientId,
+                'productId': str(uuid.uuid4()),
+                'gcodeUrl': 'https://example.invalid/benchmark.gcode',
+                'originalFilename': 'benchmark.gcode',
+                'encrypted_data_payload': {'accessCode': '12345678'},
+                'unencrypted_data': {'printerSerial': benchmarkPrinterSerial},
+            },
+            headers=apiKeyHeaders,
+        )
+
+    firstControlPayload = _timeRequest(measurements, 'firstControlGetMs', sendControlGet, spawnWallClock)
+    firstUploadPayload = _timeRequest(measurements, 'firstUploadMs', sendUpload, spawnWallClock)
+    _timeRequest(
+        measurements,
+        'firstFetchMs',
+        lambda: testClient.get(f"/fetch/{firstUploadPayload['fetchToken']}", headers=apiKeyHeaders),
+        spawnWallClock,
+    )
+
+    _timeRequest(measurements, 'warmControlGetMs', sendControlGet, None)
+    warmUploadPayload = _timeRequest(measurements, 'warmUploadMs', sendUpload, None)
+    _timeRequest(
+        measurements,
+        'warmFetchMs',
+        lambda: testClient.get(f"/fetch/{warmUploadPayload['fetchToken']}", headers=apiKeyHeaders),
+        None,
+    )
+
+    measurements['claimedCommands'] = len(firstControlPayload.get('commands', []))
+    measurements['fakeRpcCount'] = fakes.clock.rpcCount
+    return measurements
+
+
+def runColdStart(
+    rpcLatencyMs: float, gcodeSizeBytes: int, timeoutSeconds: float, encryptionMode: str
+) -> Dict[str, object]:
+    childEnvironment = {**os.environ, **benchmarkEnvironment, 'ENCRYPTION_MODE': encryptionMode}
+    childEnvironment.pop('SECRET_MANAGER_API_KEYS_PATH', None)
+    childEnvironment.pop('SECRET_MANAGER_API_KEYS', None)
+    spawnWallClock = time.time()
+    completedProcess = subprocess.run(
+        [
+            sys.executable,
+            str(Path(__file__).resolve()),
+            '--child',
+            '--spawn-wall-clock',
+            repr(spawnWallClock),
+            '--rpc-latency-ms',
+            str(rpcLatencyMs),
+            '--gcode-size-bytes',
+            str(gcodeSizeBytes),
+        ],
+        cwd=str(repositoryRoot),
+        env=childEnvironment,
+        capture_output=True,
+        text=True,
+        timeout=timeoutSeconds,
+        check=False,
+    )
+    if completedProcess.returncode != 0:
+        raise RuntimeError(
+            f'Cold-start run failed with exit code {completedProcess.returncode}:\n'
+            f'{completedProcess.stderr[-4000:]}'
+        )
+    resultLines = [line for line in completedProcess.stdout.splitlines() if line.strip()]
+    measurements = json.loads(resultLines[-1])
+    measurements['processTotalMs'] = _millisecondsSince(spawnWallClock)
+    return measurements
+
+
+def summarizeRuns(runs: List[Dict[str, object]]) -> Dict[str, Dict[str, float]]:
+    summary: Dict[str, Dict[str, float]] = {}
+    for phaseName in reportedPhases + ('interpreterStartMs', 'processTotalMs'):
+        samples = [run[phaseName] for run in runs if isinstance(run.get(phaseName), (int, float))]
+        if not samples:
+            continue
+        summary[phaseName] = {
+            'min': round(min(samples), 3),
+            'median': round(statistics.median(samples), 3),
+            'max': round(max(samples), 3),
+        }
+    return summary
+
+
+def compareWithBaseline(
+    summary: Dict[str, Dict[str, float]],
+    baselineSummary: Dict[str, Dict[str, float]],
+    maxRegressionPct: float,
+    minRegressionMs: float,
+) -> List[Dict[str, object]]:
+    regressions = []
+    for phaseName in reportedPhases:
+        if phaseName not in summary or phaseName not in baselineSummary:
+            continue
+        currentMedian = summary[phaseName]['median']
+        baselineMedian = baselineSummary[phaseName]['median']
+        # Sub-millisecond phases are noise-dominated; ignore tiny absolute deltas.
+        if currentMedian - baselineMedian < minRegressionMs:
+            continue
+        if baselineMedian <= 0 or (currentMedian - baselineMedian) / baselineMedian * 100.0 > maxRegressionPct:
+            regressions.append(
+                {
+                    'phase': phaseName,
+                    'baselineMedianMs': baselineMedian,
+                    'currentMedianMs': currentMedian,
+                }
+            )
+    return regressions
+
+
+def parseArguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='number of fresh-process runs')
+    parser.add_argument('--rpc-latency-ms', type=float, default=0.0, help='simulated latency per fake GCP RPC')
+    parser.add_argument('--gcode-size-bytes', type=int, default=256 * 1024, help='size of the fake G-code download')
+    parser.add_argument('--encryption-mode', choices=('kms', 'envelope'), default='kms')
+    parser.add_argument('--timeout-seconds', type=float, default=120.0, help='timeout for a single run')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='earlier report to compare phase medians against')
+    parser.add_argument('--max-regression-pct', type=float, default=25.0)
+    parser.add_argument('--min-regression-ms', type=float, default=5.0)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--spawn-wall-clock', type=float, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arguments = parseArguments(argv)
+
+    if arguments.child:
+        spawnWallClock = arguments.spawn_wall_clock or time.time()
+        measurements = runChild(spawnWallClock, arguments.rpc_latency_ms, arguments.gcode_size_bytes)
+        sys.stdout.write(json.dumps(measurements, default=str) + '\n')
+        return 0
+
+    runs = [
+        runColdStart(
+            arguments.rpc_latency_ms,
+            arguments.gcode_size_bytes,
+            arguments.timeout_seconds,
+            arguments.encryption_mode,
+        )
+        for _ in range(max(1, arguments.runs))
+    ]
+    report: Dict[str, object] = {
+        'benchmark': 'cold_start',
+        'generatedAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'runs': len(runs),
+            'rpcLatencyMs': arguments.rpc_latency_ms,
+            'gcodeSizeBytes': arguments.gcode_size_bytes,
+            'encryptionMode': arguments.encryption_mode,
+        },
+        'summary': summarizeRuns(runs),
+        'runs': runs,
+    }
+
+    exitCode = 0
+    if arguments.baseline:
+        baselineReport = json.loads(Path(arguments.baseline).read_text(encoding='utf-8'))
+        regressions = compareWithBaseline(
+            report['summary'],
+            baselineReport.get('summary', {}),
+            arguments.max_regression_pct,
+            arguments.min_regression_ms,
+        )
+        report['baseline'] = {
+            'path': arguments.baseline,
+            'maxRegressionPct': arguments.max_regression_pct,
+            'regressions': regressions,
+        }
+        if regressions:
+            exitCode = 1
+
+    reportText = json.dumps(report, indent=2, default=str)
+    if arguments.output:
+        Path(arguments.output).write_text(reportText + '\n', encoding='utf-8')
+    else:
+        sys.stdout.write(reportText + '\n')
+
+    for regression in report.get('baseline', {}).get('regressions', []):
+        sys.stderr.write(
+            'Cold-start regression in {phase}: {baselineMedianMs} ms -> {currentMedianMs} ms\n'.format(**regression)
+        )
+    return exitCode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
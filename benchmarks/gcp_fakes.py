@@ -0,0 +1,578 @@
+"""In-process stand-ins for the Google Cloud clients used by ``main``.
+
+The fakes implement only the calls the API makes. Every simulated RPC sleeps
+for ``rpcLatencyMs``, so benchmarks can model network round trips without
+touching GCP. ``installFakeGoogleCloud(main)`` swaps them onto an already
+imported ``main`` module.
+"""
+
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
+from google.cloud.firestore_v1.transforms import Increment
+
+
+class FakeRpcClock:
+    def __init__(self, rpcLatencyMs: float = 0.0):
+        self.rpcLatencyMs = rpcLatencyMs
+        self.rpcCount = 0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            self.rpcCount += 1
+        if self.rpcLatencyMs > 0:
+            time.sleep(self.rpcLatencyMs / 1000.0)
+
+
+class ModuleOverride:
+    """Module proxy that replaces selected attributes and forwards the rest."""
+
+    def __init__(self, module, **overrides):
+        self._module = module
+        self._overrides = overrides
+
+    def __getattr__(self, attributeName: str):
+        if attributeName in self._overrides:
+            return self._overrides[attributeName]
+        return getattr(self._module, attributeName)
+
+    def isAvailable(self) -> bool:
+        return True
+
+
+class FakeCredentials:
+    service_account_email = 'benchmark@example.iam.gserviceaccount.com'
+    token = 'benchmark-access-token'
+
+    def sign_bytes(self, message: bytes) -> bytes:  # pylint: disable=invalid-name
+        return b'signature-' + message[:8]
+
+    def refresh(self, _request) -> None:
+        return None
+
+    def with_scopes_if_required(self, _scopes):  # pylint: disable=invalid-name
+        return self
+
+
+class FakeBlob:
+    def __init__(self, bucket: 'FakeBucket', name: str):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_file(self, fileObject, **_kwargs) -> None:  # pylint: disable=invalid-name
+        self.bucket.clock.wait()
+        self.bucket.objects[self.name] = fileObject.read()
+
+    def upload_from_string(self, data, **_kwargs) -> None:  # pylint: disable=invalid-name
+        self.bucket.clock.wait()
+        self.bucket.objects[self.name] = data if isinstance(data, bytes) else str(data).encode('utf-8')
+
+    def exists(self) -> bool:
+        self.bucket.clock.wait()
+        return self.name in self.bucket.objects
+
+    @property
+    def size(self) -> Optional[int]:
+        storedBytes = self.bucket.objects.get(self.name)
+        return len(storedBytes) if storedBytes is not None else None
+
+    @property
+    def crc32c(self) -> Optional[str]:
+        return None
+
+    def rewrite(self, source: 'FakeBlob', token=None):  # pylint: disable=unused-argument
+        self.bucket.clock.wait()
+        self.bucket.objects[self.name] = source.bucket.objects[source.name]
+        return None, source.size, source.size
+
+    def generate_signed_url(self, **_kwargs) -> str:  # pylint: disable=invalid-name
+        return f'https://storage.googleapis.com/{self.bucket.name}/{self.name}?X-Goog-Signature=benchmark'
+
+
+class FakeBucket:
+    def __init__(self, name: str, objects: Dict[str, bytes], clock: FakeRpcClock):
+        self.name = name
+        self.objects = objects
+        self.clock = clock
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def get_blob(self, name: str) -> Optional[FakeBlob]:  # pylint: disable=invalid-name
+        self.clock.wait()
+        return FakeBlob(self, name) if name in self.objects else None
+
+    def delete_blob(self, name: str) -> None:  # pylint: disable=invalid-name
+        self.objects.pop(name, None)
+
+
+class FakeStorageClient:
+    def __init__(self, clock: FakeRpcClock, project: Optional[str] = None, credentials=None):
+        self.project = project
+        self._credentials = credentials or FakeCredentials()
+        self.clock = clock
+        self.buckets: Dict[str, Dict[str, bytes]] = {}
+
+    def bucket(self, name: str) -> FakeBucket:
+        return FakeBucket(name, self.buckets.setdefault(name, {}), self.clock)
+
+    @contextmanager
+    def batch(self, raise_exception: bool = True):  # pylint: disable=unused-argument
+        yield self
+        self.clock.wait()
+
+
+class FakeKmsClient:
+    def __init__(self, clock: FakeRpcClock, credentials=None):
+        self.credentials = credentials
+        self.clock = clock
+
+    @staticmethod
+    def crypto_key_path(project: str, location: str, keyRing: str, keyName: str) -> str:  # pylint: disable=invalid-name
+        return f'projects/{project}/locations/{location}/keyRings/{keyRing}/cryptoKeys/{keyName}'
+
+    def encrypt(self, request=None, **kwargs):
+        self.clock.wait()
+        plaintext = (request or kwargs).get('plaintext', b'')
+        return SimpleNamespace(ciphertext=b'kms:' + plaintext)
+
+    def decrypt(self, request=None, **kwargs):
+        self.clock.wait()
+        ciphertext = (request or kwargs).get('ciphertext', b'')
+        return SimpleNamespace(plaintext=ciphertext[len(b'kms:'):])
+
+
+class FakeSecretManagerClient:
+    def __init__(self, clock: FakeRpcClock, secretPayload: str):
+        self.clock = clock
+        self.secretPayload = secretPayload
+
+    def access_secret_version(self, name: str = None, **_kwargs):  # pylint: disable=invalid-name
+        self.clock.wait()
+        return SimpleNamespace(payload=SimpleNamespace(data=self.secretPayload.encode('utf-8')))
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference: 'FakeDocumentReference', data: Optional[dict]):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = dict(data) if data is not None else None
+        self.create_time = None
+        self.update_time = reference.collection.database.updateTimes.get((reference.collection.name, reference.id))
+
+    def to_dict(self) -> Optional[dict]:
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocumentReference:
+    def __init__(self, collection: 'FakeCollection', documentId: str):
+        self.collection = collection
+        self.id = documentId
+
+    def get(self, transaction=None, **_kwargs):  # pylint: disable=unused-argument
+        self.collection.database.clock.wait()
+        return FakeDocumentSnapshot(self, self.collection.documents.get(self.id))
+
+    def set(self, data: dict, merge: bool = False) -> None:
+        self.collection.database.clock.wait()
+        self.collection.database.applyWrite(self, data, merge=merge)
+
+    def create(self, data: dict) -> None:
+        self.collection.database.clock.wait()
+        with self.collection.database.commitLock:
+            if self.id in self.collection.documents:
+                raise AlreadyExists(f'{self.collection.name}/{self.id} already exists')
+            self.collection.database.applyWrite(self, data, merge=False)
+
+    def update(self, data: dict, option=None) -> None:
+        self.collection.database.clock.wait()
+        with self.collection.database.commitLock:
+            self.collection.database.checkPrecondition(self, option)
+            self.collection.database.applyWrite(self, data, merge=True)
+
+    def delete(self) -> None:
+        self.collection.database.clock.wait()
+        self.collection.database.applyDelete(self)
+
+
+class FakeQuery:
+    def __init__(self, collection: 'FakeCollection', filters=(), limitSize: Optional[int] = None, orderBy=None):
+        self.collection = collection
+        self.filters = tuple(filters)
+        self.limitSize = limitSize
+        self.orderBy = orderBy
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):  # pylint: disable=redefined-builtin
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return FakeQuery(self.collection, self.filters + ((field_path, op_string, value),), self.limitSize, self.orderBy)
+
+    def order_by(self, field_path, direction=None):
+        return FakeQuery(self.collection, self.filters, self.limitSize, (field_path, direction))
+
+    def limit(self, count: int):
+        return FakeQuery(self.collection, self.filters, count, self.orderBy)
+
+    def select(self, field_paths):  # pylint: disable=unused-argument
+        # Projections only save bandwidth; the fake returns whole documents.
+        return self
+
+    @staticmethod
+    def _matches(data: dict, fieldPath: str, operator: str, value) -> bool:
+        fieldValue = data.get(fieldPath)
+        # FieldFilter turns "== None" into the unary IS_NULL operator enum.
+        operatorName = getattr(operator, 'name', None)
+        if operatorName == 'IS_NULL':
+            return fieldValue is None
+        if operatorName == 'IS_NOT_NULL':
+            return fieldValue is not None
+        if operator == '==':
+            return fieldValue == value
+        if operator == 'in':
+            return fieldValue in value
+        if fieldValue is None:
+            return False
+        if operator == '>=':
+            return fieldValue >= value
+        if operator == '<=':
+            return fieldValue <= value
+        if operator == '<':
+            return fieldValue < value
+        if operator == '>':
+            return fieldValue > value
+        raise NotImplementedError(f'Operator {operator} is not supported by the fake Firestore client')
+
+    def matchesDocument(self, data: Optional[dict]) -> bool:
+        return data is not None and all(self._matches(data, *queryFilter) for queryFilter in self.filters)
+
+    def on_snapshot(self, callback):  # pylint: disable=invalid-name
+        return FakeWatch(self, callback)
+
+    def stream(self, transaction=None, **_kwargs):  # pylint: disable=unused-argument
+        self.collection.database.clock.wait()
+        matches = [
+            FakeDocumentSnapshot(self.collection.document(documentId), data)
+            for documentId, data in list(self.collection.documents.items())
+            if self.matchesDocument(data)
+        ]
+        if self.orderBy is not None:
+            fieldPath, direction = self.orderBy
+            matches.sort(
+                key=lambda snapshot: (snapshot.to_dict().get(fieldPath) is not None, snapshot.to_dict().get(fieldPath)),
+                reverse=str(direction).upper().endswith('DESCENDING'),
+            )
+        if self.limitSize is not None:
+            matches = matches[:self.limitSize]
+        return iter(matches)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class FakeWatch:
+    """Snapshot listener delivering query changes on its own thread, like Firestore's watch."""
+
+    def __init__(self, query: FakeQuery, callback):
+        self.query = query
+        self.callback = callback
+        self.is_active = True
+        self._pending: 'queue.Queue' = queue.Queue()
+        self._thread = threading.Thread(target=self._deliver, name='fake-firestore-watch', daemon=True)
+        database = query.collection.database
+        with database.commitLock:
+            initialChanges = [
+                SimpleNamespace(type=SimpleNamespace(name='ADDED'), document=snapshot)
+                for snapshot in query.stream()
+            ]
+            database.watches.append(self)
+        self._pending.put(initialChanges)
+        self._thread.start()
+
+    def documentChanged(self, reference: 'FakeDocumentReference', oldData: Optional[dict], newData: Optional[dict]):
+        if reference.collection.name != self.query.collection.name:
+            return
+        wasMatch = self.query.matchesDocument(oldData)
+        isMatch = self.query.matchesDocument(newData)
+        if isMatch:
+            changeType = 'MODIFIED' if wasMatch else 'ADDED'
+        elif wasMatch:
+            changeType = 'REMOVED'
+        else:
+            return
+        snapshot = FakeDocumentSnapshot(reference, newData if isMatch else oldData)
+        self._pending.put([SimpleNamespace(type=SimpleNamespace(name=changeType), document=snapshot)])
+
+    def _deliver(self) -> None:
+        while True:
+            changes = self._pending.get()
+            if changes is None:
+                return
+            self.callback([], changes, datetime.now(timezone.utc))
+
+    def unsubscribe(self) -> None:
+        self.is_active = False
+        database = self.query.collection.database
+        with database.commitLock:
+            if self in database.watches:
+                database.watches.remove(self)
+        self._pending.put(None)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, database: 'FakeFirestoreClient', name: str):
+        self.database = database
+        self.name = name
+        self.documents: Dict[str, dict] = database.collections.setdefault(name, {})
+        super().__init__(self)
+
+    def document(self, documentId: Optional[str] = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self, documentId or uuid.uuid4().hex)
+
+    def add(self, data: dict):
+        reference = self.document()
+        reference.set(data)
+        return datetime.now(timezone.utc), reference
+
+
+class FakeTransaction:
+    """Implements the private hooks ``firestore.transactional`` drives."""
+
+    _max_attempts = 1
+    _read_only = False
+
+    def __init__(self, database: 'FakeFirestoreClient'):
+        self.database = database
+        self._id = None
+        self._writes = []
+
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None) -> None:  # pylint: disable=unused-argument
+        self.database.clock.wait()
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self):
+        self.database.clock.wait()
+        for reference, data in self._writes:
+            self.database.applyWrite(reference, data, merge=True)
+        self._clean_up()
+        return []
+
+    def _rollback(self) -> None:
+        self._clean_up()
+
+    def get(self, reference: FakeDocumentReference):
+        return reference.get(transaction=self)
+
+    def update(self, reference: FakeDocumentReference, data: dict) -> None:
+        self._writes.append((reference, data))
+
+    def set(self, reference: FakeDocumentReference, data: dict, merge: bool = False) -> None:
+        self._writes.append((reference, data if merge else {**data}))
+
+
+class FakeWriteBatch:
+    def __init__(self, database: 'FakeFirestoreClient'):
+        self.database = database
+        self._writes = []
+
+    def set(self, reference: FakeDocumentReference, data: dict, merge: bool = False) -> None:
+        self._writes.append((reference, data, merge, None))
+
+    def update(self, reference: FakeDocumentReference, data: dict, option=None) -> None:
+        self._writes.append((reference, data, True, option))
+
+    def delete(self, reference: FakeDocumentReference) -> None:
+        self._writes.append((reference, None, False, None))
+
+    def commit(self):
+        self.database.clock.wait()
+        # Preconditions are checked and writes applied under one lock, like a
+        # Firestore commit, so concurrent batches cannot interleave.
+        with self.database.commitLock:
+            for reference, _data, _merge, option in self._writes:
+                self.database.checkPrecondition(reference, option)
+            for reference, data, merge, _option in self._writes:
+                if data is None:
+                    self.database.applyDelete(reference)
+                else:
+                    self.database.applyWrite(reference, data, merge=merge)
+        self._writes = []
+        return []
+
+
+class FakeFirestoreClient:
+    def __init__(self, clock: FakeRpcClock, serverTimestamp, deleteField, project: Optional[str] = None, credentials=None):
+        self.project = project
+        self.credentials = credentials
+        self.clock = clock
+        self.serverTimestamp = serverTimestamp
+        self.deleteField = deleteField
+        self.collections: Dict[str, Dict[str, dict]] = {}
+        self.updateTimes: Dict[tuple, int] = {}
+        self.commitLock = threading.RLock()
+        self.watches = []
+        self._lock = threading.Lock()
+        self._writeSequence = 0
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def transaction(self, **_kwargs) -> FakeTransaction:
+        return FakeTransaction(self)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def get_all(self, references, **_kwargs):  # pylint: disable=invalid-name
+        # One batched read RPC, like the real client.
+        self.clock.wait()
+        return [FakeDocumentSnapshot(reference, reference.collection.documents.get(reference.id)) for reference in references]
+
+    @staticmethod
+    def write_option(**kwargs):  # pylint: disable=invalid-name
+        return SimpleNamespace(**kwargs)
+
+    def checkPrecondition(self, reference: FakeDocumentReference, option) -> None:
+        if option is None:
+            return
+        if getattr(option, 'last_update_time', None) != self.updateTimes.get((reference.collection.name, reference.id)):
+            raise FailedPrecondition(f'{reference.collection.name}/{reference.id} was modified')
+
+    def notifyWatches(self, reference: FakeDocumentReference, oldData: Optional[dict], newData: Optional[dict]):
+        for watch in list(self.watches):
+            watch.documentChanged(reference, oldData, newData)
+
+    def applyDelete(self, reference: FakeDocumentReference) -> None:
+        with self._lock:
+            oldData = reference.collection.documents.pop(reference.id, None)
+            self.updateTimes.pop((reference.collection.name, reference.id), None)
+        self.notifyWatches(reference, oldData, None)
+
+    def applyWrite(self, reference: FakeDocumentReference, data: dict, merge: bool) -> None:
+        with self._lock:
+            documents = reference.collection.documents
+            oldData = documents.get(reference.id)
+            storedData = dict(oldData or {}) if merge else {}
+            for fieldName, fieldValue in data.items():
+                if fieldValue is self.deleteField:
+                    storedData.pop(fieldName, None)
+                elif fieldValue is self.serverTimestamp:
+                    storedData[fieldName] = datetime.now(timezone.utc)
+                elif isinstance(fieldValue, Increment):
+                    storedData[fieldName] = storedData.get(fieldName, 0) + fieldValue.value
+                else:
+                    storedData[fieldName] = fieldValue
+            documents[reference.id] = storedData
+            # A write sequence number stands in for the server's update_time.
+            self._writeSequence += 1
+            self.updateTimes[(reference.collection.name, reference.id)] = self._writeSequence
+        self.notifyWatches(reference, oldData, dict(storedData))
+
+
+def _loadRealModule(module) -> None:
+    loadModule = getattr(module, 'load', None)
+    if callable(loadModule):
+        loadModule()
+
+
+class FakeDownloadResponse:
+    def __init__(self, content: bytes):
+        self.content = content
+        self.status_code = 200
+        self.headers = {'Content-Length': str(len(content))}
+
+    def raise_for_status(self) -> None:
+        return None
+
+    def iter_content(self, chunk_size: int = 65536):  # pylint: disable=invalid-name
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset:offset + chunk_size]
+
+    def close(self) -> None:
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_excInfo):
+        self.close()
+
+
+def installFakeDownloads(mainModule, content: bytes, clock: Optional[FakeRpcClock] = None) -> None:
+    """Serve every outbound G-code download from memory."""
+    downloadClock = clock or FakeRpcClock()
+
+    def fakeGet(url, **_kwargs):  # pylint: disable=unused-argument
+        downloadClock.wait()
+        return FakeDownloadResponse(content)
+
+    fakeSession = SimpleNamespace(get=fakeGet)
+    mainModule.getDownloadSession = lambda: fakeSession
+
+
+def installFakeGoogleCloud(mainModule, rpcLatencyMs: float = 0.0, secretPayload: str = '') -> SimpleNamespace:
+    """Point ``main`` at in-memory GCP clients that share one RPC clock.
+
+    Call before ``main.getClients()``. Returns the clock and the client
+    instances so callers can seed data or count RPCs.
+    """
+    clock = FakeRpcClock(rpcLatencyMs)
+    credentials = FakeCredentials()
+    storageClient = FakeStorageClient(clock, credentials=credentials)
+    firestoreClient = FakeFirestoreClient(
+        clock,
+        serverTimestamp=mainModule.firestore.SERVER_TIMESTAMP,
+        deleteField=mainModule.DELETE_FIELD,
+    )
+    kmsClient = FakeKmsClient(clock, credentials=credentials)
+    originalStorage = mainModule.storage
+    originalKms = mainModule.kms_v1
+    originalSecretManager = mainModule.secretmanager
+
+    # The real SDKs are still imported on first use so lazy-import cost stays
+    # in the measurement; only the network-facing clients are replaced.
+    def buildStorageClient(project=None, credentials=None, **_kwargs):
+        _loadRealModule(originalStorage)
+        storageClient.project = project
+        return storageClient
+
+    def buildFirestoreClient(project=None, credentials=None, **_kwargs):
+        firestoreClient.project = project
+        return firestoreClient
+
+    def buildKmsClient(credentials=None, **_kwargs):
+        _loadRealModule(originalKms)
+        return kmsClient
+
+    def buildSecretManagerClient(**_kwargs):
+        _loadRealModule(originalSecretManager)
+        return FakeSecretManagerClient(clock, secretPayload)
+
+    mainModule.googleAuthDefault = lambda scopes=None: (credentials, None)
+    mainModule.storage = ModuleOverride(mainModule.storage, Client=buildStorageClient)
+    mainModule.firestore = ModuleOverride(mainModule.firestore, Client=buildFirestoreClient)
+    mainModule.kms_v1 = ModuleOverride(mainModule.kms_v1, KeyManagementServiceClient=buildKmsClient)
+    mainModule.secretmanager = ModuleOverride(
+        originalSecretManager, SecretManagerServiceClient=buildSecretManagerClient
+    )
+    mainModule.cachedClients = None
+
+    return SimpleNamespace(
+        clock=clock,
+        credentials=credentials,
+        storageClient=storageClient,
+        firestoreClient=firestoreClient,
+        kmsClient=kmsClient,
+    )
@@ -0,0 +1,188 @@
+"""Contention benchmark for single-use fetch tokens.
+
+Uploads one file, then sends ``--parallel`` simultaneous ``GET /fetch/<token>``
+requests for its token, released together by a barrier, and repeats that for
+``--rounds`` fresh tokens. Exactly one request per round must succeed; the rest
+should get a fast 410 (or 404 once the winner has committed) without decrypting
+or signing anything.
+
+Google Cloud is replaced by the in-process fakes in ``gcp_fakes``, whose write
+batches enforce ``update_time`` preconditions the way Firestore does.
+
+Usage::
+
+    python benchmarks/token_contention.py --parallel 32 --rounds 5 --rpc-latency-ms 10
+
+The report is JSON. The process exits with status 1 if any round had more or
+fewer than one winner, or a request that neither won nor lost cleanly.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+benchmarkDirectory = Path(__file__).resolve().parent
+repositoryRoot = benchmarkDirectory.parent
+
+benchmarkEnvironment = {
+    'GCP_PROJECT_ID': 'benchmark-project',
+    'GCS_BUCKET_NAME': 'benchmark-bucket',
+    'KMS_KEY_RING': 'benchmark-ring',
+    'KMS_KEY_NAME': 'benchmark-key',
+    'KMS_LOCATION': 'europe-north1',
+    'API_KEYS_PRINTER_STATUS': 'benchmark-key',
+    # Every request shares one API key, so lift the per-key limits out of the way.
+    'RATE_LIMIT_DEFAULT': '1000000 per minute',
+    'RATE_LIMIT_UPLOAD': '1000000 per minute',
+    'RATE_LIMIT_FETCH': '1000000 per minute',
+}
+# A loser that arrives after the winner has committed finds the token gone (404)
+# instead of consumed (410); both are fast rejections.
+loserStatusCodes = (404, 410)
+benchmarkApiKey = 'benchmark-key'
+
+
+def _percentile(samples: List[float], percentile: float) -> Optional[float]:
+    if not samples:
+        return None
+    orderedSamples = sorted(samples)
+    index = min(len(orderedSamples) - 1, int(round(percentile / 100.0 * (len(orderedSamples) - 1))))
+    return round(orderedSamples[index], 3)
+
+
+def _latencySummary(samples: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        'count': len(samples),
+        'p50': _percentile(samples, 50),
+        'p95': _percentile(samples, 95),
+        'max': round(max(samples), 3) if samples else None,
+        'mean': round(statistics.mean(samples), 3) if samples else None,
+    }
+
+
+def runContention(parallel: int, rounds: int, rpcLatencyMs: float) -> Dict[str, object]:
+    os.environ.update(benchmarkEnvironment)
+    sys.path.insert(0, str(repositoryRoot))
+    sys.path.insert(0, str(benchmarkDirectory))
+    import main  # pylint: disable=import-outside-toplevel
+    import gcp_fakes  # pylint: disable=import-outside-toplevel
+
+    fakes = gcp_fakes.installFakeGoogleCloud(main, rpcLatencyMs=rpcLatencyMs, secretPayload=benchmarkApiKey)
+    gcp_fakes.installFakeDownloads(main, b'G1 X0 Y0\n' * 1024, fakes.clock)
+    main.validPrinterApiKeys = {benchmarkApiKey}
+    main.getClients()
+
+    apiKeyHeaders = {'X-API-Key': benchmarkApiKey}
+    uploadClient = main.app.test_client()
+    roundResults = []
+    winnerLatencies: List[float] = []
+    loserLatencies: List[float] = []
+
+    for _ in range(rounds):
+        uploadResponse = uploadClient.post(
+            '/upload',
+            json={
+                'recipientId': 'contention-recipient',
+                'productId': str(uuid.uuid4()),
+                'gcodeUrl': 'https://example.invalid/contention.gcode',
+                'originalFilename': 'contention.gcode',
+                'encrypted_data_payload': {'accessCode': '12345678'},
+            },
+            headers=apiKeyHeaders,
+        )
+        if uploadResponse.status_code != 200:
+            raise RuntimeError(f'Upload failed with HTTP {uploadResponse.status_code}')
+        fetchToken = uploadResponse.get_json()['fetchToken']
+
+        signedUrlsBefore = main.urlSigner.getMetrics()['signedUrls']
+        startBarrier = threading.Barrier(parallel)
+        outcomes: List[tuple] = []
+        outcomesLock = threading.Lock()
+
+        def fetchOnce():
+            testClient = main.app.test_client()
+            startBarrier.wait()
+            startTime = time.perf_counter()
+            response = testClient.get(f'/fetch/{fetchToken}', headers=apiKeyHeaders)
+            elapsedMs = (time.perf_counter() - startTime) * 1000.0
+            with outcomesLock:
+                outcomes.append((response.status_code, elapsedMs))
+
+        workers = [threading.Thread(target=fetchOnce) for _ in range(parallel)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        statusCounts = Counter(statusCode for statusCode, _ in outcomes)
+        winnerLatencies.extend(elapsedMs for statusCode, elapsedMs in outcomes if statusCode == 200)
+        loserLatencies.extend(elapsedMs for statusCode, elapsedMs in outcomes if statusCode in loserStatusCodes)
+        roundResults.append(
+            {
+                'statusCounts': {str(statusCode): count for statusCode, count in sorted(statusCounts.items())},
+                'winners': statusCounts.get(200, 0),
+                'losers': sum(statusCounts.get(statusCode, 0) for statusCode in loserStatusCodes),
+                'signedUrlsGenerated': main.urlSigner.getMetrics()['signedUrls'] - signedUrlsBefore,
+            }
+        )
+
+    return {
+        'rounds': roundResults,
+        'winnerLatencyMs': _latencySummary(winnerLatencies),
+        'loserLatencyMs': _latencySummary(loserLatencies),
+        'fakeRpcCount': fakes.clock.rpcCount,
+    }
+
+
+def parseArguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--parallel', type=int, default=32, help='simultaneous fetches of one token')
+    parser.add_argument('--rounds', type=int, default=5, help='number of tokens to contend on')
+    parser.add_argument('--rpc-latency-ms', type=float, default=5.0, help='simulated latency per fake GCP RPC')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arguments = parseArguments(argv)
+    results = runContention(max(2, arguments.parallel), max(1, arguments.rounds), arguments.rpc_latency_ms)
+    report = {
+        'benchmark': 'token_contention',
+        'generatedAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'parameters': {
+            'parallel': max(2, arguments.parallel),
+            'rounds': max(1, arguments.rounds),
+            'rpcLatencyMs': arguments.rpc_latency_ms,
+        },
+        **results,
+    }
+
+    reportText = json.dumps(report, indent=2)
+    if arguments.output:
+        Path(arguments.output).write_text(reportText + '\n', encoding='utf-8')
+    else:
+        sys.stdout.write(reportText + '\n')
+
+    parallel = report['parameters']['parallel']
+    badRounds = [
+        roundResult for roundResult in report['rounds']
+        if roundResult['winners'] != 1 or roundResult['winners'] + roundResult['losers'] != parallel
+    ]
+    for roundResult in badRounds:
+        sys.stderr.write(
+            f"Token contention round had {roundResult['winners']} winners and "
+            f"{roundResult['losers']} losers: {roundResult['statusCounts']}\n"
+        )
+    return 1 if badRounds else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
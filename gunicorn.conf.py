@@ -0,0 +1,66 @@
+"""Gunicorn configuration for running the Cloud Printer API in production.
+
+Each worker process warms its own Google Cloud client bundle in the
+background right after it boots, so gRPC channels are never shared across a
+fork. Point the Cloud Run startup probe at ``/readyz`` to hold traffic until
+the clients are warm. Cloud Run sends
+SIGTERM and waits ten seconds before SIGKILL; gunicorn stops accepting new
+connections on SIGTERM and lets in-flight requests finish within
+``graceful_timeout``.
+"""
+
+import logging
+import os
+
+
+def _readPositiveInt(variableName: str, defaultValue: int) -> int:
+    rawValue = os.environ.get(variableName)
+    if not rawValue:
+        return defaultValue
+    try:
+        parsedValue = int(rawValue)
+    except ValueError:
+        logging.warning('Ignoring invalid %s value: %s', variableName, rawValue)
+        return defaultValue
+    return parsedValue if parsedValue > 0 else defaultValue
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# SERVER_MODE=asgi serves asgi:app on uvicorn workers, which run /control and
+# the printer status routes on the async Firestore client and forward the rest
+# to the Flask app.
+serverMode = os.environ.get('SERVER_MODE', 'wsgi').strip().lower()
+if serverMode == 'asgi':
+    wsgi_app = 'asgi:app'
+    defaultWorkerClass = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'main:app'
+    # gthread gives every worker a thread pool, so one slow /upload download
+    # does not block /control polling. Use "sync" for a plain pre-fork server.
+    defaultWorkerClass = 'gthread'
+
+worker_class = os.environ.get('SERVER_WORKER_CLASS', defaultWorkerClass)
+workers = _readPositiveInt('SERVER_WORKERS', _readPositiveInt('WEB_CONCURRENCY', 1))
+threads = _readPositiveInt('SERVER_THREADS', 8)
+
+# Cloud Run enforces the request timeout itself; 0 disables the worker timeout.
+timeout = int(os.environ.get('SERVER_TIMEOUT_SECONDS', '0'))
+graceful_timeout = _readPositiveInt('SERVER_GRACEFUL_TIMEOUT_SECONDS', 8)
+keepalive = _readPositiveInt('SERVER_KEEPALIVE_SECONDS', 5)
+
+accesslog = os.environ.get('SERVER_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('SERVER_LOG_LEVEL', 'info')
+
+
+def post_worker_init(worker):
+    import main  # pylint: disable=import-outside-toplevel
+
+    worker.log.info('Warming Google Cloud clients in worker %s', worker.pid)
+    main.startClientWarmup()
+    main.printerApiKeyStore.start()
+
+
+def worker_exit(server, worker):  # pylint: disable=unused-argument
+    worker.log.info('Worker %s exited after draining in-flight requests.', worker.pid)
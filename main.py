@@ -1,90 +1,178 @@
-import io
+import base64
+import hashlib
+import hmac
+import importlib
 import json
 import logging
+import math
 import os
+import queue
+import random
 import re
 import secrets
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Optional, Set, Tuple
-from urllib.parse import urlparse
-
-import requests
-
-from flask import Flask, jsonify, request
-try:  # pragma: no cover - optional dependency handling
-    from flask_limiter import Limiter
-    from flask_limiter.util import get_remote_address
-    RATE_LIMITER_AVAILABLE = True
-except ImportError:  # pragma: no cover - fallback when flask-limiter is unavailable
-    Limiter = None  # type: ignore[assignment,misc]
-    get_remote_address = None  # type: ignore[assignment]
-    RATE_LIMITER_AVAILABLE = False
-try:  # pragma: no cover - optional dependency handling
-    from google.api_core.exceptions import (
-        FailedPrecondition,
-        Forbidden,
-        GoogleAPICallError,
-        PermissionDenied,
-        Unauthorized,
-    )
-except ImportError:  # pragma: no cover - fallback when google-api-core is unavailable in tests
-    class FailedPrecondition(Exception):
-        """Fallback placeholder when google.api_core.exceptions is unavailable."""
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, quote, unquote, urlparse
+
+moduleImportStartTime = time.perf_counter()
+importTimingReportEnabled = os.environ.get('IMPORT_TIMING_REPORT', '').strip().lower() in {
+    '1',
+    'true',
+    'yes',
+    'on',
+}
+importTimings: List[Dict[str, object]] = []
 
 
-    class Forbidden(Exception):  # type: ignore[no-redef]
-        """Fallback placeholder when google.api_core.exceptions is unavailable."""
+@contextmanager
+def timedImport(moduleName: str, mode: str = 'eager'):
+    startTime = time.perf_counter()
+    try:
+        yield
+    finally:
+        importTimings.append(
+            {
+                'module': moduleName,
+                'mode': mode,
+                'ms': round((time.perf_counter() - startTime) * 1000.0, 2),
+            }
+        )
+
 
+with timedImport('requests'):
+    import requests
+
+with timedImport('flask'):
+    from flask import Flask, jsonify, request
+    from werkzeug.utils import secure_filename
+with timedImport('flask_limiter'):
+    try:  # pragma: no cover - optional dependency handling
+        from flask_limiter import Limiter
+        from flask_limiter.util import get_remote_address
+        RATE_LIMITER_AVAILABLE = True
+    except ImportError:  # pragma: no cover - fallback when flask-limiter is unavailable
+        Limiter = None  # type: ignore[assignment,misc]
+        get_remote_address = None  # type: ignore[assignment]
+        RATE_LIMITER_AVAILABLE = False
+with timedImport('google.api_core.exceptions'):
+    try:  # pragma: no cover - optional dependency handling
+        from google.api_core.exceptions import (
+            FailedPrecondition,
+            Forbidden,
+            GoogleAPICallError,
+            PermissionDenied,
+            Unauthorized,
+        )
+    except ImportError:  # pragma: no cover - fallback when google-api-core is unavailable in tests
+        class FailedPrecondition(Exception):
+            """Fallback placeholder when google.api_core.exceptions is unavailable."""
+
+
+        class Forbidden(Exception):  # type: ignore[no-redef]
+            """Fallback placeholder when google.api_core.exceptions is unavailable."""
+
+
+        class GoogleAPICallError(Exception):  # type: ignore[no-redef]
+            """Fallback placeholder when google.api_core.exceptions is unavailable."""
+
+
+        class PermissionDenied(Exception):  # type: ignore[no-redef]
+            """Fallback placeholder when google.api_core.exceptions is unavailable."""
+
+
+        class Unauthorized(Exception):  # type: ignore[no-redef]
+            """Fallback placeholder when google.api_core.exceptions is unavailable."""
+with timedImport('google.auth'):
+    try:  # pragma: no cover - optional dependency handling
+        from google.auth import default as googleAuthDefault
+    except (ImportError, AttributeError):  # pragma: no cover - fallback when google-auth is unavailable in tests
+        googleAuthDefault = None  # type: ignore[assignment]
+    try:  # pragma: no cover - optional dependency handling
+        from google.auth.exceptions import GoogleAuthError
+    except ImportError:  # pragma: no cover - fallback when google-auth is unavailable in tests
+        class GoogleAuthError(Exception):  # type: ignore[no-redef]
+            """Fallback placeholder when google.auth.exceptions is unavailable."""
+# Firestore backs almost every route, so it is the only Google Cloud SDK
+# imported eagerly. Storage, KMS, Secret Manager and the google-auth HTTP
+# transport load on first use through LazyModule below.
+with timedImport('google.cloud.firestore'):
+    from google.cloud import firestore
+    try:  # pragma: no cover - optional dependency handling
+        from google.cloud.firestore import transactional as firestoreTransactional
+    except ImportError:  # pragma: no cover - fallback for environments without firestore.transactional
+        try:
+            from google.cloud.firestore_v1 import transactional as firestoreTransactional
+        except ImportError:  # pragma: no cover - provide no-op decorator when transactional is unavailable
+            def firestoreTransactional(function):
+                return function
+    from google.cloud.firestore_v1 import DELETE_FIELD
+
+    try:  # pragma: no cover - optional dependency handling for FieldFilter import
+        from google.cloud.firestore_v1 import FieldFilter  # type: ignore[attr-defined]
+    except (ImportError, AttributeError):  # pragma: no cover - fallback when FieldFilter is unavailable
+        try:
+            from google.cloud.firestore_v1.base_query import FieldFilter  # type: ignore
+        except (ImportError, AttributeError):  # pragma: no cover - define minimal fallback for tests
+            @dataclass(frozen=True)
+            class FieldFilter:  # type: ignore[no-redef]
+                field_path: str
+                op_string: str
+                value: object
+
+
+class LazyModule:
+    """Module stand-in that imports the real module on first attribute access."""
+
+    def __init__(self, moduleName: str):
+        self._moduleName = moduleName
+        self._module = None
+        self._loadLock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._loadLock:
+                if self._module is None:
+                    with timedImport(self._moduleName, mode='lazy'):
+                        loadedModule = importlib.import_module(self._moduleName)
+                    if importTimingReportEnabled:
+                        logging.info(
+                            'Lazily imported %s in %.2f ms',
+                            self._moduleName,
+                            importTimings[-1]['ms'],
+                        )
+                    self._module = loadedModule
+        return self._module
 
-    class GoogleAPICallError(Exception):  # type: ignore[no-redef]
-        """Fallback placeholder when google.api_core.exceptions is unavailable."""
+    def isAvailable(self) -> bool:
+        try:
+            self.load()
+        except ImportError:
+            return False
+        return True
 
+    def __getattr__(self, attributeName: str):
+        return getattr(self.load(), attributeName)
 
-    class PermissionDenied(Exception):  # type: ignore[no-redef]
-        """Fallback placeholder when google.api_core.exceptions is unavailable."""
 
+storage = LazyModule('google.cloud.storage')
+kms_v1 = LazyModule('google.cloud.kms_v1')
+secretmanager = LazyModule('google.cloud.secretmanager')
+googleAuthTransportRequests = LazyModule('google.auth.transport.requests')
+cryptographyAead = LazyModule('cryptography.hazmat.primitives.ciphers.aead')
+cryptographyExceptions = LazyModule('cryptography.exceptions')
+# Only imported when MQTT_BROKER_URL is set.
+mqttClient = LazyModule('paho.mqtt.client')
 
-    class Unauthorized(Exception):  # type: ignore[no-redef]
-        """Fallback placeholder when google.api_core.exceptions is unavailable."""
-try:  # pragma: no cover - optional dependency handling
-    from google.auth import default as googleAuthDefault
-except (ImportError, AttributeError):  # pragma: no cover - fallback when google-auth is unavailable in tests
-    googleAuthDefault = None  # type: ignore[assignment]
-from google.auth.exceptions import GoogleAuthError
 
-try:  # pragma: no cover - optional dependency handling
-    from google.auth.transport.requests import Request
-except ImportError:  # pragma: no cover - fallback when google-auth is unavailable in tests
-    Request = None  # type: ignore[assignment]
-from google.cloud import firestore, kms_v1, storage
-try:  # pragma: no cover - optional dependency handling
-    from google.cloud.firestore import transactional as firestoreTransactional
-except ImportError:  # pragma: no cover - fallback for environments without firestore.transactional
-    try:
-        from google.cloud.firestore_v1 import transactional as firestoreTransactional
-    except ImportError:  # pragma: no cover - provide no-op decorator when transactional is unavailable
-        def firestoreTransactional(function):
-            return function
-try:  # pragma: no cover - optional dependency handling
-    from google.cloud import secretmanager
-except ImportError:  # pragma: no cover - fallback when secret manager is unavailable in tests
-    secretmanager = None  # type: ignore[assignment]
-from google.cloud.firestore_v1 import DELETE_FIELD
-
-try:  # pragma: no cover - optional dependency handling for FieldFilter import
-    from google.cloud.firestore_v1 import FieldFilter  # type: ignore[attr-defined]
-except (ImportError, AttributeError):  # pragma: no cover - fallback when FieldFilter is unavailable
-    try:
-        from google.cloud.firestore_v1.base_query import FieldFilter  # type: ignore
-    except (ImportError, AttributeError):  # pragma: no cover - define minimal fallback for tests
-        @dataclass(frozen=True)
-        class FieldFilter:  # type: ignore[no-redef]
-            field_path: str
-            op_string: str
-            value: object
-from werkzeug.utils import secure_filename
+def Request():  # pylint: disable=invalid-name
+    return googleAuthTransportRequests.Request()
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -124,12 +212,7 @@ if RATE_LIMITER_AVAILABLE and Limiter is not None:
                  remote_addr=get_remote_address(),
                  endpoint=request.endpoint,
                  method=request.method)
-        return makeJsonResponse({
-            'ok': False,
-            'error_type': 'RateLimitError',
-            'message': 'Rate limit exceeded. Please slow down your requests.',
-            'retry_after': getattr(e, 'retry_after', 60),
-        }, 429)
+        return makeRateLimitExceededResponse(getattr(e, 'retry_after', 60))
 
     logging.info('Rate limiter initialized with default limit: %s', RATE_LIMIT_DEFAULT)
 else:
@@ -156,6 +239,15 @@ def apply_rate_limit(limit_string: str):
     return noop_decorator
 
 
+def makeRateLimitExceededResponse(retryAfter: int = 60):
+    return makeJsonResponse({
+        'ok': False,
+        'error_type': 'RateLimitError',
+        'message': 'Rate limit exceeded. Please slow down your requests.',
+        'retry_after': retryAfter,
+    }, 429)
+
+
 def logEvent(event: str, level: str = 'INFO', **fields) -> None:
     record = {
         'event': event,
@@ -167,6 +259,25 @@ def logEvent(event: str, level: str = 'INFO', **fields) -> None:
     logMethod(serialized)
 
 
+# Components register a callable here; /debug/metrics returns all of them.
+metricsProviders: Dict[str, Callable[[], Dict[str, object]]] = {}
+
+
+def registerMetricsProvider(name: str, provider: Callable[[], Dict[str, object]]) -> None:
+    metricsProviders[name] = provider
+
+
+def collectMetrics() -> Dict[str, object]:
+    collectedMetrics: Dict[str, object] = {}
+    for name, provider in list(metricsProviders.items()):
+        try:
+            collectedMetrics[name] = provider()
+        except Exception as error:  # pylint: disable=broad-except
+            logging.exception('Failed to collect metrics from %s.', name)
+            collectedMetrics[name] = {'error': str(error)}
+    return collectedMetrics
+
+
 def extractFirestoreIndexUrl(errorMessage: str) -> Optional[str]:
     if not errorMessage:
         return None
@@ -212,6 +323,35 @@ allowedUploadMimeTypes = {
     'model/3mf',
 }
 readyToClaimStatuses: Set[str] = {'uploaded', 'queued', 'pending'}
+pendingFilesDefaultPageSize = int(os.environ.get('PENDING_FILES_DEFAULT_PAGE_SIZE', '100'))
+pendingFilesMaxPageSize = int(os.environ.get('PENDING_FILES_MAX_PAGE_SIZE', '500'))
+# GET /control?wait=<seconds> long-polls for up to this long.
+controlLongPollMaxSeconds = float(os.environ.get('CONTROL_LONG_POLL_MAX_SECONDS', '25'))
+controlWatchRetrySeconds = float(os.environ.get('CONTROL_WATCH_RETRY_SECONDS', '30'))
+# Under Flask every long-poll holds a server thread, so only this many may wait
+# at once per worker (default: a quarter of SERVER_THREADS); further polls are
+# answered at once. The ASGI route waits without a thread and is not capped.
+controlLongPollThreadWaiters = int(
+    os.environ.get('CONTROL_LONG_POLL_THREAD_WAITERS')
+    or max(1, int(os.environ.get('SERVER_THREADS') or '8') // 4)
+)
+# Optional MQTT notification of queued commands, e.g. mqtt://localhost:1883 or
+# mqtts://user@broker.example.com. Unset disables it; polling is unaffected.
+mqttBrokerUrl = os.environ.get('MQTT_BROKER_URL', '').strip()
+mqttTopicPrefix = os.environ.get('MQTT_TOPIC_PREFIX', 'printpro3d/recipients').strip().strip('/')
+mqttPassword = os.environ.get('MQTT_PASSWORD')
+mqttQos = int(os.environ.get('MQTT_QOS', '1'))
+mqttMaxQueuedMessages = int(os.environ.get('MQTT_MAX_QUEUED_MESSAGES', '1000'))
+# GET /api/recipients/<id>/status/stream (Server-Sent Events)
+statusStreamHeartbeatSeconds = float(os.environ.get('STATUS_STREAM_HEARTBEAT_SECONDS', '15'))
+statusStreamMaxSeconds = float(os.environ.get('STATUS_STREAM_MAX_SECONDS', '240'))
+# Under Flask every open stream holds a server thread for up to
+# STATUS_STREAM_MAX_SECONDS, so a worker serves at most this many (default: a
+# quarter of SERVER_THREADS) and answers 503 beyond that. ASGI is not capped.
+statusStreamThreadLimit = int(
+    os.environ.get('STATUS_STREAM_THREAD_LIMIT')
+    or max(1, int(os.environ.get('SERVER_THREADS') or '8') // 4)
+)
 
 
 firestoreCollectionFiles = os.environ.get('FIRESTORE_COLLECTION_FILES', 'files')
@@ -220,6 +360,32 @@ firestoreCollectionPrinterCommands = os.environ.get(
     'FIRESTORE_COLLECTION_PRINTER_COMMANDS',
     'printer_commands',
 )
+firestoreCollectionFetchTokens = os.environ.get('FIRESTORE_COLLECTION_FETCH_TOKENS', 'fetch_tokens')
+firestoreCollectionProducts = os.environ.get('FIRESTORE_COLLECTION_PRODUCTS', 'products')
+firestoreCollectionPollVersions = os.environ.get('FIRESTORE_COLLECTION_POLL_VERSIONS', 'poll_versions')
+# Firestore sustains about one write per second per document, and every status
+# post bumps its recipient's status version, so that version is spread over
+# this many shard documents that polls read together.
+statusPollVersionShards = max(1, int(os.environ.get('POLL_VERSION_STATUS_SHARDS', '8')))
+# Files uploaded before the token index existed are only reachable by query.
+fetchTokenQueryFallbackEnabled = os.environ.get('FETCH_TOKEN_QUERY_FALLBACK', 'true').strip().lower() in {
+    '1',
+    'true',
+    'yes',
+    'on',
+}
+# Comma-separated secrets; the first signs new fetch tokens and all of them verify.
+fetchTokenSigningKeys: List[bytes] = [
+    signingKey.strip().encode('utf-8')
+    for signingKey in os.environ.get('FETCH_TOKEN_SIGNING_KEYS', '').split(',')
+    if signingKey.strip()
+]
+fetchTokenAllowUnsigned = os.environ.get('FETCH_TOKEN_ALLOW_UNSIGNED', 'true').strip().lower() in {
+    '1',
+    'true',
+    'yes',
+    'on',
+}
 validPrinterApiKeys: Set[str] = set()
 port = int(os.environ.get('PORT', '8080'))
 fetchTokenTtlMinutes = int(os.environ.get('FETCH_TOKEN_TTL_MINUTES', '15'))
@@ -241,9 +407,9 @@ class ClientInitializationError(RuntimeError):
 
 @dataclass(frozen=True)
 class ClientBundle:
-    storageClient: storage.Client
+    storageClient: 'storage.Client'
     firestoreClient: firestore.Client
-    kmsClient: kms_v1.KeyManagementServiceClient
+    kmsClient: 'kms_v1.KeyManagementServiceClient'
     kmsKeyPath: str
     gcsBucketName: str
 
@@ -261,7 +427,24 @@ def parsePrinterApiKeyString(rawKeys: str) -> Set[str]:
     return sanitizedKeys
 
 
-def loadPrinterApiKeys(secretManagerClient=None) -> Set[str]:
+secretResourcePattern = r'^projects/[^/]+/secrets/[^/]+/versions/[^/]+$'
+
+
+def resolvePrinterApiKeySecretPath() -> Optional[str]:
+    """Return the Secret Manager version path when keys must be fetched remotely."""
+    if os.environ.get('API_KEYS_PRINTER_STATUS'):
+        return None
+    for candidateVariable in ('SECRET_MANAGER_API_KEYS_PATH', 'SECRET_MANAGER_API_KEYS'):
+        candidateValue = os.environ.get(candidateVariable)
+        if candidateValue:
+            secretPathCandidate = candidateValue.strip()
+            if re.fullmatch(secretResourcePattern, secretPathCandidate):
+                return secretPathCandidate
+            return None
+    return None
+
+
+def loadPrinterApiKeys(secretManagerClient=None, raiseOnError: bool = False) -> Set[str]:
     environmentValue = os.environ.get('API_KEYS_PRINTER_STATUS')
     if environmentValue:
         logging.info('Loaded printer API keys from API_KEYS_PRINTER_STATUS environment variable.')
@@ -284,7 +467,6 @@ def loadPrinterApiKeys(secretManagerClient=None) -> Set[str]:
         return set()
 
     secretPathCandidate = secretPath.strip()
-    secretResourcePattern = r'^projects/[^/]+/secrets/[^/]+/versions/[^/]+$'
     if not re.fullmatch(secretResourcePattern, secretPathCandidate):
         inlineKeys = parsePrinterApiKeyString(secretPath)
         if inlineKeys:
@@ -299,11 +481,13 @@ def loadPrinterApiKeys(secretManagerClient=None) -> Set[str]:
             )
         return inlineKeys
 
-    if secretmanager is None:
+    if not secretmanager.isAvailable():
         logging.error(
             'google.cloud.secretmanager is unavailable. Unable to load printer API keys from %s.',
             secretPathCandidate,
         )
+        if raiseOnError:
+            raise ImportError('google.cloud.secretmanager is unavailable')
         return set()
 
     try:
@@ -314,6 +498,8 @@ def loadPrinterApiKeys(secretManagerClient=None) -> Set[str]:
             logging.warning(
                 'Secret Manager secret %s did not contain any printer API keys.', secretPathCandidate
             )
+            if raiseOnError:
+                raise ValueError(f'Secret {secretPathCandidate} did not contain any printer API keys')
             return set()
 
         logging.info('Loaded printer API keys from Secret Manager path %s.', secretPathCandidate)
@@ -324,18 +510,153 @@ def loadPrinterApiKeys(secretManagerClient=None) -> Set[str]:
             secretPathCandidate,
             error,
         )
+        if raiseOnError:
+            raise
         return set()
 
 
-validPrinterApiKeys = loadPrinterApiKeys()
+printerApiKeyRefreshSeconds = int(os.environ.get('PRINTER_API_KEYS_REFRESH_SECONDS', '300'))
+printerApiKeyRetrySeconds = int(os.environ.get('PRINTER_API_KEYS_RETRY_SECONDS', '15'))
+printerApiKeyInitialWaitSeconds = float(os.environ.get('PRINTER_API_KEYS_INITIAL_WAIT_SECONDS', '5'))
+
+
+class PrinterApiKeyStore:
+    """Keeps printer API keys from Secret Manager fresh without blocking requests.
+
+    A background thread loads the secret, then reloads it every
+    ``refreshSeconds``. A failed refresh keeps the last good key set and
+    retries after ``retrySeconds``. Each successful load is published to the
+    module-level ``validPrinterApiKeys`` that ``ensureValidApiKey`` reads.
+    """
+
+    def __init__(self, secretPath: Optional[str], refreshSeconds: int, retrySeconds: int):
+        self.secretPath = secretPath
+        self.refreshSeconds = max(1, refreshSeconds)
+        self.retrySeconds = max(1, min(retrySeconds, self.refreshSeconds))
+        self._lock = threading.Lock()
+        self._loadedEvent = threading.Event()
+        self._stopEvent = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._secretManagerClient = None
+        self.keyCount = 0
+        self.loadedAtMonotonic: Optional[float] = None
+        self.lastSuccessAt: Optional[datetime] = None
+        self.lastAttemptAt: Optional[datetime] = None
+        self.lastRefreshLatencyMs: Optional[float] = None
+        self.lastError: Optional[str] = None
+        self.refreshCount = 0
+        self.failureCount = 0
+
+    @property
+    def isRemote(self) -> bool:
+        return self.secretPath is not None
+
+    def start(self) -> Optional[threading.Thread]:
+        """Start the refresh thread once; returns None for env-configured keys."""
+        if not self.isRemote:
+            return None
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopEvent.clear()
+                self._thread = threading.Thread(
+                    target=self._runRefreshLoop, name='printer-api-key-refresh', daemon=True
+                )
+                self._thread.start()
+            return self._thread
+
+    def stop(self) -> None:
+        self._stopEvent.set()
+
+    def _runRefreshLoop(self) -> None:
+        while not self._stopEvent.is_set():
+            refreshed = self.refresh()
+            self._stopEvent.wait(self.refreshSeconds if refreshed else self.retrySeconds)
+
+    def refresh(self) -> bool:
+        global validPrinterApiKeys  # pylint: disable=global-statement
+
+        startTime = time.perf_counter()
+        attemptTime = datetime.now(timezone.utc)
+        try:
+            if self._secretManagerClient is None and secretmanager.isAvailable():
+                self._secretManagerClient = secretmanager.SecretManagerServiceClient()
+            loadedKeys = loadPrinterApiKeys(self._secretManagerClient, raiseOnError=True)
+        except Exception as error:  # pylint: disable=broad-except
+            with self._lock:
+                self.lastAttemptAt = attemptTime
+                self.lastRefreshLatencyMs = _elapsedMilliseconds(startTime)
+                self.lastError = str(error)
+                self.failureCount += 1
+                keptKeyCount = self.keyCount
+            logging.warning(
+                'Printer API key refresh failed; keeping %d previously loaded keys: %s',
+                keptKeyCount,
+                error,
+            )
+            return False
+
+        validPrinterApiKeys = loadedKeys
+        with self._lock:
+            self.lastAttemptAt = attemptTime
+            self.lastSuccessAt = attemptTime
+            self.loadedAtMonotonic = time.monotonic()
+            self.lastRefreshLatencyMs = _elapsedMilliseconds(startTime)
+            self.lastError = None
+            self.keyCount = len(loadedKeys)
+            self.refreshCount += 1
+        self._loadedEvent.set()
+        return True
+
+    def waitUntilLoaded(self, timeoutSeconds: float) -> bool:
+        if not self.isRemote or self._loadedEvent.is_set():
+            return True
+        self.start()
+        return self._loadedEvent.wait(timeoutSeconds)
+
+    def isLoaded(self) -> bool:
+        return not self.isRemote or self._loadedEvent.is_set()
+
+    def getMetrics(self) -> Dict[str, object]:
+        with self._lock:
+            ageSeconds = (
+                round(time.monotonic() - self.loadedAtMonotonic, 3)
+                if self.loadedAtMonotonic is not None
+                else None
+            )
+            return {
+                'source': 'secretManager' if self.isRemote else 'environment',
+                'loaded': self.isLoaded(),
+                'keyCount': self.keyCount if self.isRemote else len(validPrinterApiKeys),
+                'ageSeconds': ageSeconds,
+                'refreshIntervalSeconds': self.refreshSeconds,
+                'lastRefreshLatencyMs': self.lastRefreshLatencyMs,
+                'lastSuccessAt': self.lastSuccessAt.isoformat() if self.lastSuccessAt else None,
+                'lastAttemptAt': self.lastAttemptAt.isoformat() if self.lastAttemptAt else None,
+                'lastError': self.lastError,
+                'refreshCount': self.refreshCount,
+                'failureCount': self.failureCount,
+            }
 
 
-def getProvidedApiKey() -> Optional[str]:
-    headerKey = request.headers.get('X-API-Key') if hasattr(request, 'headers') else None
+printerApiKeyStore = PrinterApiKeyStore(
+    resolvePrinterApiKeySecretPath(), printerApiKeyRefreshSeconds, printerApiKeyRetrySeconds
+)
+# Keys that live in the environment are read synchronously; a Secret Manager
+# path is fetched by the key store's background thread instead of at import.
+validPrinterApiKeys = set() if printerApiKeyStore.isRemote else loadPrinterApiKeys()
+registerMetricsProvider('printerApiKeys', printerApiKeyStore.getMetrics)
+
+
+# The request helpers below default to the Flask request but accept any object
+# with the same headers/args/is_json/get_json surface, so the ASGI routes in
+# asgi.py validate input with exactly the same code.
+def getProvidedApiKey(requestSource=None) -> Optional[str]:
+    requestSource = request if requestSource is None else requestSource
+    headerKey = requestSource.headers.get('X-API-Key') if hasattr(requestSource, 'headers') else None
     if headerKey:
         return headerKey
 
-    queryArgs = getattr(request, 'args', None)
+    queryArgs = getattr(requestSource, 'args', None)
     if queryArgs and hasattr(queryArgs, 'get'):
         queryKey = queryArgs.get('apiKey')
         if queryKey:
@@ -344,11 +665,22 @@ def getProvidedApiKey() -> Optional[str]:
     return None
 
 
-def ensureValidApiKey() -> Optional[Tuple[dict, int]]:
+def ensureValidApiKey(requestSource=None, waitSeconds: Optional[float] = None) -> Optional[Tuple[dict, int]]:
+    """Check the request's printer API key; ``waitSeconds`` bounds the wait for the first key load.
+
+    The wait blocks the calling thread, so the ASGI routes wait on the event
+    loop first and pass ``waitSeconds=0``.
+    """
+    if waitSeconds is None:
+        waitSeconds = printerApiKeyInitialWaitSeconds
+    if not printerApiKeyStore.waitUntilLoaded(waitSeconds):
+        logging.warning('Rejecting printer endpoint access until printer API keys are loaded.')
+        return makeErrorResponse(503, 'ServiceUnavailable', 'Printer API keys are not loaded yet')
+
     if not validPrinterApiKeys:
         return None
 
-    providedKey = getProvidedApiKey()
+    providedKey = getProvidedApiKey(requestSource)
     if not providedKey or providedKey not in validPrinterApiKeys:
         logging.warning('Invalid API key provided for printer endpoint access.')
         return makeErrorResponse(401, 'AuthError', 'Invalid API key')
@@ -356,13 +688,14 @@ def ensureValidApiKey() -> Optional[Tuple[dict, int]]:
     return None
 
 
-def getJsonPayload() -> Tuple[Optional[dict], Optional[Tuple[dict, int]]]:
-    if not getattr(request, 'is_json', False):
+def getJsonPayload(requestSource=None) -> Tuple[Optional[dict], Optional[Tuple[dict, int]]]:
+    requestSource = request if requestSource is None else requestSource
+    if not getattr(requestSource, 'is_json', False):
         logging.warning('Request content type is not JSON.')
         return None, makeErrorResponse(400, 'ValidationError', 'Request must be JSON')
 
     try:
-        payload = request.get_json()
+        payload = requestSource.get_json()
     except Exception as error:  # pylint: disable=broad-except
         logging.warning('Failed to parse JSON payload: %s', error)
         return None, makeErrorResponse(400, 'ValidationError', 'Invalid JSON payload', str(error))
@@ -601,12 +934,83 @@ def parseCommandMetadata(
     return None, makeErrorResponse(400, 'ValidationError', 'metadata must be an object or JSON string')
 
 
+clientComponentNames = ('storage', 'firestore', 'kms')
+# Serializes the first getClients() build so a burst of cold requests shares
+# one set of channels instead of each building its own bundle.
+clientInitializationLock = threading.Lock()
+# Cloud Storage speaks HTTP/1.1, so every concurrent upload or signed-URL call
+# holds its own pooled connection; size the pool to the worker's thread count.
+# Firestore and KMS use a single multiplexed gRPC channel and have no pool.
+storageHttpPoolSize = int(os.environ.get('STORAGE_HTTP_POOL_SIZE') or os.environ.get('SERVER_THREADS') or '10')
+clientWarmupLock = threading.Lock()
+clientWarmupThread: Optional[threading.Thread] = None
+clientWarmupState: Dict[str, Dict[str, object]] = {
+    componentName: {
+        'ready': False,
+        'initLatencyMs': None,
+        'firstRpcLatencyMs': None,
+        'firstRpcOk': None,
+        'error': None,
+    }
+    for componentName in clientComponentNames
+}
+
+
+def _updateClientWarmupState(componentName: str, **fields) -> None:
+    with clientWarmupLock:
+        clientWarmupState[componentName].update(fields)
+
+
+def _elapsedMilliseconds(startTime: float) -> float:
+    return round((time.perf_counter() - startTime) * 1000.0, 2)
+
+
+def _buildClientComponent(componentName: str, builder):
+    startTime = time.perf_counter()
+    try:
+        client = builder()
+    except Exception as error:  # pylint: disable=broad-except
+        _updateClientWarmupState(componentName, error=str(error))
+        raise
+    _updateClientWarmupState(
+        componentName,
+        initLatencyMs=_elapsedMilliseconds(startTime),
+        error=None,
+    )
+    return client
+
+
+def buildStorageHttpSession(credentials):
+    authorizedSession = googleAuthTransportRequests.AuthorizedSession(credentials)
+    poolAdapter = requests.adapters.HTTPAdapter(
+        pool_connections=storageHttpPoolSize,
+        pool_maxsize=storageHttpPoolSize,
+    )
+    authorizedSession.mount('https://', poolAdapter)
+    return authorizedSession
+
+
+def _buildStorageClient(storageClientKwargs: Dict[str, object]):
+    credentials = storageClientKwargs.get('credentials')
+    if credentials is not None:
+        storageClientKwargs = {**storageClientKwargs, '_http': buildStorageHttpSession(credentials)}
+    return storage.Client(**storageClientKwargs)
+
+
 def getClients() -> ClientBundle:
     global cachedClients  # pylint: disable=global-statement
 
     if cachedClients is not None:
         return cachedClients
 
+    with clientInitializationLock:
+        # Another thread may have finished the build while this one waited.
+        if cachedClients is None:
+            cachedClients = _buildClientBundle()
+    return cachedClients
+
+
+def _buildClientBundle() -> ClientBundle:
     gcpProjectId = os.environ.get('GCP_PROJECT_ID')
     gcsBucketName = os.environ.get('GCS_BUCKET_NAME')
     kmsKeyRing = os.environ.get('KMS_KEY_RING')
@@ -638,22 +1042,49 @@ def getClients() -> ClientBundle:
         storageClientKwargs: Dict[str, object] = {'project': gcpProjectId}
         if credentials is not None:
             storageClientKwargs['credentials'] = credentials
-        storageClient = storage.Client(**storageClientKwargs)
 
         firestoreClientKwargs: Dict[str, object] = {'project': gcpProjectId}
         if credentials is not None:
             firestoreClientKwargs['credentials'] = credentials
-        firestoreClient = firestore.Client(**firestoreClientKwargs)
 
         kmsClientKwargs: Dict[str, object] = {}
         if credentials is not None:
             kmsClientKwargs['credentials'] = credentials
-        kmsClient = kms_v1.KeyManagementServiceClient(**kmsClientKwargs)
+
+        # The three clients share the credentials but nothing else, so their
+        # channel setup runs side by side instead of back to back.
+        with ThreadPoolExecutor(
+            max_workers=len(clientComponentNames), thread_name_prefix='client-init'
+        ) as executor:
+            storageFuture = executor.submit(
+                _buildClientComponent, 'storage', lambda: _buildStorageClient(storageClientKwargs)
+            )
+            firestoreFuture = executor.submit(
+                _buildClientComponent,
+                'firestore',
+                lambda: firestore.Client(**firestoreClientKwargs),
+            )
+            kmsFuture = executor.submit(
+                _buildClientComponent,
+                'kms',
+                lambda: kms_v1.KeyManagementServiceClient(**kmsClientKwargs),
+            )
+            storageClient = storageFuture.result()
+            firestoreClient = firestoreFuture.result()
+            kmsClient = kmsFuture.result()
+
         kmsKeyPath = kmsClient.crypto_key_path(gcpProjectId, kmsLocation, kmsKeyRing, kmsKeyName)
     except Exception as error:  # pylint: disable=broad-except
         raise ClientInitializationError('Google Cloud clients', error) from error
 
-    cachedClients = ClientBundle(
+    logging.info(
+        "Initialized Google Cloud clients with Project: %s, Bucket: %s, KMS Key: %s",
+        gcpProjectId,
+        gcsBucketName,
+        kmsKeyPath,
+    )
+
+    return ClientBundle(
         storageClient=storageClient,
         firestoreClient=firestoreClient,
         kmsClient=kmsClient,
@@ -661,14 +1092,104 @@ def getClients() -> ClientBundle:
         gcsBucketName=gcsBucketName,
     )
 
-    logging.info(
-        "Initialized Google Cloud clients with Project: %s, Bucket: %s, KMS Key: %s",
-        gcpProjectId,
-        gcsBucketName,
-        kmsKeyPath,
+
+def preloadClients() -> bool:
+    """Build the client bundle before the first request reaches this process."""
+    try:
+        getClients()
+    except (MissingEnvironmentError, ClientInitializationError) as error:
+        logging.warning('Skipping Google Cloud client preload: %s', error)
+        return False
+    return True
+
+
+def _probeStorageClient(clients: ClientBundle) -> None:
+    clients.storageClient.bucket(clients.gcsBucketName).blob('.readyz').exists()
+
+
+def _probeFirestoreClient(clients: ClientBundle) -> None:
+    clients.firestoreClient.collection(firestoreCollectionFiles).document('.readyz').get()
+
+
+def _probeKmsClient(clients: ClientBundle) -> None:
+    clients.kmsClient.encrypt(request={'name': clients.kmsKeyPath, 'plaintext': b'readyz'})
+
+
+clientRpcProbes = {
+    'storage': _probeStorageClient,
+    'firestore': _probeFirestoreClient,
+    'kms': _probeKmsClient,
+}
+
+
+def _probeClientComponent(componentName: str, clients: ClientBundle) -> None:
+    startTime = time.perf_counter()
+    try:
+        clientRpcProbes[componentName](clients)
+        firstRpcOk = True
+        probeError = None
+    except Exception as error:  # pylint: disable=broad-except
+        logging.warning('First %s RPC failed during warm-up: %s', componentName, error)
+        firstRpcOk = False
+        probeError = str(error)
+    # The channel and credentials are warm once the first RPC returns, even
+    # when it is rejected, so readiness does not depend on its outcome.
+    _updateClientWarmupState(
+        componentName,
+        ready=True,
+        firstRpcLatencyMs=_elapsedMilliseconds(startTime),
+        firstRpcOk=firstRpcOk,
+        error=probeError,
     )
 
-    return cachedClients
+
+def runClientWarmup() -> None:
+    if not preloadClients():
+        return
+
+    clients = getClients()
+    with ThreadPoolExecutor(
+        max_workers=len(clientComponentNames), thread_name_prefix='client-warmup'
+    ) as executor:
+        for componentName in clientComponentNames:
+            executor.submit(_probeClientComponent, componentName, clients)
+
+    logging.info('Google Cloud client warm-up finished: %s', json.dumps(getClientReadiness()))
+
+
+def startClientWarmup() -> threading.Thread:
+    """Warm the client bundle on a background thread; safe to call repeatedly."""
+    global clientWarmupThread  # pylint: disable=global-statement
+
+    with clientWarmupLock:
+        previousAttemptFailed = (
+            clientWarmupThread is not None
+            and not clientWarmupThread.is_alive()
+            and cachedClients is None
+        )
+        if clientWarmupThread is None or previousAttemptFailed:
+            clientWarmupThread = threading.Thread(
+                target=runClientWarmup, name='client-warmup', daemon=True
+            )
+            clientWarmupThread.start()
+        return clientWarmupThread
+
+
+def getClientReadiness() -> Dict[str, object]:
+    with clientWarmupLock:
+        components = {
+            componentName: dict(componentState)
+            for componentName, componentState in clientWarmupState.items()
+        }
+    apiKeysLoaded = printerApiKeyStore.isLoaded()
+    return {
+        'ready': apiKeysLoaded and all(componentState['ready'] for componentState in components.values()),
+        'clients': components,
+        'apiKeysLoaded': apiKeysLoaded,
+    }
+
+
+registerMetricsProvider('clients', getClientReadiness)
 
 
 def fetchClientsOrResponse() -> Tuple[Optional[ClientBundle], Optional[Tuple[dict, int]]]:
@@ -701,6 +1222,171 @@ def generateFetchToken() -> str:
     return secrets.token_urlsafe(32)
 
 
+signedFetchTokenPrefix = 'ft1'
+signedFetchTokenPattern = re.compile(
+    r'^ft1\.(?P<fileId>[0-9a-f-]{36})\.(?P<expiresAt>[0-9]{1,12})\.(?P<nonce>[A-Za-z0-9_-]{16})\.(?P<signature>[A-Za-z0-9_-]{43})$'
+)
+
+
+class InvalidFetchTokenError(ValueError):
+    def __init__(self, reason: str, statusCode: int = 404):
+        super().__init__(reason)
+        self.reason = reason
+        self.statusCode = statusCode
+
+
+def _signFetchTokenPayload(signingKey: bytes, payload: str) -> str:
+    digest = hmac.new(signingKey, payload.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode('ascii').rstrip('=')
+
+
+def issueFetchToken(fileId: str, expiresAt: datetime) -> str:
+    """Return a signed ``ft1.<fileId>.<expiry>.<nonce>.<mac>`` token, or an opaque one without a signing key."""
+    if not fetchTokenSigningKeys:
+        return generateFetchToken()
+    payload = '.'.join(
+        [signedFetchTokenPrefix, fileId, str(int(expiresAt.timestamp())), secrets.token_urlsafe(12)]
+    )
+    return f'{payload}.{_signFetchTokenPayload(fetchTokenSigningKeys[0], payload)}'
+
+
+def isSignedFetchToken(fetchToken: str) -> bool:
+    return fetchToken.startswith(signedFetchTokenPrefix + '.')
+
+
+def verifySignedFetchToken(fetchToken: str, currentTime: Optional[datetime] = None) -> str:
+    """Return the fileId of a signed token, raising InvalidFetchTokenError without any I/O."""
+    tokenMatch = signedFetchTokenPattern.match(fetchToken)
+    if tokenMatch is None:
+        raise InvalidFetchTokenError('malformed')
+    if not fetchTokenSigningKeys:
+        raise InvalidFetchTokenError('signing disabled')
+
+    payload, signature = fetchToken.rsplit('.', 1)
+    if not any(
+        hmac.compare_digest(signature, _signFetchTokenPayload(signingKey, payload))
+        for signingKey in fetchTokenSigningKeys
+    ):
+        raise InvalidFetchTokenError('bad signature')
+
+    expiresAt = datetime.fromtimestamp(int(tokenMatch.group('expiresAt')), tz=timezone.utc)
+    if expiresAt < (currentTime or datetime.now(timezone.utc)):
+        raise InvalidFetchTokenError('expired', 410)
+    return tokenMatch.group('fileId')
+
+
+def hashFetchToken(fetchToken: str) -> str:
+    return hashlib.sha256(fetchToken.encode('utf-8')).hexdigest()
+
+
+def getFetchTokenIndexReference(firestoreClient: firestore.Client, fetchToken: str):
+    return firestoreClient.collection(firestoreCollectionFetchTokens).document(hashFetchToken(fetchToken))
+
+
+def buildFetchTokenIndexEntry(fileId: str, fetchTokenExpiry: Optional[datetime]) -> Dict[str, object]:
+    # expiresAt doubles as the field for a Firestore TTL policy on the index.
+    return {'fileId': fileId, 'expiresAt': fetchTokenExpiry, 'createdAt': firestore.SERVER_TIMESTAMP}
+
+
+def findFileByFetchToken(firestoreClient: firestore.Client, fetchToken: str):
+    """Return the files snapshot holding ``fetchToken``, or None.
+
+    Signed tokens name their file, so they resolve with one get (the caller
+    verifies them first). Opaque tokens go through the token index; the
+    collection query only runs for files written before the index existed.
+    """
+    if isSignedFetchToken(fetchToken):
+        fileSnapshot = firestoreClient.collection(firestoreCollectionFiles).document(
+            verifySignedFetchToken(fetchToken)
+        ).get()
+        if fileSnapshot.exists and (fileSnapshot.to_dict() or {}).get('fetchToken') == fetchToken:
+            return fileSnapshot
+        return None
+
+    indexSnapshot = getFetchTokenIndexReference(firestoreClient, fetchToken).get()
+    if indexSnapshot.exists:
+        fileId = (indexSnapshot.to_dict() or {}).get('fileId')
+        if fileId:
+            fileSnapshot = firestoreClient.collection(firestoreCollectionFiles).document(fileId).get()
+            if fileSnapshot.exists and (fileSnapshot.to_dict() or {}).get('fetchToken') == fetchToken:
+                return fileSnapshot
+        logging.warning('Fetch token index entry %s is stale.', indexSnapshot.id)
+
+    if not fetchTokenQueryFallbackEnabled:
+        return None
+
+    fileQuery = (
+        firestoreClient.collection(firestoreCollectionFiles)
+        .where(filter=FieldFilter('fetchToken', '==', fetchToken))
+        .limit(1)
+    )
+    fileDocuments = list(fileQuery.stream())
+    return fileDocuments[0] if fileDocuments else None
+
+
+class FetchTokenAlreadyConsumedError(RuntimeError):
+    """Raised when a concurrent request changed the file first and won the token."""
+
+
+def updateFileAndReleaseFetchToken(
+    firestoreClient: firestore.Client,
+    fileId: str,
+    updatePayload: Dict[str, object],
+    fetchToken: Optional[str],
+    lastUpdateTime=None,
+    recipientId: Optional[str] = None,
+) -> None:
+    """Apply ``updatePayload`` to the file and drop its token index entry in one batch.
+
+    With ``lastUpdateTime`` the batch only commits if the file is unchanged
+    since it was read, so one of several concurrent consumers wins. The
+    recipient's pending-list poll version is bumped in the same batch.
+    """
+    writeBatch = firestoreClient.batch()
+    fileReference = firestoreClient.collection(firestoreCollectionFiles).document(fileId)
+    if lastUpdateTime is not None:
+        writeBatch.update(
+            fileReference, updatePayload, option=firestoreClient.write_option(last_update_time=lastUpdateTime)
+        )
+    else:
+        writeBatch.update(fileReference, updatePayload)
+    if fetchToken and not isSignedFetchToken(fetchToken):
+        writeBatch.delete(getFetchTokenIndexReference(firestoreClient, fetchToken))
+    bumpPollVersion(firestoreClient, 'recipient', recipientId, 'pending', writeBatch=writeBatch)
+    try:
+        writeBatch.commit()
+    except FailedPrecondition as error:
+        if lastUpdateTime is None:
+            raise
+        raise FetchTokenAlreadyConsumedError(fileId) from error
+    finally:
+        latestFileCache.invalidateFile(fileId)
+
+
+def restoreFetchToken(
+    firestoreClient: firestore.Client,
+    fileId: str,
+    fileMetadata: Dict[str, object],
+    updatePayload: Dict[str, object],
+    fetchToken: str,
+) -> None:
+    """Undo a consumption whose request failed afterwards, so the client can retry."""
+    restorePayload = {fieldName: fileMetadata.get(fieldName, DELETE_FIELD) for fieldName in updatePayload}
+    writeBatch = firestoreClient.batch()
+    writeBatch.update(firestoreClient.collection(firestoreCollectionFiles).document(fileId), restorePayload)
+    if not isSignedFetchToken(fetchToken):
+        writeBatch.set(
+            getFetchTokenIndexReference(firestoreClient, fetchToken),
+            buildFetchTokenIndexEntry(fileId, fileMetadata.get('fetchTokenExpiry')),
+        )
+    bumpPollVersion(firestoreClient, 'recipient', fileMetadata.get('recipientId'), 'pending', writeBatch=writeBatch)
+    try:
+        writeBatch.commit()
+    except Exception:  # pylint: disable=broad-except
+        logging.exception('Failed to restore fetch token for file %s.', fileId)
+    latestFileCache.invalidateFile(fileId)
+
+
 def normalizeTimestamp(value: Optional[datetime]) -> Optional[str]:
     if not value or not isinstance(value, datetime):
         return None
@@ -711,8 +1397,9 @@ def normalizeTimestamp(value: Optional[datetime]) -> Optional[str]:
     return value.astimezone(timezone.utc).isoformat()
 
 
-def parsePrinterStatusQueryParameters():
-    queryArgs = getattr(request, 'args', {}) or {}
+def parsePrinterStatusQueryParameters(queryArgs=None):
+    if queryArgs is None:
+        queryArgs = getattr(request, 'args', {}) or {}
 
     printerSerialValue = queryArgs.get('printerSerial')
     sanitizedPrinterSerial: Optional[str] = None
@@ -774,17 +1461,23 @@ def parsePrinterStatusQueryParameters():
     return queryParameters, None
 
 
-def loadRecipientPrinterStatusSnapshots(
+def buildStatusPollQueryArgs(recipientId: str, queryParameters: dict) -> Dict[str, object]:
+    sinceTimestamp = queryParameters.get('since')
+    return {
+        'recipientId': recipientId,
+        'printerSerial': queryParameters.get('printerSerial'),
+        'since': sinceTimestamp.isoformat() if sinceTimestamp else None,
+        'limit': queryParameters.get('limit'),
+    }
+
+
+def buildRecipientPrinterStatusQuery(
+    firestoreClient,
     recipientId: str,
     printerSerial: Optional[str],
     sinceTimestamp: Optional[datetime],
     limitSize: int,
 ):
-    clients, clientError = _loadClientsOrError()
-    if clientError:
-        return None, clientError
-
-    firestoreClient = clients.firestoreClient
     statusCollection = firestoreClient.collection(firestoreCollectionPrinterStatus)
 
     query = statusCollection.where(filter=FieldFilter('recipientId', '==', recipientId))
@@ -793,7 +1486,22 @@ def loadRecipientPrinterStatusSnapshots(
     if sinceTimestamp is not None:
         query = query.where(filter=FieldFilter('timestamp', '>=', sinceTimestamp))
 
-    query = query.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limitSize)
+    return query.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limitSize)
+
+
+def loadRecipientPrinterStatusSnapshots(
+    recipientId: str,
+    printerSerial: Optional[str],
+    sinceTimestamp: Optional[datetime],
+    limitSize: int,
+):
+    clients, clientError = _loadClientsOrError()
+    if clientError:
+        return None, clientError
+
+    query = buildRecipientPrinterStatusQuery(
+        clients.firestoreClient, recipientId, printerSerial, sinceTimestamp, limitSize
+    )
 
     try:
         documentSnapshots = list(query.stream())
@@ -832,68 +1540,847 @@ def parseIso8601Timestamp(rawTimestamp: object) -> Optional[datetime]:
     return parsedTimestamp.astimezone(timezone.utc)
 
 
-@app.route('/upload', methods=['POST'])
-@apply_rate_limit(RATE_LIMIT_UPLOAD)  # Begrens opplastinger for å forhindre ressursutmattelse
-def uploadFile():
-    logging.info('Received request to /upload')
-    try:
-        clients, errorResponse = fetchClientsOrResponse()
-        if errorResponse:
-            return jsonify(errorResponse[0]), errorResponse[1]
+downloadHttpPoolHosts = int(os.environ.get('DOWNLOAD_HTTP_POOL_HOSTS', '10'))
+downloadHttpPoolSize = int(os.environ.get('DOWNLOAD_HTTP_POOL_SIZE') or str(storageHttpPoolSize))
+downloadHttpRetries = int(os.environ.get('DOWNLOAD_HTTP_RETRIES', '3'))
+downloadHttpBackoffFactor = float(os.environ.get('DOWNLOAD_HTTP_BACKOFF_FACTOR', '0.5'))
+downloadHttpTimeoutSeconds = float(os.environ.get('DOWNLOAD_HTTP_TIMEOUT_SECONDS', '60'))
+downloadHttpSessionLock = threading.Lock()
+downloadHttpSession = None
+downloadHttpCounters = {'downloads': 0, 'failures': 0, 'retries': 0}
 
-        storageClient = clients.storageClient
-        firestoreClient = clients.firestoreClient
-        kmsClient = clients.kmsClient
-        kmsKeyPath = clients.kmsKeyPath
-        gcsBucketName = clients.gcsBucketName
 
-        payload = request.get_json(silent=True)
-        if not isinstance(payload, dict):
-            logging.warning('Upload payload is not a JSON object.')
-            return jsonify({'error': 'Expected JSON body'}), 400
+def buildDownloadSession():
+    retryPolicy = requests.adapters.Retry(
+        total=downloadHttpRetries,
+        backoff_factor=downloadHttpBackoffFactor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({'GET'}),
+        raise_on_status=False,
+    )
+    # pool_block caps open connections per host at downloadHttpPoolSize; extra
+    # threads wait for a kept-alive connection instead of opening throwaways.
+    poolAdapter = requests.adapters.HTTPAdapter(
+        pool_connections=downloadHttpPoolHosts,
+        pool_maxsize=downloadHttpPoolSize,
+        max_retries=retryPolicy,
+        pool_block=True,
+    )
+    session = requests.Session()
+    session.mount('https://', poolAdapter)
+    session.mount('http://', poolAdapter)
+    return session
 
-        recipientId = payload.get('recipientId') or payload.get('recipient_id')
-        if not recipientId:
-            logging.warning('Recipient ID is missing.')
-            return jsonify({'error': 'Recipient ID is required'}), 400
 
-        productIdRaw = payload.get('productId') or payload.get('product_id')
-        if not productIdRaw:
-            logging.warning('Product ID is missing.')
-            return jsonify({'error': 'Product ID is required'}), 400
+def getDownloadSession():
+    global downloadHttpSession  # pylint: disable=global-statement
 
-        try:
-            productUuid = uuid.UUID(str(productIdRaw))
-        except (ValueError, AttributeError, TypeError):
-            logging.warning('Invalid product ID provided: %s', productIdRaw)
-            return jsonify({'error': 'Invalid product ID format'}), 400
+    if downloadHttpSession is None:
+        with downloadHttpSessionLock:
+            if downloadHttpSession is None:
+                downloadHttpSession = buildDownloadSession()
+    return downloadHttpSession
 
-        productId = str(productUuid)
 
-        gcodeUrl = payload.get('gcodeUrl')
-        if not gcodeUrl:
-            logging.warning('Missing gcodeUrl in upload payload.')
-            return jsonify({'error': 'gcodeUrl is required'}), 400
+def _incrementDownloadCounter(counterName: str, amount: int = 1) -> None:
+    with downloadHttpSessionLock:
+        downloadHttpCounters[counterName] += amount
 
-        unencryptedData, errorResponse = parseJsonObjectPayload(
-            payload.get('unencrypted_data', {}), 'unencrypted_data'
-        )
-        if errorResponse:
-            return jsonify(errorResponse[0]), errorResponse[1]
 
-        encryptedDataPayload, errorResponse = parseJsonObjectPayload(
-            payload.get('encrypted_data_payload', {}), 'encrypted_data_payload'
+def downloadSourceFile(url: str, headers: Dict[str, str], stream: bool = False):
+    """GET ``url`` through the shared keep-alive session and raise on HTTP errors."""
+    _incrementDownloadCounter('downloads')
+    try:
+        response = getDownloadSession().get(
+            url, headers=headers, timeout=downloadHttpTimeoutSeconds, stream=stream
         )
-        if errorResponse:
-            return jsonify(errorResponse[0]), errorResponse[1]
+        retryHistory = getattr(getattr(getattr(response, 'raw', None), 'retries', None), 'history', None)
+        if retryHistory:
+            _incrementDownloadCounter('retries', len(retryHistory))
+        response.raise_for_status()
+    except requests.RequestException:
+        _incrementDownloadCounter('failures')
+        raise
+    return response
+
+
+def getDownloadSessionMetrics() -> Dict[str, object]:
+    with downloadHttpSessionLock:
+        session = downloadHttpSession
+        counters = dict(downloadHttpCounters)
+
+    hosts: Dict[str, Dict[str, int]] = {}
+    if session is not None:
+        poolManager = session.get_adapter('https://').poolmanager
+        for poolKey in poolManager.pools.keys():
+            connectionPool = poolManager.pools.get(poolKey)
+            if connectionPool is None:
+                continue
+            hosts[f'{connectionPool.scheme}://{connectionPool.host}:{connectionPool.port}'] = {
+                'connectionsOpened': connectionPool.num_connections,
+                'requests': connectionPool.num_requests,
+                'idleConnections': connectionPool.pool.qsize() if connectionPool.pool is not None else 0,
+            }
 
-        fileId = str(uuid.uuid4())
-        originalFilename = (
-            payload.get('originalFilename')
-            or payload.get('lastRequestFilename')
-            or payload.get('original_filename')
-            or payload.get('last_request_filename')
-        )
+    totalRequests = sum(hostMetrics['requests'] for hostMetrics in hosts.values())
+    totalConnections = sum(hostMetrics['connectionsOpened'] for hostMetrics in hosts.values())
+    reusedRequests = max(0, totalRequests - totalConnections)
+    return {
+        **counters,
+        'poolHosts': downloadHttpPoolHosts,
+        'poolSizePerHost': downloadHttpPoolSize,
+        'requests': totalRequests,
+        'connectionsOpened': totalConnections,
+        'reusedConnections': reusedRequests,
+        'reuseRatio': round(reusedRequests / totalRequests, 3) if totalRequests else None,
+        'hosts': hosts,
+    }
+
+
+registerMetricsProvider('downloads', getDownloadSessionMetrics)
+
+
+def _readChunkSize(variableName: str, defaultValue: int) -> int:
+    # Resumable GCS uploads require chunk sizes in multiples of 256 KiB.
+    chunkQuantum = 256 * 1024
+    rawValue = int(os.environ.get(variableName, str(defaultValue)))
+    return max(chunkQuantum, (rawValue // chunkQuantum) * chunkQuantum)
+
+
+uploadMaxBytes = int(os.environ.get('UPLOAD_MAX_BYTES', str(512 * 1024 * 1024)))
+uploadChunkSizeBytes = _readChunkSize('UPLOAD_CHUNK_SIZE_BYTES', 8 * 1024 * 1024)
+downloadChunkSizeBytes = int(os.environ.get('DOWNLOAD_CHUNK_SIZE_BYTES', str(256 * 1024)))
+
+
+class UploadTooLargeError(ValueError):
+    def __init__(self, maxBytes: int):
+        self.maxBytes = maxBytes
+        super().__init__(f'Upload exceeds the maximum size of {maxBytes} bytes')
+
+
+class StreamingUploadReader:
+    """File-like view over a chunk iterator for ``blob.upload_from_file``.
+
+    Holds at most one upload chunk plus one download chunk in memory, hashes
+    and counts bytes as they pass, and raises ``UploadTooLargeError`` as soon
+    as the running size exceeds ``maxBytes``.
+    """
+
+    def __init__(self, chunks, maxBytes: int):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+        self._position = 0
+        self._exhausted = False
+        self._hasher = hashlib.sha256()
+        self.maxBytes = maxBytes
+        self.sizeBytes = 0
+
+    def _fill(self, targetSize: Optional[int]) -> None:
+        while not self._exhausted and (targetSize is None or len(self._buffer) < targetSize):
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._exhausted = True
+                break
+            if not chunk:
+                continue
+            self.sizeBytes += len(chunk)
+            if self.sizeBytes > self.maxBytes:
+                raise UploadTooLargeError(self.maxBytes)
+            self._hasher.update(chunk)
+            self._buffer.extend(chunk)
+
+    def prefetch(self, size: int) -> bool:
+        """Buffer up to ``size`` bytes; True when that is the whole stream."""
+        self._fill(size + 1)
+        return self._exhausted and len(self._buffer) <= size
+
+    @property
+    def bufferedBytes(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def sha256(self) -> str:
+        return self._hasher.hexdigest()
+
+    def read(self, size: int = -1) -> bytes:
+        self._fill(None if size is None or size < 0 else size)
+        readSize = len(self._buffer) if size is None or size < 0 else min(size, len(self._buffer))
+        data = bytes(self._buffer[:readSize])
+        del self._buffer[:readSize]
+        self._position += len(data)
+        return data
+
+    def tell(self) -> int:
+        return self._position
+
+
+def streamResponseToBlob(downloadResponse, blob) -> Tuple[int, str]:
+    """Copy a streamed HTTP response into ``blob``; returns (sizeBytes, sha256)."""
+    declaredLength = (getattr(downloadResponse, 'headers', None) or {}).get('Content-Length')
+    if declaredLength and declaredLength.isdigit() and int(declaredLength) > uploadMaxBytes:
+        raise UploadTooLargeError(uploadMaxBytes)
+
+    uploadReader = StreamingUploadReader(
+        downloadResponse.iter_content(chunk_size=downloadChunkSizeBytes), uploadMaxBytes
+    )
+    if uploadReader.prefetch(uploadChunkSizeBytes):
+        # Small files fit in one chunk: a single multipart request is cheaper
+        # than opening a resumable session.
+        blob.upload_from_file(uploadReader, size=uploadReader.bufferedBytes, checksum='crc32c')
+    else:
+        blob.chunk_size = uploadChunkSizeBytes
+        blob.upload_from_file(uploadReader, checksum='crc32c')
+    return uploadReader.sizeBytes, uploadReader.sha256
+
+
+gcsPathStyleHosts = {'storage.googleapis.com', 'storage.cloud.google.com'}
+gcsVirtualHostSuffix = '.storage.googleapis.com'
+# Buckets /upload may copy from with the service account's own credentials.
+# /upload is unauthenticated, so list only buckets whose objects any caller may
+# read; the service's own bucket is never copied from. Empty disables copying.
+gcodeSourceBuckets = {
+    bucketName.strip()
+    for bucketName in os.environ.get('GCODE_SOURCE_BUCKETS', '').split(',')
+    if bucketName.strip()
+}
+# A signature in the URL is the caller's proof of access; it is honoured by
+# downloading the URL, not by a copy that bypasses it.
+signedUrlQueryParameters = {'x-goog-signature', 'x-amz-signature', 'signature', 'googleaccessid'}
+
+
+def parseGcsSourceUrl(sourceUrl: str) -> Optional[Tuple[str, str]]:
+    """Return (bucket, object) when ``sourceUrl`` names a Cloud Storage object."""
+    parsedUrl = urlparse(sourceUrl)
+    scheme = parsedUrl.scheme.lower()
+    host = parsedUrl.netloc.lower()
+
+    if scheme == 'gs':
+        bucketName, objectName = parsedUrl.netloc, parsedUrl.path.lstrip('/')
+    elif scheme in {'http', 'https'} and host in gcsPathStyleHosts:
+        bucketName, _, encodedObjectName = parsedUrl.path.lstrip('/').partition('/')
+        objectName = unquote(encodedObjectName)
+    elif scheme in {'http', 'https'} and host.endswith(gcsVirtualHostSuffix):
+        bucketName = host[:-len(gcsVirtualHostSuffix)]
+        objectName = unquote(parsedUrl.path.lstrip('/'))
+    else:
+        return None
+
+    if not bucketName or not objectName:
+        return None
+    return bucketName, objectName
+
+
+def isGcsCopyAllowed(sourceUrl: str, sourceBucketName: str) -> bool:
+    if sourceBucketName not in gcodeSourceBuckets or sourceBucketName == os.environ.get('GCS_BUCKET_NAME'):
+        return False
+    queryParameterNames = {
+        parameterName.lower() for parameterName, _ in parse_qsl(urlparse(sourceUrl).query, keep_blank_values=True)
+    }
+    return not queryParameterNames & signedUrlQueryParameters
+
+
+def copyGcsObjectToBlob(storageClient, sourceBucketName: str, sourceObjectName: str, destinationBlob):
+    """Copy a GCS object server-side with rewrite; returns None when it does not exist."""
+    sourceBlob = storageClient.bucket(sourceBucketName).get_blob(sourceObjectName)
+    if sourceBlob is None:
+        return None
+    if sourceBlob.size is not None and sourceBlob.size > uploadMaxBytes:
+        raise UploadTooLargeError(uploadMaxBytes)
+
+    # rewrite() copies in bounded steps, so large or cross-region objects may
+    # need several calls; each call resumes from the returned token.
+    rewriteToken = None
+    totalBytes = sourceBlob.size
+    while True:
+        rewriteToken, _, totalBytes = destinationBlob.rewrite(sourceBlob, token=rewriteToken)
+        if rewriteToken is None:
+            break
+    return totalBytes
+
+
+def ingestGcodeSource(storageClient, gcodeUrl: str, downloadHeaders: Dict[str, str], blob) -> Dict[str, object]:
+    """Fill ``blob`` from ``gcodeUrl``, copying server-side from allowed GCS source buckets."""
+    gcsSource = parseGcsSourceUrl(gcodeUrl)
+    if gcsSource is not None and isGcsCopyAllowed(gcodeUrl, gcsSource[0]):
+        sourceBucketName, sourceObjectName = gcsSource
+        try:
+            copiedBytes = copyGcsObjectToBlob(storageClient, sourceBucketName, sourceObjectName, blob)
+        except (Forbidden, PermissionDenied, Unauthorized, GoogleAPICallError) as error:
+            # Typically a bucket our service account cannot read; a signed
+            # URL still works through the download path.
+            logging.warning(
+                'Server-side copy from gs://%s/%s failed; downloading instead: %s',
+                sourceBucketName,
+                sourceObjectName,
+                error,
+            )
+        else:
+            if copiedBytes is not None:
+                return {
+                    'ingestMode': 'gcsCopy',
+                    'sizeBytes': copiedBytes,
+                    'sha256': None,
+                    'crc32c': getattr(blob, 'crc32c', None),
+                    'sourceGcsUri': f'gs://{sourceBucketName}/{sourceObjectName}',
+                }
+            logging.warning(
+                'Source object gs://%s/%s not found; downloading instead.',
+                sourceBucketName,
+                sourceObjectName,
+            )
+
+    downloadUrl = gcodeUrl
+    if gcsSource is not None and urlparse(gcodeUrl).scheme.lower() == 'gs':
+        downloadUrl = f'https://storage.googleapis.com/{gcsSource[0]}/{quote(gcsSource[1])}'
+
+    downloadResponse = downloadSourceFile(downloadUrl, downloadHeaders, stream=True)
+    # Stream straight into GCS so memory stays at one chunk, not the file size.
+    try:
+        fileSizeBytes, fileSha256 = streamResponseToBlob(downloadResponse, blob)
+    finally:
+        downloadResponse.close()
+    return {
+        'ingestMode': 'download',
+        'sizeBytes': fileSizeBytes,
+        'sha256': fileSha256,
+        'crc32c': None,
+        'sourceGcsUri': None,
+    }
+
+
+# Envelope encryption: encryptedData is sealed locally with AES-256-GCM under a
+# data key, and only the data key is wrapped by KMS. One wrapped key is reused
+# for many uploads, and unwrapped keys are cached, so most uploads and fetches
+# make no KMS call. Records without encryptionScheme are direct KMS ciphertext.
+encryptionMode = os.environ.get('ENCRYPTION_MODE', 'kms').strip().lower()
+dataKeyBackendName = os.environ.get('DATA_KEY_BACKEND', 'kms').strip().lower()
+dataKeyRotationSeconds = float(os.environ.get('DATA_KEY_ROTATION_SECONDS', '3600'))
+dataKeyMaxUses = int(os.environ.get('DATA_KEY_MAX_USES', '100000'))
+dataKeyCacheTtlSeconds = float(os.environ.get('DATA_KEY_CACHE_TTL_SECONDS', '3600'))
+dataKeyCacheMaxEntries = int(os.environ.get('DATA_KEY_CACHE_MAX_ENTRIES', '256'))
+envelopeEncryptionScheme = 'envelope-aes256gcm-v1'
+dataKeySizeBytes = 32
+aesGcmNonceSizeBytes = 12
+
+
+class EnvelopeDecryptionError(ValueError):
+    """Raised when envelope-encrypted data cannot be authenticated or decoded."""
+
+
+class KmsDataKeyBackend:
+    """Wraps data keys with the Cloud KMS key used for direct encryption."""
+
+    name = 'kms'
+
+    def __init__(self, kmsClient, kmsKeyPath: str):
+        self.kmsClient = kmsClient
+        self.keyId = kmsKeyPath
+
+    def wrapKey(self, dataKey: bytes) -> bytes:
+        return self.kmsClient.encrypt(request={'name': self.keyId, 'plaintext': dataKey}).ciphertext
+
+    def unwrapKey(self, wrappedKey: bytes) -> bytes:
+        return self.kmsClient.decrypt(request={'name': self.keyId, 'ciphertext': wrappedKey}).plaintext
+
+
+class LocalDataKeyBackend:
+    """Wraps data keys with a local AES-GCM key; meant for tests and benchmarks."""
+
+    name = 'local'
+
+    def __init__(self, keyEncryptionKey: bytes):
+        self.keyEncryptionKey = keyEncryptionKey
+        self.keyId = 'local:' + hashlib.sha256(keyEncryptionKey).hexdigest()[:16]
+
+    def wrapKey(self, dataKey: bytes) -> bytes:
+        nonce = os.urandom(aesGcmNonceSizeBytes)
+        return nonce + cryptographyAead.AESGCM(self.keyEncryptionKey).encrypt(nonce, dataKey, self.keyId.encode())
+
+    def unwrapKey(self, wrappedKey: bytes) -> bytes:
+        nonce, sealedKey = wrappedKey[:aesGcmNonceSizeBytes], wrappedKey[aesGcmNonceSizeBytes:]
+        try:
+            return cryptographyAead.AESGCM(self.keyEncryptionKey).decrypt(nonce, sealedKey, self.keyId.encode())
+        except cryptographyExceptions.InvalidTag as error:
+            raise EnvelopeDecryptionError('Wrapped data key does not match the local key') from error
+
+
+localDataKeyBackend: Optional[LocalDataKeyBackend] = None
+
+
+def getDataKeyBackend(kmsClient, kmsKeyPath: str):
+    global localDataKeyBackend  # pylint: disable=global-statement
+
+    if dataKeyBackendName != 'local':
+        return KmsDataKeyBackend(kmsClient, kmsKeyPath)
+    if localDataKeyBackend is None:
+        rawKey = os.environ.get('LOCAL_DATA_KEY_ENCRYPTION_KEY')
+        if rawKey:
+            keyEncryptionKey = bytes.fromhex(rawKey)
+        else:
+            logging.warning('LOCAL_DATA_KEY_ENCRYPTION_KEY is not set; using a per-process key.')
+            keyEncryptionKey = os.urandom(dataKeySizeBytes)
+        localDataKeyBackend = LocalDataKeyBackend(keyEncryptionKey)
+    return localDataKeyBackend
+
+
+class DataKeyManager:
+    """Holds the active data key for encryption and a TTL/LRU cache of unwrapped keys."""
+
+    def __init__(self, rotationSeconds: float, maxUses: int, cacheTtlSeconds: float, cacheMaxEntries: int):
+        self.rotationSeconds = rotationSeconds
+        self.maxUses = maxUses
+        self.cacheTtlSeconds = cacheTtlSeconds
+        self.cacheMaxEntries = max(1, cacheMaxEntries)
+        self._lock = threading.Lock()
+        self._activeKey: Optional[Dict[str, object]] = None
+        self._unwrappedKeys: 'OrderedDict[Tuple[str, bytes], Tuple[bytes, float]]' = OrderedDict()
+        self._counters = {'wraps': 0, 'unwraps': 0, 'cacheHits': 0, 'cacheMisses': 0, 'evictions': 0}
+
+    def _cacheKey(self, backend, wrappedKey: bytes) -> Tuple[str, bytes]:
+        return backend.keyId, wrappedKey
+
+    def _rememberKey(self, cacheKey: Tuple[str, bytes], dataKey: bytes) -> None:
+        self._unwrappedKeys[cacheKey] = (dataKey, time.monotonic() + self.cacheTtlSeconds)
+        self._unwrappedKeys.move_to_end(cacheKey)
+        while len(self._unwrappedKeys) > self.cacheMaxEntries:
+            self._unwrappedKeys.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def acquireEncryptionKey(self, backend) -> Tuple[bytes, bytes]:
+        with self._lock:
+            activeKey = self._activeKey
+            if (
+                activeKey is not None
+                and activeKey['keyId'] == backend.keyId
+                and activeKey['uses'] < self.maxUses
+                and time.monotonic() - activeKey['createdAt'] < self.rotationSeconds
+            ):
+                activeKey['uses'] += 1
+                return activeKey['dataKey'], activeKey['wrappedKey']
+
+        # Wrap outside the lock; a concurrent rotation just means one extra key.
+        dataKey = os.urandom(dataKeySizeBytes)
+        wrappedKey = backend.wrapKey(dataKey)
+        with self._lock:
+            self._counters['wraps'] += 1
+            self._activeKey = {
+                'keyId': backend.keyId,
+                'dataKey': dataKey,
+                'wrappedKey': wrappedKey,
+                'createdAt': time.monotonic(),
+                'uses': 1,
+            }
+            self._rememberKey(self._cacheKey(backend, wrappedKey), dataKey)
+        return dataKey, wrappedKey
+
+    def resolveDecryptionKey(self, backend, wrappedKey: bytes) -> bytes:
+        cacheKey = self._cacheKey(backend, wrappedKey)
+        with self._lock:
+            cachedEntry = self._unwrappedKeys.get(cacheKey)
+            if cachedEntry is not None and cachedEntry[1] > time.monotonic():
+                self._unwrappedKeys.move_to_end(cacheKey)
+                self._counters['cacheHits'] += 1
+                return cachedEntry[0]
+            self._counters['cacheMisses'] += 1
+
+        dataKey = backend.unwrapKey(wrappedKey)
+        with self._lock:
+            self._counters['unwraps'] += 1
+            self._rememberKey(cacheKey, dataKey)
+        return dataKey
+
+    def getMetrics(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                'mode': encryptionMode,
+                'backend': dataKeyBackendName,
+                'cachedKeys': len(self._unwrappedKeys),
+                'activeKeyUses': self._activeKey['uses'] if self._activeKey else 0,
+                **self._counters,
+            }
+
+
+dataKeyManager = DataKeyManager(
+    dataKeyRotationSeconds, dataKeyMaxUses, dataKeyCacheTtlSeconds, dataKeyCacheMaxEntries
+)
+registerMetricsProvider('dataKeys', dataKeyManager.getMetrics)
+
+
+def encryptSensitivePayload(kmsClient, kmsKeyPath: str, plaintext: bytes, fileId: str) -> Dict[str, str]:
+    """Return the Firestore fields holding ``plaintext`` in the configured encryption mode."""
+    if encryptionMode != 'envelope':
+        encryptResponse = kmsClient.encrypt(request={'name': kmsKeyPath, 'plaintext': plaintext})
+        return {'encryptedData': encryptResponse.ciphertext.hex()}
+
+    backend = getDataKeyBackend(kmsClient, kmsKeyPath)
+    dataKey, wrappedKey = dataKeyManager.acquireEncryptionKey(backend)
+    nonce = os.urandom(aesGcmNonceSizeBytes)
+    cipherText = cryptographyAead.AESGCM(dataKey).encrypt(nonce, plaintext, fileId.encode('utf-8'))
+    return {
+        'encryptionScheme': envelopeEncryptionScheme,
+        'encryptedData': (nonce + cipherText).hex(),
+        'wrappedDataKey': wrappedKey.hex(),
+        'dataKeyBackend': backend.name,
+    }
+
+
+def decryptSensitivePayload(kmsClient, kmsKeyPath: str, fileMetadata: Dict[str, object], cipherText: bytes) -> bytes:
+    """Decrypt ``encryptedData`` for either envelope records or direct KMS records."""
+    encryptionScheme = fileMetadata.get('encryptionScheme')
+    if not encryptionScheme:
+        return kmsClient.decrypt(request={'name': kmsKeyPath, 'ciphertext': cipherText}).plaintext
+    if encryptionScheme != envelopeEncryptionScheme:
+        raise EnvelopeDecryptionError(f'Unsupported encryption scheme: {encryptionScheme}')
+
+    try:
+        wrappedKey = bytes.fromhex(str(fileMetadata.get('wrappedDataKey') or ''))
+    except ValueError as error:
+        raise EnvelopeDecryptionError('Stored data key is not valid hex') from error
+    if not wrappedKey or len(cipherText) <= aesGcmNonceSizeBytes:
+        raise EnvelopeDecryptionError('Stored envelope is incomplete')
+
+    backend = getDataKeyBackend(kmsClient, kmsKeyPath)
+    if fileMetadata.get('dataKeyBackend', backend.name) != backend.name:
+        raise EnvelopeDecryptionError(f"Data key was wrapped by the {fileMetadata.get('dataKeyBackend')} backend")
+
+    dataKey = dataKeyManager.resolveDecryptionKey(backend, wrappedKey)
+    nonce, sealedData = cipherText[:aesGcmNonceSizeBytes], cipherText[aesGcmNonceSizeBytes:]
+    try:
+        return cryptographyAead.AESGCM(dataKey).decrypt(
+            nonce, sealedData, str(fileMetadata.get('fileId') or '').encode('utf-8')
+        )
+    except cryptographyExceptions.InvalidTag as error:
+        raise EnvelopeDecryptionError('Envelope ciphertext failed authentication') from error
+
+
+signedUrlTokenRefreshMarginSeconds = float(os.environ.get('SIGNED_URL_TOKEN_REFRESH_MARGIN_SECONDS', '300'))
+# Used when refreshed credentials report no expiry of their own.
+signedUrlTokenDefaultTtlSeconds = float(os.environ.get('SIGNED_URL_TOKEN_DEFAULT_TTL_SECONDS', '1800'))
+signingScopes = ['https://www.googleapis.com/auth/cloud-platform']
+
+
+gcsHmacAccessId = os.environ.get('GCS_HMAC_ACCESS_ID', '').strip()
+gcsHmacSecret = os.environ.get('GCS_HMAC_SECRET', '').strip()
+gcsSigningHost = 'storage.googleapis.com'
+hmacSigningAlgorithm = 'GOOG4-HMAC-SHA256'
+maxSignedUrlExpirationSeconds = 7 * 24 * 60 * 60
+
+
+def _hmacSha256(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()
+
+
+def generateHmacSignedUrl(
+    accessId: str,
+    secret: str,
+    bucketName: str,
+    objectName: str,
+    expiration: timedelta,
+    method: str = 'GET',
+    now: Optional[datetime] = None,
+) -> str:
+    """Build a V4 signed URL with a GCS HMAC key, entirely in-process."""
+    expirationSeconds = int(expiration.total_seconds())
+    if not 0 < expirationSeconds <= maxSignedUrlExpirationSeconds:
+        raise ValueError(f'Signed URL expiration must be between 1 and {maxSignedUrlExpirationSeconds} seconds')
+
+    signingTime = (now or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    requestTimestamp = signingTime.strftime('%Y%m%dT%H%M%SZ')
+    datestamp = signingTime.strftime('%Y%m%d')
+    credentialScope = f'{datestamp}/auto/storage/goog4_request'
+
+    canonicalUri = f"/{bucketName}/{quote(objectName, safe='/~')}"
+    queryParameters = {
+        'X-Goog-Algorithm': hmacSigningAlgorithm,
+        'X-Goog-Credential': f'{accessId}/{credentialScope}',
+        'X-Goog-Date': requestTimestamp,
+        'X-Goog-Expires': str(expirationSeconds),
+        'X-Goog-SignedHeaders': 'host',
+    }
+    canonicalQueryString = '&'.join(
+        f"{quote(name, safe='-_.~')}={quote(value, safe='-_.~')}"
+        for name, value in sorted(queryParameters.items())
+    )
+    canonicalRequest = '\n'.join(
+        [
+            method.upper(),
+            canonicalUri,
+            canonicalQueryString,
+            f'host:{gcsSigningHost}\n',
+            'host',
+            'UNSIGNED-PAYLOAD',
+        ]
+    )
+    stringToSign = '\n'.join(
+        [
+            hmacSigningAlgorithm,
+            requestTimestamp,
+            credentialScope,
+            hashlib.sha256(canonicalRequest.encode('utf-8')).hexdigest(),
+        ]
+    )
+
+    signingKey = ('GOOG4' + secret).encode('utf-8')
+    for scopePart in (datestamp, 'auto', 'storage', 'goog4_request'):
+        signingKey = _hmacSha256(signingKey, scopePart)
+    signature = hmac.new(signingKey, stringToSign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    return f'https://{gcsSigningHost}{canonicalUri}?{canonicalQueryString}&X-Goog-Signature={signature}'
+
+
+class UrlSigner:
+    """Generates V4 signed URLs, caching scoped credentials and their access token for IAM signing.
+
+    With an HMAC key configured, URLs are signed in-process and nothing else
+    is consulted. Otherwise credentials with a private key sign locally, and
+    the rest (Cloud Run's metadata server credentials) sign through IAM
+    signBlob, which needs an access token; the token is refreshed once,
+    shortly before it expires, instead of per URL.
+    """
+
+    def __init__(
+        self,
+        refreshMarginSeconds: float,
+        defaultTokenTtlSeconds: float,
+        hmacKey: Optional[Tuple[str, str]] = None,
+    ):
+        self.refreshMarginSeconds = refreshMarginSeconds
+        self.defaultTokenTtlSeconds = defaultTokenTtlSeconds
+        self.hmacKey = hmacKey
+        self._lock = threading.Lock()
+        self._baseCredentials = None
+        self._scopedCredentials = None
+        self._tokenExpiresAt = 0.0
+        self._counters = {
+            'signedUrls': 0,
+            'hmacSignedUrls': 0,
+            'iamSignedUrls': 0,
+            'tokenRefreshes': 0,
+            'failures': 0,
+        }
+        self._totalSignMs = 0.0
+        self._maxSignMs = 0.0
+        self._lastRefreshMs: Optional[float] = None
+
+    def _credentialsExpiresAt(self, credentials) -> float:
+        expiry = getattr(credentials, 'expiry', None)
+        if not isinstance(expiry, datetime):
+            return time.time() + self.defaultTokenTtlSeconds
+        if expiry.tzinfo is None:
+            expiry = expiry.replace(tzinfo=timezone.utc)
+        return expiry.timestamp()
+
+    def _scopeCredentials(self, credentials):
+        withScopesMethod = getattr(credentials, 'with_scopes_if_required', None)
+        if callable(withScopesMethod):
+            scopedCredentials = withScopesMethod(signingScopes)
+            if scopedCredentials is not None:
+                return scopedCredentials
+        return credentials
+
+    def _tokenIsFresh(self, credentials) -> bool:
+        return (
+            self._scopedCredentials is not None
+            and self._baseCredentials is credentials
+            and getattr(self._scopedCredentials, 'token', None)
+            and time.time() < self._tokenExpiresAt - self.refreshMarginSeconds
+        )
+
+    def getIamSigningCredentials(self, credentials) -> Tuple[str, str]:
+        """Return ``(serviceAccountEmail, accessToken)``, refreshing at most once across threads."""
+        with self._lock:
+            if not self._tokenIsFresh(credentials):
+                if self._baseCredentials is not credentials or self._scopedCredentials is None:
+                    self._scopedCredentials = self._scopeCredentials(credentials)
+                    self._baseCredentials = credentials
+                refreshStartTime = time.perf_counter()
+                self._scopedCredentials.refresh(Request())
+                self._lastRefreshMs = _elapsedMilliseconds(refreshStartTime)
+                self._tokenExpiresAt = self._credentialsExpiresAt(self._scopedCredentials)
+                self._counters['tokenRefreshes'] += 1
+            scopedCredentials = self._scopedCredentials
+
+        accessToken = getattr(scopedCredentials, 'token', None)
+        if not accessToken:
+            raise AttributeError('Credentials missing access token required for IAM signing')
+        serviceAccountEmail = getattr(scopedCredentials, 'service_account_email', None)
+        if not serviceAccountEmail:
+            raise AttributeError('Credentials missing service_account_email required for IAM signing')
+        return serviceAccountEmail, accessToken
+
+    def sign(self, storageClient, blob, expiration: timedelta, method: str = 'GET') -> str:
+        startTime = time.perf_counter()
+        signingKwargs: Dict[str, object] = {'version': 'v4', 'expiration': expiration, 'method': method}
+        iamSigning = False
+        try:
+            if self.hmacKey is not None:
+                accessId, secret = self.hmacKey
+                signedUrl = generateHmacSignedUrl(accessId, secret, blob.bucket.name, blob.name, expiration, method)
+            else:
+                credentials = getattr(storageClient, '_credentials', None)
+                iamSigning = credentials is not None and not callable(getattr(credentials, 'sign_bytes', None))
+                if iamSigning:
+                    serviceAccountEmail, accessToken = self.getIamSigningCredentials(credentials)
+                    signingKwargs['service_account_email'] = serviceAccountEmail
+                    signingKwargs['access_token'] = accessToken
+                signedUrl = blob.generate_signed_url(**signingKwargs)
+        except Exception:
+            with self._lock:
+                self._counters['failures'] += 1
+            raise
+
+        elapsedMs = _elapsedMilliseconds(startTime)
+        with self._lock:
+            self._counters['signedUrls'] += 1
+            if self.hmacKey is not None:
+                self._counters['hmacSignedUrls'] += 1
+            elif iamSigning:
+                self._counters['iamSignedUrls'] += 1
+            self._totalSignMs += elapsedMs
+            self._maxSignMs = max(self._maxSignMs, elapsedMs)
+        return signedUrl
+
+    def getMetrics(self) -> Dict[str, object]:
+        with self._lock:
+            signedUrls = self._counters['signedUrls']
+            return {
+                'mode': 'hmac' if self.hmacKey is not None else 'credentials',
+                **self._counters,
+                'avgSignMs': round(self._totalSignMs / signedUrls, 3) if signedUrls else None,
+                'maxSignMs': round(self._maxSignMs, 3),
+                'lastTokenRefreshMs': self._lastRefreshMs,
+                'tokenExpiresInSeconds': (
+                    round(self._tokenExpiresAt - time.time(), 1) if self._scopedCredentials is not None else None
+                ),
+            }
+
+
+if bool(gcsHmacAccessId) != bool(gcsHmacSecret):
+    logging.warning('Set both GCS_HMAC_ACCESS_ID and GCS_HMAC_SECRET to sign URLs with an HMAC key; ignoring it.')
+urlSigner = UrlSigner(
+    signedUrlTokenRefreshMarginSeconds,
+    signedUrlTokenDefaultTtlSeconds,
+    hmacKey=(gcsHmacAccessId, gcsHmacSecret) if gcsHmacAccessId and gcsHmacSecret else None,
+)
+registerMetricsProvider('urlSigner', urlSigner.getMetrics)
+
+
+uploadStageWorkers = int(os.environ.get('UPLOAD_STAGE_WORKERS') or str(storageHttpPoolSize))
+uploadStageExecutor: Optional[ThreadPoolExecutor] = None
+uploadStageLock = threading.Lock()
+uploadStageStats: Dict[str, Dict[str, float]] = {}
+
+
+def getUploadStageExecutor() -> ThreadPoolExecutor:
+    global uploadStageExecutor  # pylint: disable=global-statement
+
+    if uploadStageExecutor is None:
+        with uploadStageLock:
+            if uploadStageExecutor is None:
+                uploadStageExecutor = ThreadPoolExecutor(
+                    max_workers=max(1, uploadStageWorkers), thread_name_prefix='upload-stage'
+                )
+    return uploadStageExecutor
+
+
+def _runTimedUploadStage(stageTimings: Dict[str, float], stageName: str, function, *args, **kwargs):
+    startTime = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        stageTimings[stageName] = _elapsedMilliseconds(startTime)
+
+
+def recordUploadStageTimings(stageTimings: Dict[str, float]) -> None:
+    with uploadStageLock:
+        for stageName, elapsedMs in stageTimings.items():
+            stageStats = uploadStageStats.setdefault(stageName, {'count': 0, 'totalMs': 0.0, 'maxMs': 0.0})
+            stageStats['count'] += 1
+            stageStats['totalMs'] += elapsedMs
+            stageStats['maxMs'] = max(stageStats['maxMs'], elapsedMs)
+
+
+def getUploadStageMetrics() -> Dict[str, object]:
+    with uploadStageLock:
+        return {
+            'workers': uploadStageWorkers,
+            'stages': {
+                stageName: {
+                    'count': int(stageStats['count']),
+                    'avgMs': round(stageStats['totalMs'] / stageStats['count'], 2),
+                    'maxMs': round(stageStats['maxMs'], 2),
+                }
+                for stageName, stageStats in uploadStageStats.items()
+            },
+        }
+
+
+registerMetricsProvider('uploadStages', getUploadStageMetrics)
+
+
+@app.route('/upload', methods=['POST'])
+@apply_rate_limit(RATE_LIMIT_UPLOAD)  # Begrens opplastinger for å forhindre ressursutmattelse
+def uploadFile():
+    logging.info('Received request to /upload')
+    try:
+        clients, errorResponse = fetchClientsOrResponse()
+        if errorResponse:
+            return jsonify(errorResponse[0]), errorResponse[1]
+
+        storageClient = clients.storageClient
+        firestoreClient = clients.firestoreClient
+        kmsClient = clients.kmsClient
+        kmsKeyPath = clients.kmsKeyPath
+        gcsBucketName = clients.gcsBucketName
+
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            logging.warning('Upload payload is not a JSON object.')
+            return jsonify({'error': 'Expected JSON body'}), 400
+
+        recipientId = payload.get('recipientId') or payload.get('recipient_id')
+        if not recipientId:
+            logging.warning('Recipient ID is missing.')
+            return jsonify({'error': 'Recipient ID is required'}), 400
+
+        productIdRaw = payload.get('productId') or payload.get('product_id')
+        if not productIdRaw:
+            logging.warning('Product ID is missing.')
+            return jsonify({'error': 'Product ID is required'}), 400
+
+        try:
+            productUuid = uuid.UUID(str(productIdRaw))
+        except (ValueError, AttributeError, TypeError):
+            logging.warning('Invalid product ID provided: %s', productIdRaw)
+            return jsonify({'error': 'Invalid product ID format'}), 400
+
+        productId = str(productUuid)
+
+        gcodeUrl = payload.get('gcodeUrl')
+        if not gcodeUrl:
+            logging.warning('Missing gcodeUrl in upload payload.')
+            return jsonify({'error': 'gcodeUrl is required'}), 400
+
+        unencryptedData, errorResponse = parseJsonObjectPayload(
+            payload.get('unencrypted_data', {}), 'unencrypted_data'
+        )
+        if errorResponse:
+            return jsonify(errorResponse[0]), errorResponse[1]
+
+        encryptedDataPayload, errorResponse = parseJsonObjectPayload(
+            payload.get('encrypted_data_payload', {}), 'encrypted_data_payload'
+        )
+        if errorResponse:
+            return jsonify(errorResponse[0]), errorResponse[1]
+
+        fileId = str(uuid.uuid4())
+        originalFilename = (
+            payload.get('originalFilename')
+            or payload.get('lastRequestFilename')
+            or payload.get('original_filename')
+            or payload.get('last_request_filename')
+        )
 
         if not originalFilename:
             parsedUrl = urlparse(gcodeUrl)
@@ -942,55 +2429,77 @@ def uploadFile():
         if printerApiToken:
             downloadHeaders['X-API-Key'] = printerApiToken
 
+        gcsObjectName = f"{recipientId}/{productId}_{normalizedFilename}"
+        bucket = storageClient.bucket(gcsBucketName)
+        blob = bucket.blob(gcsObjectName)
+
+        # Encryption does not depend on the G-code bytes, so it runs on the
+        # stage executor while this thread moves the file into GCS.
+        uploadStartTime = time.perf_counter()
+        stageTimings: Dict[str, float] = {}
+        encryptFuture = getUploadStageExecutor().submit(
+            _runTimedUploadStage,
+            stageTimings,
+            'encrypt',
+            encryptSensitivePayload,
+            kmsClient,
+            kmsKeyPath,
+            json.dumps(encryptedDataPayload).encode('utf-8'),
+            fileId,
+        )
+
         try:
-            downloadResponse = requests.get(
-                gcodeUrl,
-                headers=downloadHeaders,
-                timeout=60,
+            ingestResult = _runTimedUploadStage(
+                stageTimings, 'ingest', ingestGcodeSource, storageClient, gcodeUrl, downloadHeaders, blob
+            )
+        except UploadTooLargeError as error:
+            encryptFuture.cancel()
+            logging.warning('Rejected G-code from %s: %s', gcodeUrl, error)
+            return (
+                jsonify({'error': 'G-code file exceeds the maximum upload size', 'maxBytes': error.maxBytes}),
+                413,
             )
-            downloadResponse.raise_for_status()
         except requests.RequestException as error:
+            encryptFuture.cancel()
             logging.error('Failed to download G-code from %s: %s', gcodeUrl, error)
             return (
                 jsonify({'error': 'Failed to download G-code from provided URL'}),
                 502,
             )
-
-        downloadBuffer = io.BytesIO(downloadResponse.content)
-
-        gcsObjectName = f"{recipientId}/{productId}_{normalizedFilename}"
-        bucket = storageClient.bucket(gcsBucketName)
-        blob = bucket.blob(gcsObjectName)
-
-        blob.upload_from_file(downloadBuffer)
+        except Exception:
+            encryptFuture.cancel()
+            raise
         logging.info(
-            'File %s uploaded to gs://%s/%s', normalizedFilename, gcsBucketName, gcsObjectName
+            'File %s stored at gs://%s/%s via %s (%s bytes)',
+            normalizedFilename,
+            gcsBucketName,
+            gcsObjectName,
+            ingestResult['ingestMode'],
+            ingestResult['sizeBytes'],
         )
 
         try:
-            encryptResponse = kmsClient.encrypt(
-                request={
-                    'name': kmsKeyPath,
-                    'plaintext': json.dumps(encryptedDataPayload).encode('utf-8'),
-                }
-            )
-            encryptedDataCipherText = encryptResponse.ciphertext.hex()
-            logging.info('Sensitive data encrypted with KMS.')
+            encryptedFields = encryptFuture.result()
+            logging.info('Sensitive data encrypted (%s mode).', encryptionMode)
         except GoogleAPICallError as error:
             logging.error('KMS encryption failed: %s', error)
             return jsonify({'error': f'KMS encryption failed: {error.message}'}), 500
 
-        fetchToken = generateFetchToken()
+        fetchTokenExpiry = datetime.now(timezone.utc) + timedelta(minutes=fetchTokenTtlMinutes)
+        fetchToken = issueFetchToken(fileId, fetchTokenExpiry)
         metadata = {
             'fileId': fileId,
             'originalFilename': normalizedFilename,
             'gcsPath': gcsObjectName,
-            'encryptedData': encryptedDataCipherText,
+            'sizeBytes': ingestResult['sizeBytes'],
+            'sha256': ingestResult['sha256'],
+            'ingestMode': ingestResult['ingestMode'],
+            **encryptedFields,
             'unencryptedData': unencryptedData,
             'recipientId': recipientId,
             'productId': productId,
             'fetchToken': fetchToken,
-            'fetchTokenExpiry': datetime.now(timezone.utc) + timedelta(minutes=fetchTokenTtlMinutes),
+            'fetchTokenExpiry': fetchTokenExpiry,
             'fetchTokenConsumed': False,
             'status': 'uploaded',
             'timestamp': firestore.SERVER_TIMESTAMP,
@@ -1002,12 +2511,33 @@ def uploadFile():
             ),
         }
 
+        if ingestResult['crc32c']:
+            metadata['crc32c'] = ingestResult['crc32c']
+        if ingestResult['sourceGcsUri']:
+            metadata['sourceGcsUri'] = ingestResult['sourceGcsUri']
+
         upstreamFileId = payload.get('fileId')
         if upstreamFileId:
             metadata['sourceFileId'] = str(upstreamFileId)
 
-        firestoreClient.collection(firestoreCollectionFiles).document(fileId).set(metadata)
+        writeBatch = firestoreClient.batch()
+        if not isSignedFetchToken(fetchToken):
+            writeBatch.set(
+                getFetchTokenIndexReference(firestoreClient, fetchToken),
+                buildFetchTokenIndexEntry(fileId, fetchTokenExpiry),
+            )
+        writeBatch.set(
+            getLatestFilePointerReference(firestoreClient, productId),
+            buildLatestFilePointer(productId, fileId, recipientId, firestore.SERVER_TIMESTAMP),
+        )
+        bumpPollVersion(firestoreClient, 'recipient', recipientId, 'pending', writeBatch=writeBatch)
+        writeBatch.set(firestoreClient.collection(firestoreCollectionFiles).document(fileId), metadata)
+        _runTimedUploadStage(stageTimings, 'firestore', writeBatch.commit)
+        latestFileCache.invalidateProduct(productId)
         logging.info('Metadata for file %s stored in Firestore.', fileId)
+        stageTimings['total'] = _elapsedMilliseconds(uploadStartTime)
+        recordUploadStageTimings(stageTimings)
+        logEvent('upload_stages', fileId=fileId, ingestMode=ingestResult['ingestMode'], **stageTimings)
 
         return jsonify(
             {
@@ -1049,6 +2579,140 @@ def pickLatestDocumentByTimestamp(documentSnapshots: List):
     return latestSnapshot
 
 
+# Printers post /products/<productId>/status repeatedly while a job runs; the
+# resolved latest file is cached per product so those posts skip the lookup.
+# Writes from this instance invalidate the entry; writes from other instances
+# are picked up when it expires.
+latestFileCacheTtlSeconds = float(os.environ.get('LATEST_FILE_CACHE_TTL_SECONDS', '30'))
+latestFileCacheMaxEntries = int(os.environ.get('LATEST_FILE_CACHE_MAX_ENTRIES', '2048'))
+
+
+class LatestFileCache:
+    """TTL/LRU cache of the latest files snapshot per productId."""
+
+    def __init__(self, ttlSeconds: float, maxEntries: int):
+        self.ttlSeconds = ttlSeconds
+        self.maxEntries = max(1, maxEntries)
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Tuple[object, float]]' = OrderedDict()
+        self._generation = 0
+        self._counters = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, productId: str) -> Tuple[Optional[object], int]:
+        """Return the cached snapshot (or None) and the generation to pass to ``put``."""
+        with self._lock:
+            cachedEntry = self._entries.get(productId)
+            if cachedEntry is not None:
+                if cachedEntry[1] > time.monotonic():
+                    self._entries.move_to_end(productId)
+                    self._counters['hits'] += 1
+                    return cachedEntry[0], self._generation
+                del self._entries[productId]
+                self._counters['expired'] += 1
+            self._counters['misses'] += 1
+            return None, self._generation
+
+    def put(self, productId: str, documentSnapshot, generation: int) -> None:
+        if self.ttlSeconds <= 0:
+            return
+        with self._lock:
+            # An invalidation since the lookup started means the snapshot may
+            # predate that write, so it is not cached.
+            if generation != self._generation:
+                return
+            self._entries[productId] = (documentSnapshot, time.monotonic() + self.ttlSeconds)
+            self._entries.move_to_end(productId)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def invalidateProduct(self, productId: Optional[str]) -> None:
+        with self._lock:
+            self._generation += 1
+            if productId and self._entries.pop(productId, None) is not None:
+                self._counters['invalidations'] += 1
+
+    def invalidateFile(self, fileId: Optional[str]) -> None:
+        with self._lock:
+            self._generation += 1
+            for productId, (documentSnapshot, _) in list(self._entries.items()):
+                if getattr(documentSnapshot, 'id', None) == fileId:
+                    del self._entries[productId]
+                    self._counters['invalidations'] += 1
+
+    def getMetrics(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['misses']
+            return {
+                'entries': len(self._entries),
+                'ttlSeconds': self.ttlSeconds,
+                **self._counters,
+                'hitRatio': round(self._counters['hits'] / lookups, 3) if lookups else None,
+            }
+
+
+latestFileCache = LatestFileCache(latestFileCacheTtlSeconds, latestFileCacheMaxEntries)
+registerMetricsProvider('latestFiles', latestFileCache.getMetrics)
+
+
+def getLatestFilePointerReference(firestoreClient: firestore.Client, productId: str):
+    return firestoreClient.collection(firestoreCollectionProducts).document(productId)
+
+
+def buildLatestFilePointer(productId: str, fileId: str, recipientId: Optional[str], fileTimestamp) -> Dict[str, object]:
+    return {
+        'productId': productId,
+        'latestFileId': fileId,
+        'recipientId': recipientId,
+        'latestFileTimestamp': fileTimestamp,
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }
+
+
+def repairLatestFilePointer(firestoreClient: firestore.Client, productId: str, pointerSnapshot, fileSnapshot) -> bool:
+    """Point ``productId`` at ``fileSnapshot`` unless someone else moved the pointer first."""
+    fileMetadata = fileSnapshot.to_dict() or {}
+    pointerData = buildLatestFilePointer(
+        productId, fileSnapshot.id, fileMetadata.get('recipientId'), fileMetadata.get('timestamp')
+    )
+    pointerReference = getLatestFilePointerReference(firestoreClient, productId)
+    try:
+        if pointerSnapshot is not None and pointerSnapshot.exists:
+            pointerReference.update(
+                pointerData, option=firestoreClient.write_option(last_update_time=pointerSnapshot.update_time)
+            )
+        else:
+            pointerReference.create(pointerData)
+    except Exception as error:  # pylint: disable=broad-except
+        logging.info('Latest file pointer for product %s was not repaired: %s', productId, error)
+        return False
+    return True
+
+
+def findLatestProductFile(firestoreClient: firestore.Client, productId: str):
+    """Return the newest files snapshot for ``productId`` through its latestFileId pointer.
+
+    Products without a usable pointer (uploaded before pointers existed, or
+    whose file is gone) fall back to a full scan, and the pointer is repaired.
+    """
+    pointerSnapshot = getLatestFilePointerReference(firestoreClient, productId).get()
+    if pointerSnapshot.exists:
+        latestFileId = (pointerSnapshot.to_dict() or {}).get('latestFileId')
+        if latestFileId:
+            fileSnapshot = firestoreClient.collection(firestoreCollectionFiles).document(latestFileId).get()
+            if fileSnapshot.exists:
+                return fileSnapshot
+        logging.warning('Latest file pointer for product %s is stale.', productId)
+
+    fileQuery = firestoreClient.collection(firestoreCollectionFiles).where(
+        filter=FieldFilter('productId', '==', productId)
+    )
+    fileSnapshot = pickLatestDocumentByTimestamp(list(fileQuery.stream()))
+    if fileSnapshot is not None:
+        repairLatestFilePointer(firestoreClient, productId, pointerSnapshot, fileSnapshot)
+    return fileSnapshot
+
+
 def buildHandshakeResponseMetadata(fileMetadata: dict) -> dict:
     metadataPayload = fileMetadata.get('unencryptedData')
     if isinstance(metadataPayload, dict):
@@ -1090,18 +2754,9 @@ def productHandshake(productId: str):
             logging.warning('Invalid handshake status received: %s', clientStatus)
             return jsonify({'error': 'Invalid status value'}), 400
 
-        fileQuery = firestoreClient.collection(firestoreCollectionFiles).where(
-            filter=FieldFilter('productId', '==', productId)
-        )
-        documentSnapshots = list(fileQuery.stream())
-
-        if not documentSnapshots:
-            logging.info('No files found in handshake for product %s', productId)
-            return jsonify({'error': 'File not found for product'}), 404
-
-        documentSnapshot = pickLatestDocumentByTimestamp(documentSnapshots)
+        documentSnapshot = findLatestProductFile(firestoreClient, productId)
         if documentSnapshot is None:
-            logging.info('No valid document snapshots for product %s', productId)
+            logging.info('No files found in handshake for product %s', productId)
             return jsonify({'error': 'File not found for product'}), 404
 
         fileMetadata = documentSnapshot.to_dict() or {}
@@ -1156,9 +2811,18 @@ def productHandshake(productId: str):
                 }
             )
 
-        firestoreClient.collection(firestoreCollectionFiles).document(
-            documentSnapshot.id
-        ).update(handshakeUpdatePayload)
+        try:
+            updateFileAndReleaseFetchToken(
+                firestoreClient,
+                documentSnapshot.id,
+                handshakeUpdatePayload,
+                fetchToken if fetchMode == 'metadata' else None,
+                lastUpdateTime=getattr(documentSnapshot, 'update_time', None) if fetchMode == 'metadata' else None,
+                recipientId=fileMetadata.get('recipientId'),
+            )
+        except FetchTokenAlreadyConsumedError:
+            logging.warning('File %s changed during handshake for product %s.', documentSnapshot.id, productId)
+            return jsonify({'error': 'Fetch token already used'}), 410
 
         responsePayload = {
             'productId': productId,
@@ -1254,19 +2918,13 @@ def productStatusUpdate(productId: str):
 
         recipientId = payload.get('recipientId')
 
-        fileQuery = firestoreClient.collection(firestoreCollectionFiles).where(
-            filter=FieldFilter('productId', '==', productId)
-        )
-        documentSnapshots = list(fileQuery.stream())
-
-        if not documentSnapshots:
-            logging.info('No files found when recording status for product %s', productId)
-            return jsonify({'error': 'File not found for product'}), 404
-
-        documentSnapshot = pickLatestDocumentByTimestamp(documentSnapshots)
+        documentSnapshot, cacheGeneration = latestFileCache.get(productId)
         if documentSnapshot is None:
-            logging.info('No valid file snapshots found when recording status for product %s', productId)
-            return jsonify({'error': 'File not found for product'}), 404
+            documentSnapshot = findLatestProductFile(firestoreClient, productId)
+            if documentSnapshot is None:
+                logging.info('No files found when recording status for product %s', productId)
+                return jsonify({'error': 'File not found for product'}), 404
+            latestFileCache.put(productId, documentSnapshot, cacheGeneration)
 
         fileMetadata = documentSnapshot.to_dict() or {}
 
@@ -1361,7 +3019,7 @@ def productStatusUpdate(productId: str):
         if currentFileStatus is not None:
             statusRecord['fileStatus'] = currentFileStatus
 
-        firestoreClient.collection(firestoreCollectionPrinterStatus).add(statusRecord)
+        addPrinterStatusRecord(firestoreClient, statusRecord)
         logEvent(
             'status_received',
             appId=payload.get('appId'),
@@ -1377,13 +3035,125 @@ def productStatusUpdate(productId: str):
             progress=payload.get('jobProgress'),
             mqttReady=payload.get('mqttReady'),
         )
-        logging.info('Stored product status update for %s with file %s', productId, documentSnapshot.id)
-
-        return jsonify({'message': 'Product status recorded'}), 200
-
-    except Exception:  # pylint: disable=broad-except
-        logging.exception('Unexpected error while recording product status update for %s', productId)
-        return jsonify({'error': 'Internal server error'}), 500
+        logging.info('Stored product status update for %s with file %s', productId, documentSnapshot.id)
+
+        return jsonify({'message': 'Product status recorded'}), 200
+
+    except Exception:  # pylint: disable=broad-except
+        logging.exception('Unexpected error while recording product status update for %s', productId)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+def _decryptFetchedFileData(kmsClient, kmsKeyPath: str, documentSnapshot, fileMetadata: Dict[str, object]):
+    unencryptedData = fileMetadata.get('unencryptedData')
+    encryptedDataHex = fileMetadata.get('encryptedData')
+
+    if not encryptedDataHex:
+        if unencryptedData is None:
+            logging.warning(
+                'Missing encrypted and unencrypted data for file %s',
+                documentSnapshot.id,
+            )
+            return None, (jsonify({'error': 'File metadata is incomplete'}), 422)
+
+        logging.info(
+            'No encrypted data found for file %s; using stored unencrypted metadata.',
+            documentSnapshot.id,
+        )
+        return unencryptedData, None
+
+    try:
+        encryptedDataCipherText = bytes.fromhex(encryptedDataHex)
+    except ValueError:
+        logging.warning(
+            'Invalid encryptedData stored for file %s', documentSnapshot.id
+        )
+        return None, (jsonify({'error': 'Stored encrypted data is invalid'}), 422)
+
+    try:
+        decryptedPlaintext = decryptSensitivePayload(
+            kmsClient, kmsKeyPath, fileMetadata, encryptedDataCipherText
+        )
+    except EnvelopeDecryptionError as error:
+        logging.warning('Envelope decryption failed for file %s: %s', documentSnapshot.id, error)
+        return None, (jsonify({'error': 'Stored encrypted data is invalid'}), 422)
+    except GoogleAPICallError as error:
+        logging.error('KMS decryption failed: %s', error)
+        return None, (jsonify({'error': f'KMS decryption failed: {error.message}'}), 500)
+
+    try:
+        decryptedData = json.loads(decryptedPlaintext.decode('utf-8'))
+    except json.JSONDecodeError:
+        logging.warning(
+            'Decrypted metadata is not valid JSON for file %s',
+            documentSnapshot.id,
+        )
+        return None, (jsonify({'error': 'Decrypted metadata is invalid JSON'}), 422)
+    logging.info('Sensitive data decrypted.')
+    return decryptedData, None
+
+
+def _signFetchedFileUrl(storageClient, gcsBucketName: str, documentSnapshot, gcsPath: Optional[str]):
+    if not gcsPath:
+        logging.warning(
+            'Missing gcsPath in metadata for file %s', documentSnapshot.id
+        )
+        return None, (
+            jsonify({'error': 'File metadata is incomplete: missing gcsPath'}),
+            422,
+        )
+
+    blob = storageClient.bucket(gcsBucketName).blob(gcsPath)
+
+    try:
+        signedUrl = urlSigner.sign(storageClient, blob, timedelta(minutes=15))
+    except (AttributeError, ImportError, TypeError, GoogleAuthError) as error:
+        logging.exception(
+            'Service account is missing a signing key required for signed URL generation: %s',
+            error,
+        )
+        return None, (
+            jsonify(
+                {
+                    'error': 'Service account lacks a signing capability required for signed URL generation',
+                    'detail': str(error),
+                }
+            ),
+            503,
+        )
+    except (Forbidden, PermissionDenied, Unauthorized) as error:
+        missingPermissions = ['storage.objects.sign', 'iam.serviceAccounts.signBlob']
+        logging.error(
+            'Missing IAM permissions for signed URL generation: %s',
+            error,
+        )
+        return None, (
+            jsonify(
+                {
+                    'error': 'Missing required IAM permissions to generate signed URL',
+                    'missingPermissions': missingPermissions,
+                    'detail': str(error),
+                }
+            ),
+            403,
+        )
+    except GoogleAPICallError as error:
+        logging.exception(
+            'Storage API call failed during signed URL generation: %s',
+            error,
+        )
+        errorDetail = getattr(error, 'message', str(error))
+        return None, (
+            jsonify(
+                {
+                    'error': 'Storage service temporarily unavailable for signed URL generation',
+                    'detail': errorDetail,
+                }
+            ),
+            503,
+        )
+    logging.info('Generated signed URL for gs://%s/%s', gcsBucketName, gcsPath)
+    return signedUrl, None
 
 
 @app.route('/fetch/<fetchToken>', methods=['GET'])
@@ -1391,6 +3161,20 @@ def productStatusUpdate(productId: str):
 def fetchFile(fetchToken: str):
     logging.info('Received request to /fetch/%s', fetchToken)
     try:
+        # Signed tokens are checked before any client or Firestore work, so
+        # forged and expired ones cost no I/O.
+        if isSignedFetchToken(fetchToken):
+            try:
+                verifySignedFetchToken(fetchToken)
+            except InvalidFetchTokenError as error:
+                logging.warning('Rejected signed fetch token (%s).', error.reason)
+                if error.statusCode == 410:
+                    return jsonify({'error': 'Fetch token expired'}), 410
+                return jsonify({'error': 'File not found or token invalid/expired'}), 404
+        elif fetchTokenSigningKeys and not fetchTokenAllowUnsigned:
+            logging.warning('Rejected unsigned fetch token.')
+            return jsonify({'error': 'File not found or token invalid/expired'}), 404
+
         clients, errorResponse = fetchClientsOrResponse()
         if errorResponse:
             return jsonify(errorResponse[0]), errorResponse[1]
@@ -1405,18 +3189,11 @@ def fetchFile(fetchToken: str):
             logging.warning('Fetch token is missing.')
             return jsonify({'error': 'Fetch token is required'}), 400
 
-        fileQuery = (
-            firestoreClient.collection(firestoreCollectionFiles)
-            .where(filter=FieldFilter('fetchToken', '==', fetchToken))
-            .limit(1)
-        )
-        fileDocuments = list(fileQuery.stream())
-
-        if not fileDocuments:
+        documentSnapshot = findFileByFetchToken(firestoreClient, fetchToken)
+        if documentSnapshot is None:
             logging.warning('No file found for fetch token: %s', fetchToken)
             return jsonify({'error': 'File not found or token invalid/expired'}), 404
 
-        documentSnapshot = fileDocuments[0]
         fileMetadata = documentSnapshot.to_dict() or {}
 
         if fileMetadata.get('fetchTokenConsumed'):
@@ -1429,169 +3206,10 @@ def fetchFile(fetchToken: str):
             logging.warning('Fetch token expired for file %s', documentSnapshot.id)
             return jsonify({'error': 'Fetch token expired'}), 410
 
-        unencryptedData = fileMetadata.get('unencryptedData')
-        encryptedDataHex = fileMetadata.get('encryptedData')
-        decryptedData = {}
-
-        if encryptedDataHex:
-            try:
-                encryptedDataCipherText = bytes.fromhex(encryptedDataHex)
-            except ValueError:
-                logging.warning(
-                    'Invalid encryptedData stored for file %s', documentSnapshot.id
-                )
-                return (
-                    jsonify({'error': 'Stored encrypted data is invalid'}),
-                    422,
-                )
-
-            try:
-                decryptResponse = kmsClient.decrypt(
-                    request={'name': kmsKeyPath, 'ciphertext': encryptedDataCipherText}
-                )
-                try:
-                    decryptedData = json.loads(decryptResponse.plaintext.decode('utf-8'))
-                except json.JSONDecodeError:
-                    logging.warning(
-                        'Decrypted metadata is not valid JSON for file %s',
-                        documentSnapshot.id,
-                    )
-                    return jsonify({'error': 'Decrypted metadata is invalid JSON'}), 422
-                logging.info('Sensitive data decrypted with KMS.')
-            except GoogleAPICallError as error:
-                logging.error('KMS decryption failed: %s', error)
-                return jsonify({'error': f'KMS decryption failed: {error.message}'}), 500
-        else:
-            if unencryptedData is None:
-                logging.warning(
-                    'Missing encrypted and unencrypted data for file %s',
-                    documentSnapshot.id,
-                )
-                return jsonify({'error': 'File metadata is incomplete'}), 422
-
-            decryptedData = unencryptedData
-            logging.info(
-                'No encrypted data found for file %s; using stored unencrypted metadata.',
-                documentSnapshot.id,
-            )
-
-
         requestArgs = getattr(request, 'args', {}) or {}
         fetchMode = str(requestArgs.get('mode', 'full')).lower()
         metadataOnly = fetchMode == 'metadata'
 
-        signedUrl = None
-        gcsPath = fileMetadata.get('gcsPath')
-        if not metadataOnly:
-            bucket = storageClient.bucket(gcsBucketName)
-            if not gcsPath:
-                logging.warning(
-                    'Missing gcsPath in metadata for file %s', documentSnapshot.id
-                )
-                return (
-                    jsonify({'error': 'File metadata is incomplete: missing gcsPath'}),
-                    422,
-                )
-
-            blob = bucket.blob(gcsPath)
-
-            try:
-                credentials = getattr(storageClient, '_credentials', None)
-                if credentials is not None:
-                    signBytesMethod = getattr(credentials, 'sign_bytes', None)
-                    if callable(signBytesMethod):
-                        signedUrl = blob.generate_signed_url(
-                            version='v4',
-                            expiration=timedelta(minutes=15),
-                            method='GET',
-                        )
-                    else:
-                        if Request is None:
-                            raise ImportError('google.auth Request is required for IAM signing')
-                        requestAdapter = Request()
-                        scopedCredentials = credentials
-                        withScopesMethod = getattr(credentials, 'with_scopes_if_required', None)
-                        if callable(withScopesMethod):
-                            scopedCredentials = withScopesMethod(
-                                ['https://www.googleapis.com/auth/cloud-platform']
-                            )
-                            if scopedCredentials is None:
-                                scopedCredentials = credentials
-                        credentials = scopedCredentials
-                        credentials.refresh(requestAdapter)
-                        accessToken = getattr(credentials, 'token', None)
-                        if not accessToken:
-                            raise AttributeError(
-                                'Credentials missing access token required for IAM signing'
-                            )
-                        serviceAccountEmail = getattr(
-                            credentials, 'service_account_email', None
-                        )
-                        if not serviceAccountEmail:
-                            raise AttributeError(
-                                'Credentials missing service_account_email required for IAM signing'
-                            )
-                        signedUrl = blob.generate_signed_url(
-                            version='v4',
-                            expiration=timedelta(minutes=15),
-                            method='GET',
-                            service_account_email=serviceAccountEmail,
-                            access_token=accessToken,
-                        )
-
-                if signedUrl is None:
-                    signedUrl = blob.generate_signed_url(
-                        version='v4',
-                        expiration=timedelta(minutes=15),
-                        method='GET',
-                    )
-            except (AttributeError, ImportError, TypeError, GoogleAuthError) as error:
-                logging.exception(
-                    'Service account is missing a signing key required for signed URL generation: %s',
-                    error,
-                )
-                return (
-                    jsonify(
-                        {
-                            'error': 'Service account lacks a signing capability required for signed URL generation',
-                            'detail': str(error),
-                        }
-                    ),
-                    503,
-                )
-            except (Forbidden, PermissionDenied, Unauthorized) as error:
-                missingPermissions = ['storage.objects.sign', 'iam.serviceAccounts.signBlob']
-                logging.error(
-                    'Missing IAM permissions for signed URL generation: %s',
-                    error,
-                )
-                return (
-                    jsonify(
-                        {
-                            'error': 'Missing required IAM permissions to generate signed URL',
-                            'missingPermissions': missingPermissions,
-                            'detail': str(error),
-                        }
-                    ),
-                    403,
-                )
-            except GoogleAPICallError as error:
-                logging.exception(
-                    'Storage API call failed during signed URL generation: %s',
-                    error,
-                )
-                errorDetail = getattr(error, 'message', str(error))
-                return (
-                    jsonify(
-                        {
-                            'error': 'Storage service temporarily unavailable for signed URL generation',
-                            'detail': errorDetail,
-                        }
-                    ),
-                    503,
-                )
-            logging.info('Generated signed URL for gs://%s/%s', gcsBucketName, gcsPath)
-
         requestTimestamp = datetime.now(timezone.utc)
         updatePayload = {
             'lastRequestTimestamp': requestTimestamp,
@@ -1622,41 +3240,309 @@ def fetchFile(fetchToken: str):
                 }
             )
 
-        firestoreClient.collection(firestoreCollectionFiles).document(
-            documentSnapshot.id
-        ).update(updatePayload)
+        # Consume the token before decrypting or signing, so concurrent and
+        # retried requests for it get a 410 without repeating that work.
+        try:
+            updateFileAndReleaseFetchToken(
+                firestoreClient,
+                documentSnapshot.id,
+                updatePayload,
+                fetchToken,
+                lastUpdateTime=getattr(documentSnapshot, 'update_time', None),
+                recipientId=fileMetadata.get('recipientId'),
+            )
+        except FetchTokenAlreadyConsumedError:
+            logging.warning('Fetch token for file %s was consumed by a concurrent request.', documentSnapshot.id)
+            return jsonify({'error': 'Fetch token already used'}), 410
         logging.info('Updated status for file %s to %s.', documentSnapshot.id, updatePayload['status'])
 
-        responsePayload = {
-            'message': (
-                'Metadata retrieved successfully'
-                if metadataOnly
-                else 'File and data retrieved successfully'
-            ),
-            'unencryptedData': unencryptedData if isinstance(unencryptedData, dict) else unencryptedData or {},
-            'decryptedData': decryptedData,
-            'fetchMode': fetchMode,
-            'lastRequestTimestamp': requestTimestamp.isoformat(),
-            'lastRequestFileName': fileMetadata.get('originalFilename'),
-        }
+        try:
+            unencryptedData = fileMetadata.get('unencryptedData')
+            decryptedData, errorResponse = _decryptFetchedFileData(
+                kmsClient, kmsKeyPath, documentSnapshot, fileMetadata
+            )
+            signedUrl = None
+            gcsPath = fileMetadata.get('gcsPath')
+            if errorResponse is None and not metadataOnly:
+                signedUrl, errorResponse = _signFetchedFileUrl(storageClient, gcsBucketName, documentSnapshot, gcsPath)
+            if errorResponse is None:
+                responsePayload = {
+                    'message': (
+                        'Metadata retrieved successfully'
+                        if metadataOnly
+                        else 'File and data retrieved successfully'
+                    ),
+                    'unencryptedData': unencryptedData if isinstance(unencryptedData, dict) else unencryptedData or {},
+                    'decryptedData': decryptedData,
+                    'fetchMode': fetchMode,
+                    'lastRequestTimestamp': requestTimestamp.isoformat(),
+                    'lastRequestFileName': fileMetadata.get('originalFilename'),
+                }
 
-        if not metadataOnly:
-            responsePayload['signedUrl'] = signedUrl
-            responsePayload['gcsPath'] = gcsPath
+                if not metadataOnly:
+                    responsePayload['signedUrl'] = signedUrl
+                    responsePayload['gcsPath'] = gcsPath
 
-        return jsonify(responsePayload), 200
+                return jsonify(responsePayload), 200
+        except Exception:  # pylint: disable=broad-except
+            # An unexpected failure must not burn the token either; the
+            # generic 500 below lets the client retry with it.
+            restoreFetchToken(firestoreClient, documentSnapshot.id, fileMetadata, updatePayload, fetchToken)
+            raise
+
+        restoreFetchToken(firestoreClient, documentSnapshot.id, fileMetadata, updatePayload, fetchToken)
+        return errorResponse
 
     except Exception:  # pylint: disable=broad-except
         logging.exception('An unexpected error occurred during file fetch.')
         return jsonify({'error': 'Internal server error'}), 500
 
 
+# Polled reads answer If-None-Match from small version documents instead of
+# re-running their query. Writers bump the version after (or atomically with)
+# the data they change, so a stale ETag can only cause one extra full read.
+# A version is the sum of its shards; each bump adds a random step, so the sum
+# never returns to a value an earlier ETag carried, even after a shard's
+# counter is deleted to invalidate it.
+shardedPollChannels = {'status'}
+pollVersionMaxStep = 2 ** 31
+
+
+def getPollVersionReference(firestoreClient: firestore.Client, scope: str, key: str):
+    return firestoreClient.collection(firestoreCollectionPollVersions).document(
+        f"{scope}:{quote(key, safe='')}"
+    )
+
+
+def getPollVersionShardReferences(firestoreClient: firestore.Client, scope: str, key: str, channel: str) -> list:
+    if channel not in shardedPollChannels:
+        return [getPollVersionReference(firestoreClient, scope, key)]
+    versionCollection = firestoreClient.collection(firestoreCollectionPollVersions)
+    return [
+        versionCollection.document(f"{scope}:{quote(key, safe='')}:{channel}:{shardIndex}")
+        for shardIndex in range(statusPollVersionShards)
+    ]
+
+
+def buildPollVersionBump(channel: str) -> Dict[str, object]:
+    return {
+        channel: firestore.Increment(random.randrange(1, pollVersionMaxStep)),
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }
+
+
+def bumpPollVersion(firestoreClient: firestore.Client, scope: str, key: Optional[str], channel: str, writeBatch=None):
+    if not isinstance(key, str) or not key.strip():
+        return
+    shardReferences = getPollVersionShardReferences(firestoreClient, scope, key.strip(), channel)
+    random.shuffle(shardReferences)
+    versionBump = buildPollVersionBump(channel)
+    if writeBatch is not None:
+        writeBatch.set(shardReferences[0], versionBump, merge=True)
+        return
+    for shardReference in shardReferences:
+        try:
+            shardReference.set(versionBump, merge=True)
+            return
+        except Exception as error:  # pylint: disable=broad-except
+            logging.warning('Failed to bump %s poll version shard %s: %s', channel, shardReference.id, error)
+    invalidatePollVersion(shardReferences, scope, key.strip(), channel)
+
+
+def invalidatePollVersion(shardReferences: list, scope: str, key: str, channel: str) -> None:
+    """Change a version that could not be bumped by deleting its shard counters.
+
+    Without it, polls would keep answering 304 for data that has changed.
+    Every shard is cleared because an empty one would leave the sum as it was.
+    """
+    failedShardIds = []
+    for shardReference in shardReferences:
+        try:
+            shardReference.set({channel: DELETE_FIELD}, merge=True)
+        except Exception:  # pylint: disable=broad-except
+            failedShardIds.append(shardReference.id)
+    if failedShardIds:
+        logging.error(
+            'Failed to bump or invalidate %s poll version for %s %s (shards %s); polls may answer 304 until the next bump.',
+            channel,
+            scope,
+            key,
+            ', '.join(failedShardIds),
+        )
+    else:
+        logging.warning('Invalidated %s poll version for %s %s after a failed bump.', channel, scope, key)
+
+
+def listStatusPollVersionBumps(statusRecord: Dict[str, object]) -> List[Tuple[str, str, str]]:
+    """Return the (scope, key, channel) versions a printer status document changes."""
+    versionBumps = []
+    recipientId = statusRecord.get('recipientId')
+    if isinstance(recipientId, str) and recipientId.strip():
+        versionBumps.append(('recipient', recipientId.strip(), 'status'))
+    printerSerial = statusRecord.get('printerSerial')
+    if statusRecord.get('type') == 'printer_image' and isinstance(printerSerial, str) and printerSerial.strip():
+        versionBumps.append(('printer', printerSerial.strip(), 'images'))
+    return versionBumps
+
+
+def addPrinterStatusRecord(firestoreClient: firestore.Client, statusRecord: Dict[str, object]):
+    """Store a printer status document together with the poll versions it changes.
+
+    One write batch holds both, so a poll never sees the new document under the
+    old version and each status costs a single commit.
+    """
+    documentReference = firestoreClient.collection(firestoreCollectionPrinterStatus).document()
+    writeBatch = firestoreClient.batch()
+    writeBatch.set(documentReference, statusRecord)
+    for scope, key, channel in listStatusPollVersionBumps(statusRecord):
+        bumpPollVersion(firestoreClient, scope, key, channel, writeBatch=writeBatch)
+    writeBatch.commit()
+    return documentReference
+
+
+def readPollVersion(firestoreClient: firestore.Client, scope: str, key: str, channel: str) -> Optional[int]:
+    """Return the current version, or None (no conditional handling) if it cannot be read."""
+    try:
+        shardReferences = getPollVersionShardReferences(firestoreClient, scope, key, channel)
+        if len(shardReferences) == 1:
+            versionSnapshots = [shardReferences[0].get()]
+        else:
+            versionSnapshots = list(firestoreClient.get_all(shardReferences))
+    except Exception:  # pylint: disable=broad-except
+        logging.exception('Failed to read %s poll version for %s %s.', channel, scope, key)
+        return None
+    return sumPollVersionSnapshots(versionSnapshots, channel)
+
+
+def parsePollVersionSnapshot(versionSnapshot, channel: str) -> int:
+    if not getattr(versionSnapshot, 'exists', False):
+        return 0
+    versionValue = (versionSnapshot.to_dict() or {}).get(channel)
+    return versionValue if isinstance(versionValue, int) else 0
+
+
+def sumPollVersionSnapshots(versionSnapshots, channel: str) -> Optional[int]:
+    # 0 means never bumped, or invalidated after a failed bump; it says nothing
+    # about the data, so it gets no ETag.
+    return sum(parsePollVersionSnapshot(versionSnapshot, channel) for versionSnapshot in versionSnapshots) or None
+
+
+def buildPollEtag(channel: str, version: int, queryArgs: Dict[str, object], validUntil: Optional[datetime] = None) -> str:
+    """ETag for a polled response; ``validUntil`` stops 304s once time alone changes the body."""
+    argumentDigest = hashlib.sha256(
+        json.dumps(queryArgs, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()[:16]
+    validUntilEpoch = int(validUntil.timestamp()) if validUntil is not None else 0
+    return f'"{channel}-{version}-{validUntilEpoch}-{argumentDigest}"'
+
+
+def findMatchingPollEtag(
+    headers, channel: str, version: Optional[int], queryArgs: Dict[str, object]
+) -> Optional[str]:
+    """Return the client's If-None-Match tag if it still describes the current response."""
+    ifNoneMatch = headers.get('If-None-Match') if headers is not None else None
+    if not ifNoneMatch or version is None:
+        return None
+    currentChannel, currentVersion, _, currentDigest = buildPollEtag(channel, version, queryArgs).strip('"').split('-')
+    for candidateTag in ifNoneMatch.split(','):
+        candidateTag = candidateTag.strip()
+        if candidateTag.startswith('W/'):
+            candidateTag = candidateTag[2:]
+        candidateParts = candidateTag.strip('"').split('-')
+        if len(candidateParts) != 4 or candidateParts[0] != currentChannel or candidateParts[1] != currentVersion:
+            continue
+        if candidateParts[3] != currentDigest or not candidateParts[2].isdigit():
+            continue
+        validUntilEpoch = int(candidateParts[2])
+        if validUntilEpoch == 0 or validUntilEpoch > time.time():
+            return candidateTag
+    return None
+
+
+def attachEtag(result, etag: str):
+    response, statusCode = result
+    if hasattr(response, 'headers'):
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+    return response, statusCode
+
+
+def makeNotModifiedResponse(etag: str):
+    return attachEtag((jsonify({}), 304), etag)
+
+
+def attachPollEtag(
+    result,
+    channel: str,
+    version: Optional[int],
+    queryArgs: Dict[str, object],
+    validUntil: Optional[datetime] = None,
+):
+    if version is None or result[1] != 200:
+        return result
+    return attachEtag(result, buildPollEtag(channel, version, queryArgs, validUntil))
+
+
+class InvalidPageTokenError(ValueError):
+    """Raised when a pending-files pageToken cannot be decoded."""
+
+
+def encodePendingPageToken(timestamp: datetime, fileId: str) -> str:
+    cursorPayload = json.dumps({'t': timestamp.isoformat(), 'id': fileId}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(cursorPayload.encode('utf-8')).rstrip(b'=').decode('ascii')
+
+
+def decodePendingPageToken(pageToken: str) -> Tuple[datetime, str]:
+    try:
+        paddedToken = pageToken + '=' * (-len(pageToken) % 4)
+        cursorPayload = json.loads(base64.urlsafe_b64decode(paddedToken.encode('ascii')))
+        cursorTimestamp = parseIso8601Timestamp(cursorPayload['t'])
+        cursorFileId = cursorPayload['id']
+    except (ValueError, TypeError, KeyError) as error:
+        raise InvalidPageTokenError('pageToken is invalid') from error
+    if cursorTimestamp is None or not isinstance(cursorFileId, str) or not cursorFileId:
+        raise InvalidPageTokenError('pageToken is invalid')
+    return cursorTimestamp, cursorFileId
+
+
+def parsePendingPageParameters(limitValue, pageTokenValue) -> Tuple[Optional[Dict[str, object]], Optional[str]]:
+    """Validate ``limit`` and ``pageToken``; return (parameters, error message)."""
+    limitSize = pendingFilesDefaultPageSize
+    if limitValue is not None:
+        try:
+            limitSize = int(limitValue)
+        except (TypeError, ValueError):
+            return None, 'limit must be a positive integer'
+        if limitSize < 1:
+            return None, 'limit must be a positive integer'
+    limitSize = min(limitSize, pendingFilesMaxPageSize)
+
+    pageCursor = None
+    if pageTokenValue is not None:
+        if not isinstance(pageTokenValue, str) or not pageTokenValue.strip():
+            return None, 'pageToken must be a non-empty string when provided'
+        try:
+            pageCursor = decodePendingPageToken(pageTokenValue.strip())
+        except InvalidPageTokenError as error:
+            return None, str(error)
+    return {'limit': limitSize, 'pageCursor': pageCursor}, None
+
+
 def buildPendingFileList(
-    firestoreClient: firestore.Client, recipientId: str
-) -> Tuple[List[Dict[str, Optional[str]]], List[str]]:
+    firestoreClient: firestore.Client,
+    recipientId: str,
+    limitSize: Optional[int] = None,
+    pageCursor: Optional[Tuple[datetime, str]] = None,
+) -> Tuple[List[Dict[str, Optional[str]]], List[str], Optional[str]]:
+    """Return one page of claimable files, oldest first, and the next pageToken.
+
+    Files that are read but not claimable are reported as skipped; they still
+    advance the cursor so the next page does not read them again.
+    """
     pendingFiles: List[Dict[str, Optional[str]]] = []
     skippedFiles: List[str] = []
     currentTime = datetime.now(timezone.utc)
+    limitSize = limitSize or pendingFilesDefaultPageSize
 
     fileQuery = firestoreClient.collection(firestoreCollectionFiles).where(
         filter=FieldFilter('recipientId', '==', recipientId)
@@ -1669,8 +3555,17 @@ def buildPendingFileList(
     fileQuery = fileQuery.where(
         filter=FieldFilter('fetchTokenConsumed', '==', False)
     )
+    # The document ID breaks timestamp ties so the cursor never skips a file.
+    fileQuery = fileQuery.order_by('timestamp').order_by('__name__')
+    if pageCursor is not None:
+        cursorTimestamp, cursorFileId = pageCursor
+        fileQuery = fileQuery.start_after({'timestamp': cursorTimestamp, '__name__': cursorFileId})
+    # One extra document tells whether another page exists.
+    documentSnapshots = list(fileQuery.limit(limitSize + 1).stream())
+    hasMore = len(documentSnapshots) > limitSize
+    documentSnapshots = documentSnapshots[:limitSize]
 
-    for documentSnapshot in fileQuery.stream():
+    for documentSnapshot in documentSnapshots:
         metadata = documentSnapshot.to_dict() or {}
         fetchToken = metadata.get('fetchToken')
         if not fetchToken:
@@ -1699,9 +3594,13 @@ def buildPendingFileList(
             }
         )
 
-    pendingFiles.sort(key=lambda item: item.get('uploadedAt') or '')
+    nextPageToken = None
+    if hasMore and documentSnapshots:
+        lastTimestamp = (documentSnapshots[-1].to_dict() or {}).get('timestamp')
+        if isinstance(lastTimestamp, datetime):
+            nextPageToken = encodePendingPageToken(lastTimestamp, documentSnapshots[-1].id)
 
-    return pendingFiles, skippedFiles
+    return pendingFiles, skippedFiles, nextPageToken
 
 
 def _handleClientInitializationErrors(error: Exception):
@@ -1751,13 +3650,18 @@ def listPendingJobs(appId: str):
 
     sanitizedRecipientId = recipientId.strip()
 
+    pageParameters, pageError = parsePendingPageParameters(payload.get('limit'), payload.get('pageToken'))
+    if pageError:
+        logging.warning('Invalid paging parameters when listing pending jobs: %s', pageError)
+        return makeErrorResponse(400, 'ValidationError', pageError)
+
     clients, clientError = _loadClientsOrError()
     if clientError:
         return clientError
 
     firestoreClient = clients.firestoreClient
-    pendingFiles, skippedFiles = buildPendingFileList(
-        firestoreClient, sanitizedRecipientId
+    pendingFiles, skippedFiles, nextPageToken = buildPendingFileList(
+        firestoreClient, sanitizedRecipientId, pageParameters['limit'], pageParameters['pageCursor']
     )
 
     responsePayload: Dict[str, object] = {
@@ -1767,6 +3671,8 @@ def listPendingJobs(appId: str):
     }
     if skippedFiles:
         responsePayload['skipped'] = skippedFiles
+    if nextPageToken:
+        responsePayload['nextPageToken'] = nextPageToken
 
     return makeJsonResponse(responsePayload, 200)
 
@@ -1861,6 +3767,8 @@ def claimJob(appId: str):
     except Exception as error:  # pylint: disable=broad-except
         logging.exception('Failed to update job %s during claim.', jobId)
         return makeErrorResponse(500, 'ServerError', 'Failed to claim job', str(error))
+    latestFileCache.invalidateFile(jobId)
+    bumpPollVersion(firestoreClient, 'recipient', jobMetadata.get('recipientId'), 'pending')
 
     logEvent('job_claimed', jobId=jobId, recipientId=recipientId, printerId=printerId)
 
@@ -1930,6 +3838,16 @@ def listLatestRecipientPrinterStatuses(recipientId: str):
     if validationError:
         return validationError
 
+    clients, clientError = _loadClientsOrError()
+    if clientError:
+        return clientError
+
+    statusQueryArgs = buildStatusPollQueryArgs(sanitizedRecipientId, queryParameters)
+    statusVersion = readPollVersion(clients.firestoreClient, 'recipient', sanitizedRecipientId, 'status')
+    matchingEtag = findMatchingPollEtag(request.headers, 'status', statusVersion, statusQueryArgs)
+    if matchingEtag:
+        return makeNotModifiedResponse(matchingEtag)
+
     documentSnapshots, loadError = loadRecipientPrinterStatusSnapshots(
         sanitizedRecipientId,
         queryParameters['printerSerial'],
@@ -1945,7 +3863,96 @@ def listLatestRecipientPrinterStatuses(recipientId: str):
         'ok': True,
         'printers': printerStatuses,
     }
-    return makeJsonResponse(responsePayload, 200)
+    return attachPollEtag(makeJsonResponse(responsePayload, 200), 'status', statusVersion, statusQueryArgs)
+
+
+@app.route('/api/recipients/<recipientId>/status/stream', methods=['GET'])
+@apply_rate_limit(RATE_LIMIT_AUTH)  # Direktestrøm av status
+def streamRecipientPrinterStatuses(recipientId: str):
+    logging.info('Received request to /api/recipients/%s/status/stream', recipientId)
+
+    apiKeyError = ensureValidApiKey()
+    if apiKeyError:
+        return apiKeyError
+
+    if not isinstance(recipientId, str) or not recipientId.strip():
+        logging.warning('Missing recipientId when streaming printer status.')
+        return makeErrorResponse(400, 'ValidationError', 'recipientId is required')
+
+    sanitizedRecipientId = recipientId.strip()
+
+    queryParameters, validationError = parsePrinterStatusQueryParameters()
+    if validationError:
+        return validationError
+
+    clients, clientError = _loadClientsOrError()
+    if clientError:
+        return clientError
+
+    if not statusStreamThreadSlots.acquire(blocking=False):
+        logging.warning('All %d status stream slots are in use; rejecting stream.', statusStreamThreadLimit)
+        return makeErrorResponse(
+            503, 'ServiceUnavailable', 'Too many open status streams on this instance; poll status/latest'
+        )
+
+    queryArgs = getattr(request, 'args', {}) or {}
+    resumeKey = parseStatusEventId(request.headers.get('Last-Event-ID') or queryArgs.get('lastEventId'))
+    statusStream = PrinterStatusStream(sanitizedRecipientId, queryParameters['printerSerial'], resumeKey)
+
+    # Subscribe before the initial query so nothing written in between is lost;
+    # the stream drops whatever the query already covered.
+    updateQueue: 'queue.Queue[object]' = queue.Queue()
+    subscription = printerStatusBroadcaster.subscribe(clients.firestoreClient, sanitizedRecipientId, updateQueue.put)
+    if subscription is None:
+        statusStreamThreadSlots.release()
+        return makeErrorResponse(503, 'ServiceUnavailable', 'Live printer status is unavailable; poll status/latest')
+
+    streamClosed = threading.Event()
+
+    def closeStream():
+        # Runs from the generator and from the response's close hook, which is
+        # the only one that fires if the client leaves before the first event.
+        if not streamClosed.is_set():
+            streamClosed.set()
+            printerStatusBroadcaster.unsubscribe(subscription)
+            statusStreamThreadSlots.release()
+
+    try:
+        initialEvents = statusStream.buildInitialEvents(
+            list(statusStream.buildInitialQuery(clients.firestoreClient, queryParameters).stream())
+        )
+    except Exception as error:  # pylint: disable=broad-except
+        closeStream()
+        logging.exception('Failed to load printer status history for %s.', sanitizedRecipientId)
+        return makeErrorResponse(500, 'ServerError', 'Failed to load printer status updates', str(error))
+
+    def generateStatusEvents():
+        try:
+            yield from initialEvents
+            deadline = time.monotonic() + statusStreamMaxSeconds
+            while True:
+                remainingSeconds = deadline - time.monotonic()
+                if remainingSeconds <= 0 or not printerStatusBroadcaster.isActive(subscription):
+                    # The client reconnects with Last-Event-ID and resumes.
+                    return
+                try:
+                    documentSnapshot = updateQueue.get(timeout=min(statusStreamHeartbeatSeconds, remainingSeconds))
+                except queue.Empty:
+                    yield statusStreamHeartbeat
+                    continue
+                statusEvent = statusStream.eventForUpdate(documentSnapshot)
+                if statusEvent:
+                    yield statusEvent
+        finally:
+            closeStream()
+
+    streamResponse = app.response_class(
+        generateStatusEvents(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    streamResponse.call_on_close(closeStream)
+    return streamResponse, 200
 
 
 @app.route('/recipients/<recipientId>/pending', methods=['GET'])
@@ -1968,7 +3975,25 @@ def listPendingFiles(recipientId: str):
             logging.warning('Recipient ID is missing when listing pending files.')
             return jsonify({'error': 'Recipient ID is required'}), 400
 
-        pendingFiles, skippedFiles = buildPendingFileList(firestoreClient, recipientId)
+        queryArgs = getattr(request, 'args', {}) or {}
+        pageParameters, pageError = parsePendingPageParameters(queryArgs.get('limit'), queryArgs.get('pageToken'))
+        if pageError:
+            logging.warning('Invalid paging parameters when listing pending files: %s', pageError)
+            return jsonify({'error': pageError}), 400
+
+        pendingQueryArgs = {
+            'recipientId': recipientId,
+            'limit': pageParameters['limit'],
+            'pageToken': queryArgs.get('pageToken'),
+        }
+        pendingVersion = readPollVersion(firestoreClient, 'recipient', recipientId, 'pending')
+        matchingEtag = findMatchingPollEtag(request.headers, 'pending', pendingVersion, pendingQueryArgs)
+        if matchingEtag:
+            return makeNotModifiedResponse(matchingEtag)
+
+        pendingFiles, skippedFiles, nextPageToken = buildPendingFileList(
+            firestoreClient, recipientId, pageParameters['limit'], pageParameters['pageCursor']
+        )
 
         responsePayload = {
             'recipientId': recipientId,
@@ -1976,8 +4001,18 @@ def listPendingFiles(recipientId: str):
         }
         if skippedFiles:
             responsePayload['skippedFiles'] = skippedFiles
+        if nextPageToken:
+            responsePayload['nextPageToken'] = nextPageToken
 
-        return jsonify(responsePayload), 200
+        # The listing also changes when a listed fetch token expires, with no
+        # write to bump the version, so the ETag stops matching at that point.
+        tokenExpiries = [
+            parseIso8601Timestamp(pendingFile.get('fetchTokenExpiry')) for pendingFile in pendingFiles
+        ]
+        validUntil = min((expiry for expiry in tokenExpiries if expiry is not None), default=None)
+        return attachPollEtag(
+            (jsonify(responsePayload), 200), 'pending', pendingVersion, pendingQueryArgs, validUntil
+        )
 
     except Exception:  # pylint: disable=broad-except
         logging.exception('An unexpected error occurred while listing pending files.')
@@ -2124,6 +4159,7 @@ def queuePrinterControlCommand():
         expiresAt=expiresAtTimestamp.isoformat() if expiresAtTimestamp else None,
         metadata=metadata or {},
     )
+    commandPushPublisher.publish(recipientId, buildCommandNotification(commandRecord))
 
     responsePayload = {
         'ok': True,
@@ -2208,6 +4244,262 @@ def buildLatestPrinterStatusMap(documentSnapshots):
     return printerStatuses
 
 
+statusStreamRetryMilliseconds = 3000
+statusStreamReplayLimit = 500
+# New listeners also pick up documents written this long before they started,
+# which covers clock skew against the server timestamps.
+statusListenerLookbackSeconds = 60
+statusStreamHeartbeat = ': keepalive\n\n'
+
+
+def _printerStatusKey(serializedStatus: dict) -> Optional[str]:
+    return (
+        serializedStatus.get('printerSerial')
+        or serializedStatus.get('printerId')
+        or serializedStatus.get('printerIpAddress')
+    )
+
+
+def statusEventKey(documentSnapshot) -> Optional[Tuple[int, str]]:
+    """Order of a status document in the stream: (timestamp in ms, document ID)."""
+    timestampValue = (documentSnapshot.to_dict() or {}).get('timestamp')
+    if not isinstance(timestampValue, datetime):
+        return None
+    return int(timestampValue.timestamp() * 1000), documentSnapshot.id
+
+
+def formatStatusEventId(eventKey: Tuple[int, str]) -> str:
+    return f'{eventKey[0]}-{eventKey[1]}'
+
+
+def parseStatusEventId(rawValue) -> Optional[Tuple[int, str]]:
+    if not isinstance(rawValue, str):
+        return None
+    timestampPart, _, documentId = rawValue.strip().partition('-')
+    if not timestampPart.isdigit() or not documentId:
+        return None
+    return int(timestampPart), documentId
+
+
+def formatServerSentEvent(eventName: str, payload, eventId: Optional[str] = None) -> str:
+    eventLines = []
+    if eventId:
+        eventLines.append(f'id: {eventId}')
+    eventLines.append(f'event: {eventName}')
+    eventLines.append('data: ' + json.dumps(_to_jsonable(payload), ensure_ascii=False, separators=(',', ':')))
+    return '\n'.join(eventLines) + '\n\n'
+
+
+class PrinterStatusStream:
+    """Events for one status stream: an initial snapshot (or replay), then de-duplicated pushes.
+
+    Each printer keeps the key of the last status sent for it, so documents
+    the listener delivers that are already covered by the initial query, or
+    older than what the client has, are dropped.
+    """
+
+    def __init__(self, recipientId: str, printerSerial: Optional[str], resumeKey: Optional[Tuple[int, str]]):
+        self.recipientId = recipientId
+        self.printerSerial = printerSerial
+        self.resumeKey = resumeKey
+        self.printerCursors: Dict[str, Tuple[int, str]] = {}
+
+    def buildInitialQuery(self, firestoreClient, queryParameters: dict):
+        if self.resumeKey is None:
+            return buildRecipientPrinterStatusQuery(
+                firestoreClient,
+                self.recipientId,
+                self.printerSerial,
+                queryParameters['since'],
+                queryParameters['limit'],
+            )
+        resumeTimestamp = datetime.fromtimestamp(self.resumeKey[0] / 1000, tz=timezone.utc)
+        return buildRecipientPrinterStatusQuery(
+            firestoreClient, self.recipientId, self.printerSerial, resumeTimestamp, statusStreamReplayLimit
+        )
+
+    def buildInitialEvents(self, documentSnapshots) -> List[str]:
+        initialEvents = [f'retry: {statusStreamRetryMilliseconds}\n\n']
+        if self.resumeKey is None:
+            newestKey = None
+            for documentSnapshot in documentSnapshots:
+                eventKey = statusEventKey(documentSnapshot)
+                printerKey = _printerStatusKey(documentSnapshot.to_dict() or {})
+                if eventKey is None or not printerKey:
+                    continue
+                self.printerCursors[printerKey] = max(self.printerCursors.get(printerKey, eventKey), eventKey)
+                newestKey = max(newestKey or eventKey, eventKey)
+            initialEvents.append(
+                formatServerSentEvent(
+                    'snapshot',
+                    {'ok': True, 'printers': buildLatestPrinterStatusMap(documentSnapshots)},
+                    formatStatusEventId(newestKey) if newestKey else None,
+                )
+            )
+            return initialEvents
+
+        replaySnapshots = list(documentSnapshots)
+        if len(replaySnapshots) >= statusStreamReplayLimit:
+            # Too far behind to replay every update; send each printer's latest.
+            latestStatusIds = {status['statusId'] for status in buildLatestPrinterStatusMap(replaySnapshots).values()}
+            replaySnapshots = [snapshot for snapshot in replaySnapshots if snapshot.id in latestStatusIds]
+        replaySnapshots.sort(key=lambda snapshot: statusEventKey(snapshot) or (0, ''))
+        for documentSnapshot in replaySnapshots:
+            statusEvent = self.eventForUpdate(documentSnapshot)
+            if statusEvent:
+                initialEvents.append(statusEvent)
+        return initialEvents
+
+    def eventForUpdate(self, documentSnapshot) -> Optional[str]:
+        statusData = documentSnapshot.to_dict() or {}
+        if self.printerSerial and statusData.get('printerSerial') != self.printerSerial:
+            return None
+        eventKey = statusEventKey(documentSnapshot)
+        printerKey = _printerStatusKey(statusData)
+        if eventKey is None or not printerKey:
+            return None
+        cursorKey = self.printerCursors.get(printerKey, self.resumeKey)
+        if cursorKey is not None and eventKey <= cursorKey:
+            return None
+        self.printerCursors[printerKey] = eventKey
+        return formatServerSentEvent(
+            'status', serializePrinterStatusDocument(documentSnapshot), formatStatusEventId(eventKey)
+        )
+
+
+class PrinterStatusSubscription:
+    def __init__(self, recipientId: str, deliver: Callable[[object], None]):
+        self.recipientId = recipientId
+        self.deliver = deliver
+        self.listener: Optional[dict] = None
+
+
+class PrinterStatusBroadcaster:
+    """Per-recipient snapshot listeners on new printer status documents, shared by open streams.
+
+    A recipient's listener starts with its first stream and stops with its
+    last. Its query starts at a fixed timestamp, so the result set the watch
+    holds grows with every update; once the listener is ``recycleSeconds`` old
+    the next subscribe swaps in a listener anchored at the current time.
+    Streams end and resubscribe within ``statusStreamMaxSeconds``, so a busy
+    recipient's listener is recycled at least that often. Subscribers are
+    called on Firestore's watch thread and must only hand the snapshot off.
+    """
+
+    def __init__(self, lookbackSeconds: float, recycleSeconds: float):
+        self.lookbackSeconds = lookbackSeconds
+        self.recycleSeconds = recycleSeconds
+        self._lock = threading.Lock()
+        self._listeners: Dict[str, dict] = {}
+        self._counters = {'listenerStarts': 0, 'listenerRecycles': 0, 'listenerFailures': 0, 'delivered': 0}
+
+    def _startWatch(self, firestoreClient: firestore.Client, recipientId: str):
+        # The lookback covers updates written while a stream runs its initial
+        # query; streams drop the ones they have already sent.
+        listenerStart = datetime.now(timezone.utc) - timedelta(seconds=self.lookbackSeconds)
+        return (
+            firestoreClient.collection(firestoreCollectionPrinterStatus)
+            .where(filter=FieldFilter('recipientId', '==', recipientId))
+            .where(filter=FieldFilter('timestamp', '>=', listenerStart))
+            .on_snapshot(lambda _documentSnapshots, changes, _readTime: self._onSnapshot(recipientId, changes))
+        )
+
+    def subscribe(
+        self, firestoreClient: firestore.Client, recipientId: str, deliver: Callable[[object], None]
+    ) -> Optional[PrinterStatusSubscription]:
+        """Return a subscription, or None if the recipient's listener cannot be started."""
+        subscription = PrinterStatusSubscription(recipientId, deliver)
+        staleWatch = None
+        with self._lock:
+            listener = self._listeners.get(recipientId)
+            if listener is not None and not getattr(listener['watch'], 'is_active', True):
+                logging.warning('Printer status listener for %s stopped; restarting.', recipientId)
+                self._counters['listenerFailures'] += 1
+                listener = None
+            if listener is None:
+                try:
+                    watch = self._startWatch(firestoreClient, recipientId)
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception('Failed to start the printer status listener for %s.', recipientId)
+                    self._counters['listenerFailures'] += 1
+                    return None
+                listener = {'watch': watch, 'startedAt': time.monotonic(), 'subscriptions': set()}
+                self._listeners[recipientId] = listener
+                self._counters['listenerStarts'] += 1
+            elif time.monotonic() - listener['startedAt'] >= self.recycleSeconds:
+                # The new watch starts before the old one stops, so no update
+                # falls between them; open streams keep the same listener.
+                try:
+                    newWatch = self._startWatch(firestoreClient, recipientId)
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception('Failed to recycle the printer status listener for %s.', recipientId)
+                    self._counters['listenerFailures'] += 1
+                else:
+                    staleWatch, listener['watch'] = listener['watch'], newWatch
+                    listener['startedAt'] = time.monotonic()
+                    self._counters['listenerRecycles'] += 1
+            listener['subscriptions'].add(subscription)
+            subscription.listener = listener
+        if staleWatch is not None:
+            self._stopWatch(staleWatch)
+        return subscription
+
+    def isActive(self, subscription: PrinterStatusSubscription) -> bool:
+        with self._lock:
+            listener = self._listeners.get(subscription.recipientId)
+            return listener is subscription.listener and bool(getattr(listener['watch'], 'is_active', True))
+
+    def _onSnapshot(self, recipientId: str, changes) -> None:
+        addedSnapshots = [
+            change.document for change in changes if getattr(change.type, 'name', change.type) == 'ADDED'
+        ]
+        with self._lock:
+            listener = self._listeners.get(recipientId)
+            subscriptions = list(listener['subscriptions']) if listener else []
+            self._counters['delivered'] += len(addedSnapshots) * len(subscriptions)
+        for subscription in subscriptions:
+            for documentSnapshot in addedSnapshots:
+                subscription.deliver(documentSnapshot)
+
+    def unsubscribe(self, subscription: PrinterStatusSubscription) -> None:
+        with self._lock:
+            listener = self._listeners.get(subscription.recipientId)
+            if listener is None or listener is not subscription.listener:
+                return
+            listener['subscriptions'].discard(subscription)
+            if listener['subscriptions']:
+                return
+            del self._listeners[subscription.recipientId]
+        self._stopWatch(listener['watch'])
+
+    def stop(self) -> None:
+        with self._lock:
+            listeners, self._listeners = list(self._listeners.values()), {}
+        for listener in listeners:
+            self._stopWatch(listener['watch'])
+
+    @staticmethod
+    def _stopWatch(watch) -> None:
+        try:
+            watch.unsubscribe()
+        except Exception:  # pylint: disable=broad-except
+            logging.exception('Failed to stop a printer status listener.')
+
+    def getMetrics(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                'recipients': len(self._listeners),
+                'streams': sum(len(listener['subscriptions']) for listener in self._listeners.values()),
+                'threadStreamLimit': statusStreamThreadLimit,
+                **self._counters,
+            }
+
+
+printerStatusBroadcaster = PrinterStatusBroadcaster(statusListenerLookbackSeconds, statusStreamMaxSeconds)
+statusStreamThreadSlots = threading.BoundedSemaphore(max(0, statusStreamThreadLimit))
+registerMetricsProvider('statusStreams', printerStatusBroadcaster.getMetrics)
+
+
 def _parseExpirationTimestampValue(rawValue):
     if isinstance(rawValue, datetime):
         expiration = rawValue
@@ -2225,19 +4517,33 @@ def _parseExpirationTimestampValue(rawValue):
     return expiration.astimezone(timezone.utc)
 
 
+pendingCommandStatuses = (None, 'queued', 'pending')
+
+
+def _evaluatePrinterCommandClaim(commandData: dict, recipientId: str, currentTime: datetime) -> str:
+    if commandData.get('recipientId') != recipientId:
+        return 'skip'
+
+    if commandData.get('status') not in pendingCommandStatuses:
+        return 'skip'
+
+    expirationTime = _parseExpirationTimestampValue(commandData.get('expiresAt'))
+    if expirationTime is not None and expirationTime <= currentTime:
+        return 'expire'
+
+    return 'claim'
+
+
 @firestoreTransactional
 def _claimPrinterCommand(transaction, documentReference, recipientId, claimUpdate, currentTime):
     snapshot = documentReference.get(transaction=transaction)
     commandData = snapshot.to_dict() or {}
 
-    if commandData.get('recipientId') != recipientId:
-        return False, None
-
-    if commandData.get('status') not in (None, 'queued', 'pending'):
+    claimDecision = _evaluatePrinterCommandClaim(commandData, recipientId, currentTime)
+    if claimDecision == 'skip':
         return False, None
 
-    expirationTime = _parseExpirationTimestampValue(commandData.get('expiresAt'))
-    if expirationTime is not None and expirationTime <= currentTime:
+    if claimDecision == 'expire':
         expirationUpdate = {
             'status': 'expired',
             'expiredAt': firestore.SERVER_TIMESTAMP,
@@ -2249,17 +4555,11 @@ def _claimPrinterCommand(transaction, documentReference, recipientId, claimUpdat
     return True, commandData
 
 
-def _listPendingPrinterControlCommands():
-    apiKeyError = ensureValidApiKey()
-    if apiKeyError:
-        return apiKeyError
-
-    queryArgs = getattr(request, 'args', {}) or {}
-
+def parsePrinterCommandQueryParameters(queryArgs):
     recipientId = queryArgs.get('recipientId')
     if not isinstance(recipientId, str) or not recipientId.strip():
         logging.warning('Missing or invalid recipientId when listing printer commands.')
-        return makeErrorResponse(400, 'ValidationError', 'recipientId query parameter is required')
+        return None, makeErrorResponse(400, 'ValidationError', 'recipientId query parameter is required')
     sanitizedRecipientId = recipientId.strip()
 
     printerSerialValue = queryArgs.get('printerSerial')
@@ -2267,7 +4567,7 @@ def _listPendingPrinterControlCommands():
     if printerSerialValue is not None:
         if not isinstance(printerSerialValue, str) or not printerSerialValue.strip():
             logging.warning('Invalid printerSerial provided when listing printer commands.')
-            return makeErrorResponse(
+            return None, makeErrorResponse(
                 400,
                 'ValidationError',
                 'printerSerial must be a non-empty string when provided',
@@ -2279,7 +4579,7 @@ def _listPendingPrinterControlCommands():
         printerIpValue = queryArgs.get('printerIpAddress')
         if not isinstance(printerIpValue, str) or not printerIpValue.strip():
             logging.warning('Invalid printerIpAddress parameter provided when listing commands.')
-            return makeErrorResponse(400, 'ValidationError', 'printerIpAddress must be a non-empty string')
+            return None, makeErrorResponse(400, 'ValidationError', 'printerIpAddress must be a non-empty string')
         printerIpAddress = printerIpValue.strip()
 
     printerIdValue = queryArgs.get('printerId')
@@ -2287,7 +4587,9 @@ def _listPendingPrinterControlCommands():
     if printerIdValue is not None:
         if not isinstance(printerIdValue, str) or not printerIdValue.strip():
             logging.warning('Invalid printerId parameter provided when listing commands.')
-            return makeErrorResponse(400, 'ValidationError', 'printerId must be a non-empty string when provided')
+            return None, makeErrorResponse(
+                400, 'ValidationError', 'printerId must be a non-empty string when provided'
+            )
         sanitizedPrinterId = printerIdValue.strip()
 
     limitValue = queryArgs.get('limit')
@@ -2297,108 +4599,489 @@ def _listPendingPrinterControlCommands():
             limitSize = max(1, int(limitValue))
         except (TypeError, ValueError):
             logging.warning('Invalid limit parameter provided when listing commands.')
-            return makeErrorResponse(400, 'ValidationError', 'limit must be a positive integer')
+            return None, makeErrorResponse(400, 'ValidationError', 'limit must be a positive integer')
 
-    clients, clientError = _loadClientsOrError()
-    if clientError:
-        return clientError
+    waitValue = queryArgs.get('wait')
+    waitSeconds = 0.0
+    if waitValue is not None:
+        try:
+            waitSeconds = float(waitValue)
+        except (TypeError, ValueError):
+            waitSeconds = -1.0
+        if not math.isfinite(waitSeconds) or waitSeconds < 0:
+            logging.warning('Invalid wait parameter provided when listing commands.')
+            return None, makeErrorResponse(400, 'ValidationError', 'wait must be a non-negative number of seconds')
 
-    firestoreClient = clients.firestoreClient
-    commandCollection = firestoreClient.collection(firestoreCollectionPrinterCommands)
+    queryParameters = {
+        'recipientId': sanitizedRecipientId,
+        'printerSerial': sanitizedPrinterSerial,
+        'printerIpAddress': printerIpAddress,
+        'printerId': sanitizedPrinterId,
+        'limit': limitSize,
+        'waitSeconds': min(waitSeconds, controlLongPollMaxSeconds),
+    }
+    return queryParameters, None
 
-    logging.info(
-        'Checking pending commands for recipient %s (limit=%d)',
-        sanitizedRecipientId,
-        limitSize,
-    )
 
+def buildPendingPrinterCommandQuery(firestoreClient, queryParameters: dict):
+    commandCollection = firestoreClient.collection(firestoreCollectionPrinterCommands)
     baseQuery = commandCollection.where(
-        filter=FieldFilter('recipientId', '==', sanitizedRecipientId)
+        filter=FieldFilter('recipientId', '==', queryParameters['recipientId'])
     )
 
-    if sanitizedPrinterSerial is not None:
+    if queryParameters['printerSerial'] is not None:
         baseQuery = baseQuery.where(
-            filter=FieldFilter('printerSerial', '==', sanitizedPrinterSerial)
+            filter=FieldFilter('printerSerial', '==', queryParameters['printerSerial'])
         )
-    if printerIpAddress is not None:
+    if queryParameters['printerIpAddress'] is not None:
         baseQuery = baseQuery.where(
-            filter=FieldFilter('printerIpAddress', '==', printerIpAddress)
+            filter=FieldFilter('printerIpAddress', '==', queryParameters['printerIpAddress'])
         )
-    if sanitizedPrinterId is not None:
+    if queryParameters['printerId'] is not None:
         baseQuery = baseQuery.where(
-            filter=FieldFilter('printerId', '==', sanitizedPrinterId)
+            filter=FieldFilter('printerId', '==', queryParameters['printerId'])
         )
+    return baseQuery
+
+
+def pendingCommandFetchLimit(limitSize: int) -> int:
+    return max(limitSize * 3, limitSize + 10)
+
+
+def _normalizeCommandTimestamp(rawValue):
+    if isinstance(rawValue, datetime):
+        return rawValue if rawValue.tzinfo else rawValue.replace(tzinfo=timezone.utc)
+    if hasattr(rawValue, 'to_datetime'):
+        try:
+            normalizedValue = rawValue.to_datetime()
+            if normalizedValue.tzinfo is None:
+                normalizedValue = normalizedValue.replace(tzinfo=timezone.utc)
+            return normalizedValue
+        except Exception:  # pylint: disable=broad-except
+            return None
+    if isinstance(rawValue, str):
+        try:
+            parsedValue = datetime.fromisoformat(rawValue)
+            if parsedValue.tzinfo is None:
+                parsedValue = parsedValue.replace(tzinfo=timezone.utc)
+            return parsedValue
+        except ValueError:
+            return None
+    return None
+
+
+def appendPendingCommandCandidates(
+    snapshotCandidates: List[Tuple[datetime, object]],
+    seenDocumentIds: Set[str],
+    snapshots,
+) -> None:
+    for snapshot in snapshots:
+        documentId = getattr(snapshot, 'id', None)
+        if documentId is None or documentId in seenDocumentIds:
+            continue
+
+        commandData = snapshot.to_dict() or {}
+        statusValue = commandData.get('status')
+        if statusValue not in pendingCommandStatuses:
+            continue
+
+        createdAtValue = commandData.get('createdAt')
+        normalizedCreatedAt = _normalizeCommandTimestamp(createdAtValue)
+        if normalizedCreatedAt is None:
+            createdAtFallback = getattr(snapshot, 'create_time', None)
+            normalizedCreatedAt = _normalizeCommandTimestamp(createdAtFallback)
+        if normalizedCreatedAt is None:
+            normalizedCreatedAt = datetime.min.replace(tzinfo=timezone.utc)
+
+        snapshotCandidates.append((normalizedCreatedAt, snapshot))
+        seenDocumentIds.add(documentId)
+
+
+def selectOldestPendingCommands(snapshotCandidates: List[Tuple[datetime, object]], limitSize: int) -> list:
+    sortedCandidates = sorted(snapshotCandidates, key=lambda item: (item[0], getattr(item[1], 'id', '')))
+    return [item[1] for item in sortedCandidates[:limitSize]]
+
+
+def buildPrinterCommandClaimUpdate(queryParameters: dict) -> Dict[str, object]:
+    claimUpdate: Dict[str, object] = {
+        'status': 'reserved',
+        'claimedByRecipient': queryParameters['recipientId'],
+        'claimedAt': firestore.SERVER_TIMESTAMP,
+    }
+    if queryParameters['printerSerial']:
+        claimUpdate['claimedByPrinterSerial'] = queryParameters['printerSerial']
+    if queryParameters['printerIpAddress']:
+        claimUpdate['claimedByPrinterIpAddress'] = queryParameters['printerIpAddress']
+    if queryParameters['printerId']:
+        claimUpdate['claimedByPrinterId'] = queryParameters['printerId']
+    return claimUpdate
+
+
+def buildClaimedPrinterCommandPayload(snapshotData: dict, commandId: str, queryParameters: dict):
+    responsePayload = {**snapshotData}
+    responsePayload['status'] = 'reserved'
+    responsePayload['claimedByRecipient'] = queryParameters['recipientId']
+    if queryParameters['printerSerial']:
+        responsePayload['claimedByPrinterSerial'] = queryParameters['printerSerial']
+    if queryParameters['printerIpAddress']:
+        responsePayload['claimedByPrinterIpAddress'] = queryParameters['printerIpAddress']
+    if queryParameters['printerId']:
+        responsePayload['claimedByPrinterId'] = queryParameters['printerId']
+
+    responsePayload['commandId'] = commandId
+
+    jsonablePayload = _to_jsonable(responsePayload)
+    logging.info(
+        'Claimed printer control command %s with payload=%s',
+        commandId,
+        json.dumps(jsonablePayload, ensure_ascii=False),
+    )
+    return jsonablePayload
+
+
+def logExpiredPrinterCommand(commandId: str, commandData: dict, recipientId: str, expirationTime: datetime) -> None:
+    logEvent(
+        'command_expired',
+        commandId=commandId,
+        recipientId=recipientId,
+        printerSerial=commandData.get('printerSerial'),
+        expiresAt=expirationTime.isoformat(),
+    )
+
+
+printerCommandWatchFields = ('recipientId', 'printerSerial', 'printerIpAddress', 'printerId')
+
+
+class PrinterCommandWaiter:
+    """A long-polling request, woken when a command matching its filters is queued."""
 
-    def normalizeTimestamp(rawValue):
-        if isinstance(rawValue, datetime):
-            return rawValue if rawValue.tzinfo else rawValue.replace(tzinfo=timezone.utc)
-        if hasattr(rawValue, 'to_datetime'):
+    def __init__(self, queryParameters: dict, notify: Callable[[], None]):
+        self.recipientId = queryParameters['recipientId']
+        self.criteria = {
+            fieldName: queryParameters[fieldName]
+            for fieldName in printerCommandWatchFields
+            if queryParameters.get(fieldName) is not None
+        }
+        self.notify = notify
+
+    def matches(self, commandData: dict) -> bool:
+        # Same equality filters as buildPendingPrinterCommandQuery.
+        return all(commandData.get(fieldName) == value for fieldName, value in self.criteria.items())
+
+
+class PrinterCommandWatcher:
+    """One snapshot listener on pending printer commands, shared by every waiting poll.
+
+    The listener runs on Firestore's watch thread and only wakes waiters; the
+    woken request claims through the usual queries and transactions. If the
+    listener cannot be started (or has stopped), polls are answered at once
+    and a restart is attempted after ``retrySeconds``.
+    """
+
+    def __init__(self, retrySeconds: float):
+        self.retrySeconds = retrySeconds
+        self._lock = threading.Lock()
+        self._watch = None
+        self._nextStartTime = 0.0
+        self._waiters: Dict[str, List[PrinterCommandWaiter]] = {}
+        self._counters = {'listenerStarts': 0, 'listenerFailures': 0, 'changes': 0, 'wakeups': 0}
+
+    def ensureListening(self, firestoreClient: firestore.Client) -> bool:
+        with self._lock:
+            if self._watch is not None:
+                if getattr(self._watch, 'is_active', True):
+                    return True
+                logging.warning('Printer command listener stopped; restarting after %.0fs.', self.retrySeconds)
+                self._watch = None
+                self._counters['listenerFailures'] += 1
+                self._nextStartTime = time.monotonic() + self.retrySeconds
+            if time.monotonic() < self._nextStartTime:
+                return False
+            watchedStatuses = [statusValue for statusValue in pendingCommandStatuses if statusValue is not None]
             try:
-                normalizedValue = rawValue.to_datetime()
-                if normalizedValue.tzinfo is None:
-                    normalizedValue = normalizedValue.replace(tzinfo=timezone.utc)
-                return normalizedValue
+                self._watch = (
+                    firestoreClient.collection(firestoreCollectionPrinterCommands)
+                    .where(filter=FieldFilter('status', 'in', watchedStatuses))
+                    .on_snapshot(self._onSnapshot)
+                )
             except Exception:  # pylint: disable=broad-except
-                return None
-        if isinstance(rawValue, str):
-            try:
-                parsedValue = datetime.fromisoformat(rawValue)
-                if parsedValue.tzinfo is None:
-                    parsedValue = parsedValue.replace(tzinfo=timezone.utc)
-                return parsedValue
-            except ValueError:
-                return None
-        return None
+                logging.exception('Failed to start the printer command listener.')
+                self._counters['listenerFailures'] += 1
+                self._nextStartTime = time.monotonic() + self.retrySeconds
+                return False
+            self._counters['listenerStarts'] += 1
+            return True
+
+    def _onSnapshot(self, _documentSnapshots, changes, _readTime) -> None:
+        notifications = []
+        with self._lock:
+            for change in changes:
+                if getattr(change.type, 'name', change.type) == 'REMOVED':
+                    continue
+                self._counters['changes'] += 1
+                commandData = change.document.to_dict() or {}
+                for waiter in self._waiters.get(commandData.get('recipientId'), ()):
+                    if waiter.matches(commandData):
+                        notifications.append(waiter.notify)
+            self._counters['wakeups'] += len(notifications)
+        for notify in notifications:
+            notify()
+
+    @contextmanager
+    def subscribe(self, queryParameters: dict, notify: Callable[[], None]):
+        """Register a waiter for the duration of the block.
+
+        Subscribe before the first claim attempt so a command queued while
+        that attempt runs still wakes the request.
+        """
+        waiter = PrinterCommandWaiter(queryParameters, notify)
+        with self._lock:
+            self._waiters.setdefault(waiter.recipientId, []).append(waiter)
+        try:
+            yield waiter
+        finally:
+            with self._lock:
+                recipientWaiters = self._waiters.get(waiter.recipientId, [])
+                if waiter in recipientWaiters:
+                    recipientWaiters.remove(waiter)
+                if not recipientWaiters:
+                    self._waiters.pop(waiter.recipientId, None)
+
+    def stop(self) -> None:
+        with self._lock:
+            watch, self._watch = self._watch, None
+        if watch is not None:
+            watch.unsubscribe()
+
+    def getMetrics(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                'listening': self._watch is not None and bool(getattr(self._watch, 'is_active', True)),
+                'waiters': sum(len(recipientWaiters) for recipientWaiters in self._waiters.values()),
+                'maxWaitSeconds': controlLongPollMaxSeconds,
+                'threadWaiterLimit': controlLongPollThreadWaiters,
+                **self._counters,
+            }
 
-    fallbackFetchLimit = max(limitSize * 3, limitSize + 10)
 
-    def fetchPendingSnapshotsWithoutCompositeIndex():
-        snapshotCandidates: List[Tuple[datetime, firestore.DocumentSnapshot]] = []
-        seenDocumentIds: Set[str] = set()
+printerCommandWatcher = PrinterCommandWatcher(controlWatchRetrySeconds)
+controlLongPollThreadSlots = threading.BoundedSemaphore(max(0, controlLongPollThreadWaiters))
+registerMetricsProvider('controlWatch', printerCommandWatcher.getMetrics)
 
-        def appendSnapshots(snapshots: List[firestore.DocumentSnapshot]):
-            for snapshot in snapshots:
-                documentId = getattr(snapshot, 'id', None)
-                if documentId is None or documentId in seenDocumentIds:
-                    continue
 
-                commandData = snapshot.to_dict() or {}
-                statusValue = commandData.get('status')
-                if statusValue not in (None, 'queued', 'pending'):
-                    continue
+class CommandPushPublisher:
+    """Publishes a notification to ``<prefix>/<recipientId>/commands`` when a command is queued.
+
+    The MQTT connection is opened on first use and kept up (and reconnected)
+    by paho's network thread, so publishing never waits on the broker.
+    Notifications are a hint to claim now through ``GET /control``; one that
+    is lost only delays the command until the client's next poll.
+    """
+
+    def __init__(
+        self,
+        brokerUrl: str,
+        topicPrefix: str,
+        qos: int = 1,
+        password: Optional[str] = None,
+        maxQueuedMessages: int = 1000,
+    ):
+        self.brokerUrl = brokerUrl
+        self.topicPrefix = topicPrefix
+        self.qos = qos
+        self.password = password
+        self.maxQueuedMessages = maxQueuedMessages
+        self._lock = threading.Lock()
+        self._client = None
+        self._connected = False
+        self._lastError: Optional[str] = None
+        self._counters = {'published': 0, 'queuedWhileDisconnected': 0, 'failures': 0, 'connects': 0, 'disconnects': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.brokerUrl)
+
+    def topicFor(self, recipientId: str) -> str:
+        # Topic separators and wildcards in the ID must not change the topic's shape.
+        return f"{self.topicPrefix}/{quote(recipientId, safe='')}/commands"
+
+    def _ensureClient(self):
+        with self._lock:
+            if self._client is not None:
+                return self._client
+            parsedUrl = urlparse(self.brokerUrl)
+            if parsedUrl.scheme not in {'mqtt', 'mqtts'} or not parsedUrl.hostname:
+                raise ValueError('MQTT_BROKER_URL must look like mqtt://host:port or mqtts://host:port')
+            useTls = parsedUrl.scheme == 'mqtts'
+            client = mqttClient.Client(
+                callback_api_version=mqttClient.CallbackAPIVersion.VERSION2,
+                client_id=f'printpro3d-api-{uuid.uuid4().hex[:12]}',
+            )
+            if parsedUrl.username:
+                client.username_pw_set(unquote(parsedUrl.username), self.password or unquote(parsedUrl.password or ''))
+            if useTls:
+                client.tls_set()
+            client.on_connect = self._onConnect
+            client.on_disconnect = self._onDisconnect
+            client.max_queued_messages_set(self.maxQueuedMessages)
+            client.reconnect_delay_set(min_delay=1, max_delay=30)
+            client.connect_async(parsedUrl.hostname, parsedUrl.port or (8883 if useTls else 1883), keepalive=60)
+            client.loop_start()
+            self._client = client
+            logging.info('Publishing command notifications to MQTT broker %s', parsedUrl.hostname)
+            return client
+
+    def _onConnect(self, _client, _userdata, _flags, reasonCode, _properties=None) -> None:
+        with self._lock:
+            if getattr(reasonCode, 'is_failure', False):
+                self._lastError = f'connect refused: {reasonCode}'
+                return
+            self._connected = True
+            self._counters['connects'] += 1
+
+    def _onDisconnect(self, _client, _userdata, _flags, reasonCode, _properties=None) -> None:
+        with self._lock:
+            self._connected = False
+            self._counters['disconnects'] += 1
+            if getattr(reasonCode, 'is_failure', False):
+                self._lastError = f'disconnected: {reasonCode}'
+
+    def publish(self, recipientId: Optional[str], notification: Dict[str, object]) -> bool:
+        if not self.enabled or not recipientId:
+            return False
+        payload = json.dumps(_to_jsonable(notification), ensure_ascii=False, separators=(',', ':'))
+        try:
+            messageInfo = self._ensureClient().publish(self.topicFor(recipientId), payload, qos=self.qos)
+            resultCode = messageInfo.rc
+        except Exception as error:  # pylint: disable=broad-except
+            resultCode = None
+            errorMessage = str(error)
+        else:
+            errorMessage = mqttClient.error_string(resultCode)
+        with self._lock:
+            if resultCode == mqttClient.MQTT_ERR_SUCCESS:
+                self._counters['published'] += 1
+                return True
+            if resultCode == mqttClient.MQTT_ERR_NO_CONN and self.qos > 0:
+                # paho keeps QoS 1/2 messages and sends them once reconnected.
+                self._counters['queuedWhileDisconnected'] += 1
+                return True
+            self._counters['failures'] += 1
+            self._lastError = errorMessage
+        logging.warning('Failed to publish command notification for %s: %s', recipientId, errorMessage)
+        return False
+
+    def stop(self) -> None:
+        with self._lock:
+            client, self._client = self._client, None
+            self._connected = False
+        if client is not None:
+            client.disconnect()
+            client.loop_stop()
+
+    def getMetrics(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'connected': self._connected,
+                'qos': self.qos,
+                **self._counters,
+                'lastError': self._lastError,
+            }
+
+
+commandPushPublisher = CommandPushPublisher(
+    mqttBrokerUrl, mqttTopicPrefix, mqttQos, mqttPassword, mqttMaxQueuedMessages
+)
+registerMetricsProvider('commandPush', commandPushPublisher.getMetrics)
+
+
+def buildCommandNotification(commandRecord: Dict[str, object]) -> Dict[str, object]:
+    """Compact MQTT payload: enough to route and claim the command, no metadata."""
+    notification = {'type': 'command_queued', 'queuedAt': datetime.now(timezone.utc).isoformat()}
+    for fieldName in ('commandId', 'commandType', 'recipientId', 'printerSerial', 'printerIpAddress', 'printerId'):
+        if commandRecord.get(fieldName) is not None:
+            notification[fieldName] = commandRecord[fieldName]
+    if commandRecord.get('expiresAt') is not None:
+        notification['expiresAt'] = commandRecord['expiresAt']
+    return notification
+
+
+def _listPendingPrinterControlCommands():
+    apiKeyError = ensureValidApiKey()
+    if apiKeyError:
+        return apiKeyError
+
+    queryArgs = getattr(request, 'args', {}) or {}
+    queryParameters, validationError = parsePrinterCommandQueryParameters(queryArgs)
+    if validationError:
+        return validationError
+
+    clients, clientError = _loadClientsOrError()
+    if clientError:
+        return clientError
+
+    firestoreClient = clients.firestoreClient
+    waitSeconds = queryParameters['waitSeconds']
+    if waitSeconds > 0 and controlLongPollThreadSlots.acquire(blocking=False):
+        try:
+            if printerCommandWatcher.ensureListening(firestoreClient):
+                return _waitForPrinterControlCommands(firestoreClient, queryParameters, waitSeconds)
+        finally:
+            controlLongPollThreadSlots.release()
+    elif waitSeconds > 0:
+        logging.info('All %d long-poll slots are in use; answering /control at once.', controlLongPollThreadWaiters)
+
+    claimedCommands, claimError = _claimPendingPrinterControlCommands(firestoreClient, queryParameters)
+    return claimError or makeJsonResponse({'commands': claimedCommands}, 200)
+
+
+def _waitForPrinterControlCommands(firestoreClient: firestore.Client, queryParameters: dict, waitSeconds: float):
+    commandQueued = threading.Event()
+    deadline = time.monotonic() + waitSeconds
+    with printerCommandWatcher.subscribe(queryParameters, commandQueued.set):
+        while True:
+            commandQueued.clear()
+            claimedCommands, claimError = _claimPendingPrinterControlCommands(firestoreClient, queryParameters)
+            if claimError:
+                return claimError
+            # A wakeup can lose the claim to another poller; keep waiting then.
+            remainingSeconds = deadline - time.monotonic()
+            if claimedCommands or remainingSeconds <= 0 or not commandQueued.wait(remainingSeconds):
+                return makeJsonResponse({'commands': claimedCommands}, 200)
+
+
+def _claimPendingPrinterControlCommands(firestoreClient: firestore.Client, queryParameters: dict):
+    """Claim the oldest pending commands matching ``queryParameters``; returns (commands, error)."""
+    sanitizedRecipientId = queryParameters['recipientId']
+    limitSize = queryParameters['limit']
 
-                createdAtValue = commandData.get('createdAt')
-                normalizedCreatedAt = normalizeTimestamp(createdAtValue)
-                if normalizedCreatedAt is None:
-                    createdAtFallback = getattr(snapshot, 'create_time', None)
-                    normalizedCreatedAt = normalizeTimestamp(createdAtFallback)
-                if normalizedCreatedAt is None:
-                    normalizedCreatedAt = datetime.min.replace(tzinfo=timezone.utc)
+    logging.info(
+        'Checking pending commands for recipient %s (limit=%d)',
+        sanitizedRecipientId,
+        limitSize,
+    )
+
+    baseQuery = buildPendingPrinterCommandQuery(firestoreClient, queryParameters)
+    fallbackFetchLimit = pendingCommandFetchLimit(limitSize)
 
-                snapshotCandidates.append((normalizedCreatedAt, snapshot))
-                seenDocumentIds.add(documentId)
+    def fetchPendingSnapshotsWithoutCompositeIndex():
+        snapshotCandidates: List[Tuple[datetime, firestore.DocumentSnapshot]] = []
+        seenDocumentIds: Set[str] = set()
 
-        fetchLimit = fallbackFetchLimit
         for statusFilter in ('queued', 'pending', None):
-            try:
-                statusSnapshots = list(
-                    baseQuery.where(
-                        filter=FieldFilter('status', '==', statusFilter)
-                    ).limit(fetchLimit).stream()
-                )
-            except FailedPrecondition as error:
-                raise error
-            appendSnapshots(statusSnapshots)
+            statusSnapshots = list(
+                baseQuery.where(
+                    filter=FieldFilter('status', '==', statusFilter)
+                ).limit(fallbackFetchLimit).stream()
+            )
+            appendPendingCommandCandidates(snapshotCandidates, seenDocumentIds, statusSnapshots)
 
         if len(snapshotCandidates) < limitSize:
-            try:
-                additionalSnapshots = list(baseQuery.limit(fetchLimit).stream())
-            except FailedPrecondition as error:
-                raise error
-            appendSnapshots(additionalSnapshots)
+            additionalSnapshots = list(baseQuery.limit(fallbackFetchLimit).stream())
+            appendPendingCommandCandidates(snapshotCandidates, seenDocumentIds, additionalSnapshots)
 
-        snapshotCandidates.sort(key=lambda item: (item[0], getattr(item[1], 'id', '')))
-        return [item[1] for item in snapshotCandidates[:limitSize]]
+        return selectOldestPendingCommands(snapshotCandidates, limitSize)
 
     try:
         documents = fetchPendingSnapshotsWithoutCompositeIndex()
@@ -2413,35 +5096,19 @@ def _listPendingPrinterControlCommands():
             fallbackDocuments = list(baseQuery.limit(fallbackFetchLimit).stream())
         except Exception as fallbackError:  # pylint: disable=broad-except
             logging.exception('Failed to fetch pending printer control commands.')
-            return makeErrorResponse(
+            return None, makeErrorResponse(
                 500,
                 'ServerError',
                 'Failed to fetch pending printer control commands',
                 str(fallbackError),
             )
 
-        pendingDocuments = []
-        for snapshot in fallbackDocuments:
-            commandData = snapshot.to_dict() or {}
-            statusValue = commandData.get('status')
-            if statusValue not in (None, 'queued', 'pending'):
-                continue
-
-            createdAtValue = commandData.get('createdAt')
-            normalizedCreatedAt = normalizeTimestamp(createdAtValue)
-            if normalizedCreatedAt is None:
-                createdAtFallback = getattr(snapshot, 'create_time', None)
-                normalizedCreatedAt = normalizeTimestamp(createdAtFallback)
-            if normalizedCreatedAt is None:
-                normalizedCreatedAt = datetime.min.replace(tzinfo=timezone.utc)
-
-            pendingDocuments.append((normalizedCreatedAt, snapshot))
-
-        pendingDocuments.sort(key=lambda item: (item[0], getattr(item[1], 'id', '')))
-        documents = [item[1] for item in pendingDocuments[:limitSize]]
+        pendingDocuments: List[Tuple[datetime, firestore.DocumentSnapshot]] = []
+        appendPendingCommandCandidates(pendingDocuments, set(), fallbackDocuments)
+        documents = selectOldestPendingCommands(pendingDocuments, limitSize)
     except Exception as error:  # pylint: disable=broad-except
         logging.exception('Failed to fetch pending printer control commands.')
-        return makeErrorResponse(
+        return None, makeErrorResponse(
             500,
             'ServerError',
             'Failed to fetch pending printer control commands',
@@ -2470,26 +5137,10 @@ def _listPendingPrinterControlCommands():
                 logging.exception(
                     'Failed to mark printer control command %s as expired.', commandId
                 )
-            logEvent(
-                'command_expired',
-                commandId=commandId,
-                recipientId=sanitizedRecipientId,
-                printerSerial=commandData.get('printerSerial'),
-                expiresAt=expirationTime.isoformat(),
-            )
+            logExpiredPrinterCommand(commandId, commandData, sanitizedRecipientId, expirationTime)
             continue
 
-        claimUpdate: Dict[str, object] = {
-            'status': 'reserved',
-            'claimedByRecipient': sanitizedRecipientId,
-            'claimedAt': firestore.SERVER_TIMESTAMP,
-        }
-        if sanitizedPrinterSerial:
-            claimUpdate['claimedByPrinterSerial'] = sanitizedPrinterSerial
-        if printerIpAddress:
-            claimUpdate['claimedByPrinterIpAddress'] = printerIpAddress
-        if sanitizedPrinterId:
-            claimUpdate['claimedByPrinterId'] = sanitizedPrinterId
+        claimUpdate = buildPrinterCommandClaimUpdate(queryParameters)
 
         try:
             succeeded, snapshotData = _claimPrinterCommand(
@@ -2516,24 +5167,8 @@ def _listPendingPrinterControlCommands():
         if not succeeded or snapshotData is None:
             continue
 
-        responsePayload = {**snapshotData}
-        responsePayload['status'] = 'reserved'
-        responsePayload['claimedByRecipient'] = sanitizedRecipientId
-        if sanitizedPrinterSerial:
-            responsePayload['claimedByPrinterSerial'] = sanitizedPrinterSerial
-        if printerIpAddress:
-            responsePayload['claimedByPrinterIpAddress'] = printerIpAddress
-        if sanitizedPrinterId:
-            responsePayload['claimedByPrinterId'] = sanitizedPrinterId
-
-        responsePayload['commandId'] = commandId
-
-        jsonablePayload = _to_jsonable(responsePayload)
-        claimedCommands.append(jsonablePayload)
-        logging.info(
-            'Claimed printer control command %s with payload=%s',
-            commandId,
-            json.dumps(jsonablePayload, ensure_ascii=False),
+        claimedCommands.append(
+            buildClaimedPrinterCommandPayload(snapshotData, commandId, queryParameters)
         )
         logging.debug('Claimed printer control command %s.', commandId)
 
@@ -2544,7 +5179,7 @@ def _listPendingPrinterControlCommands():
         len(claimedCommands),
     )
 
-    return makeJsonResponse({'commands': claimedCommands}, 200)
+    return claimedCommands, None
 
 
 def _loadPrinterCommandDocument(commandId: str):
@@ -2797,32 +5432,28 @@ def debugListPendingCommands():
     return makeJsonResponse(responsePayload, 200)
 
 
-def _handlePrinterStatusUpdate(appId: Optional[str]):
-    logging.info('Received printer status update for app %s', appId or 'default')
-
+@app.route('/debug/metrics', methods=['GET'])
+@apply_rate_limit(RATE_LIMIT_AUTH)
+def debugMetrics():
     apiKeyError = ensureValidApiKey()
     if apiKeyError:
         return apiKeyError
 
-    payload, payloadError = getJsonPayload()
-    if payloadError:
-        return payloadError
-
-    clients, clientError = _loadClientsOrError()
-    if clientError:
-        return clientError
+    return makeJsonResponse({'ok': True, 'metrics': collectMetrics()}, 200)
 
-    firestoreClient = clients.firestoreClient
 
+def buildPrinterStatusRecord(
+    payload: dict, appId: Optional[str]
+) -> Tuple[Optional[dict], Optional[Tuple[dict, int]]]:
     recipientId = payload.get('recipientId')
     if recipientId is not None:
         if not isinstance(recipientId, str):
             logging.warning('Invalid recipientId type in printer status update: %s', type(recipientId).__name__)
-            return makeErrorResponse(400, 'ValidationError', 'recipientId must be a non-empty string')
+            return None, makeErrorResponse(400, 'ValidationError', 'recipientId must be a non-empty string')
         sanitizedRecipientId = recipientId.strip()
         if not sanitizedRecipientId:
             logging.warning('Empty recipientId provided in printer status update.')
-            return makeErrorResponse(400, 'ValidationError', 'recipientId must be a non-empty string')
+            return None, makeErrorResponse(400, 'ValidationError', 'recipientId must be a non-empty string')
         payload['recipientId'] = sanitizedRecipientId
 
     requiredFields = [
@@ -2841,7 +5472,7 @@ def _handlePrinterStatusUpdate(appId: Optional[str]):
     for field in requiredFields:
         if field not in payload:
             logging.warning('Missing required field in printer status update: %s', field)
-            return makeErrorResponse(400, 'ValidationError', f'Missing required field: {field}')
+            return None, makeErrorResponse(400, 'ValidationError', f'Missing required field: {field}')
 
     sanitizedStatusData = {
         key: value
@@ -2860,25 +5491,48 @@ def _handlePrinterStatusUpdate(appId: Optional[str]):
     if appId:
         sanitizedStatusData['appId'] = appId
 
-    try:
-        documentReference = (
-            firestoreClient.collection(firestoreCollectionPrinterStatus)
-            .add(sanitizedStatusData)
-        )
-    except Exception as error:  # pylint: disable=broad-except
-        logging.exception('Failed to store printer status update.')
-        return makeErrorResponse(500, 'ServerError', 'Failed to store printer status update', str(error))
+    return sanitizedStatusData, None
 
-    responsePayload = {
+
+def buildPrinterStatusResponsePayload(documentReference, statusRecord: dict) -> dict:
+    return {
         'ok': True,
         'success': True,
         'message': 'Printer status updated successfully',
         'statusId': getattr(documentReference, 'id', None),
-        'organizationId': sanitizedStatusData.get('organizationId'),
-        'printerId': sanitizedStatusData.get('printerId'),
+        'organizationId': statusRecord.get('organizationId'),
+        'printerId': statusRecord.get('printerId'),
     }
 
-    return makeJsonResponse(responsePayload, 200)
+
+def _handlePrinterStatusUpdate(appId: Optional[str]):
+    logging.info('Received printer status update for app %s', appId or 'default')
+
+    apiKeyError = ensureValidApiKey()
+    if apiKeyError:
+        return apiKeyError
+
+    payload, payloadError = getJsonPayload()
+    if payloadError:
+        return payloadError
+
+    clients, clientError = _loadClientsOrError()
+    if clientError:
+        return clientError
+
+    firestoreClient = clients.firestoreClient
+
+    sanitizedStatusData, validationError = buildPrinterStatusRecord(payload, appId)
+    if validationError:
+        return validationError
+
+    try:
+        documentReference = addPrinterStatusRecord(firestoreClient, sanitizedStatusData)
+    except Exception as error:  # pylint: disable=broad-except
+        logging.exception('Failed to store printer status update.')
+        return makeErrorResponse(500, 'ServerError', 'Failed to store printer status update', str(error))
+
+    return makeJsonResponse(buildPrinterStatusResponsePayload(documentReference, sanitizedStatusData), 200)
 
 
 @app.route('/api/apps/<appId>/functions/updatePrinterStatus', methods=['POST'])
@@ -2893,6 +5547,27 @@ def printerStatusUpdate():
     return _handlePrinterStatusUpdate(None)
 
 
+def buildSimplePrinterStatusRecord(payload: dict) -> Tuple[Optional[dict], Optional[Tuple[dict, int]]]:
+    # Validate recipientId
+    recipientId = payload.get('recipientId')
+    if not recipientId or not isinstance(recipientId, str) or not recipientId.strip():
+        logging.warning('Invalid or missing recipientId in status update')
+        return None, makeErrorResponse(400, 'ValidationError', 'recipientId must be a non-empty string')
+
+    # Validate printerIpAddress
+    printerIpAddress = payload.get('printerIpAddress')
+    if not printerIpAddress or not isinstance(printerIpAddress, str) or not printerIpAddress.strip():
+        logging.warning('Invalid or missing printerIpAddress in status update')
+        return None, makeErrorResponse(400, 'ValidationError', 'printerIpAddress must be a non-empty string')
+
+    # Prepare status data
+    statusData = dict(payload)
+    statusData['timestamp'] = firestore.SERVER_TIMESTAMP
+    statusData['recipientId'] = recipientId.strip()
+    statusData['printerIpAddress'] = printerIpAddress.strip()
+    return statusData, None
+
+
 @app.route('/updatePrinterStatus', methods=['POST'])
 @apply_rate_limit(RATE_LIMIT_AUTH)  # Enkel statusoppdatering
 def simpleUpdatePrinterStatus():
@@ -2913,28 +5588,18 @@ def simpleUpdatePrinterStatus():
 
     firestoreClient = clients.firestoreClient
 
-    # Validate recipientId
-    recipientId = payload.get('recipientId')
-    if not recipientId or not isinstance(recipientId, str) or not recipientId.strip():
-        logging.warning('Invalid or missing recipientId in status update')
-        return makeErrorResponse(400, 'ValidationError', 'recipientId must be a non-empty string')
-
-    # Validate printerIpAddress
-    printerIpAddress = payload.get('printerIpAddress')
-    if not printerIpAddress or not isinstance(printerIpAddress, str) or not printerIpAddress.strip():
-        logging.warning('Invalid or missing printerIpAddress in status update')
-        return makeErrorResponse(400, 'ValidationError', 'printerIpAddress must be a non-empty string')
-
-    # Prepare status data
-    statusData = dict(payload)
-    statusData['timestamp'] = firestore.SERVER_TIMESTAMP
-    statusData['recipientId'] = recipientId.strip()
-    statusData['printerIpAddress'] = printerIpAddress.strip()
+    statusData, validationError = buildSimplePrinterStatusRecord(payload)
+    if validationError:
+        return validationError
 
     # Store in Firestore
     try:
-        documentReference = firestoreClient.collection(firestoreCollectionPrinterStatus).add(statusData)
-        logging.info('Stored status update for recipient %s, printer %s', recipientId, printerIpAddress)
+        documentReference = addPrinterStatusRecord(firestoreClient, statusData)
+        logging.info(
+            'Stored status update for recipient %s, printer %s',
+            statusData['recipientId'],
+            statusData['printerIpAddress'],
+        )
     except Exception as error:
         logging.exception('Failed to store printer status update')
         return makeErrorResponse(500, 'ServerError', 'Failed to store printer status update', str(error))
@@ -2981,7 +5646,7 @@ def reportPrinterError():
 
     # Store in Firestore (same collection as status updates)
     try:
-        documentReference = firestoreClient.collection(firestoreCollectionPrinterStatus).add(errorData)
+        documentReference = addPrinterStatusRecord(firestoreClient, errorData)
         logging.warning('Stored error report for recipient %s: %s', recipientId, payload.get('errorMessage', 'Unknown error'))
     except Exception as error:
         logging.exception('Failed to store printer error report')
@@ -3029,7 +5694,7 @@ def reportPrinterImage():
 
     # Store in Firestore (same collection as status updates)
     try:
-        documentReference = firestoreClient.collection(firestoreCollectionPrinterStatus).add(imageData)
+        documentReference = addPrinterStatusRecord(firestoreClient, imageData)
         logging.info('Stored image report for recipient %s', recipientId)
     except Exception as error:
         logging.exception('Failed to store printer image report')
@@ -3138,50 +5803,7 @@ def uploadPrinterImage():
     # Generate signed URL for the uploaded image
     signedUrl = None
     try:
-        credentials = getattr(storageClient, '_credentials', None)
-        if credentials is not None:
-            signBytesMethod = getattr(credentials, 'sign_bytes', None)
-            if callable(signBytesMethod):
-                signedUrl = blob.generate_signed_url(
-                    version='v4',
-                    expiration=timedelta(hours=24),  # 24-hour expiry for images
-                    method='GET',
-                )
-            else:
-                if Request is None:
-                    raise ImportError('google.auth Request is required for IAM signing')
-                requestAdapter = Request()
-                scopedCredentials = credentials
-                withScopesMethod = getattr(credentials, 'with_scopes_if_required', None)
-                if callable(withScopesMethod):
-                    scopedCredentials = withScopesMethod(
-                        ['https://www.googleapis.com/auth/cloud-platform']
-                    )
-                    if scopedCredentials is None:
-                        scopedCredentials = credentials
-                credentials = scopedCredentials
-                credentials.refresh(requestAdapter)
-                accessToken = getattr(credentials, 'token', None)
-                if not accessToken:
-                    raise AttributeError('Credentials missing access token required for IAM signing')
-                serviceAccountEmail = getattr(credentials, 'service_account_email', None)
-                if not serviceAccountEmail:
-                    raise AttributeError('Credentials missing service_account_email required for IAM signing')
-                signedUrl = blob.generate_signed_url(
-                    version='v4',
-                    expiration=timedelta(hours=24),
-                    method='GET',
-                    service_account_email=serviceAccountEmail,
-                    access_token=accessToken,
-                )
-
-        if signedUrl is None:
-            signedUrl = blob.generate_signed_url(
-                version='v4',
-                expiration=timedelta(hours=24),
-                method='GET',
-            )
-
+        signedUrl = urlSigner.sign(storageClient, blob, timedelta(hours=24))  # 24-hour expiry for images
         logging.info('Generated signed URL for printer image gs://%s/%s', gcsBucketName, gcsPath)
     except Exception as error:
         logging.warning('Failed to generate signed URL for printer image: %s', error)
@@ -3208,7 +5830,7 @@ def uploadPrinterImage():
         imageMetadata['printerIpAddress'] = printerIpAddress
 
     try:
-        documentReference = firestoreClient.collection(firestoreCollectionPrinterStatus).add(imageMetadata)
+        documentReference = addPrinterStatusRecord(firestoreClient, imageMetadata)
         documentId = getattr(documentReference, 'id', None)
         logging.info('Stored printer image metadata for %s (document: %s)', printerSerial, documentId)
     except Exception as error:
@@ -3229,6 +5851,10 @@ def uploadPrinterImage():
     return makeJsonResponse(response, 200)
 
 
+latestImageUrlTtl = timedelta(hours=1)
+latestImageEtagMargin = timedelta(minutes=5)
+
+
 @app.route('/api/printer-images/latest', methods=['GET'])
 @apply_rate_limit(RATE_LIMIT_AUTH)  # Hent siste bilde
 def getLatestPrinterImage():
@@ -3266,6 +5892,12 @@ def getLatestPrinterImage():
         logging.warning('Missing printerSerial in latest image request')
         return makeErrorResponse(400, 'ValidationError', 'printerSerial query parameter is required')
 
+    imageQueryArgs = {'printerSerial': printerSerial, 'imageType': imageType}
+    imageVersion = readPollVersion(firestoreClient, 'printer', printerSerial, 'images')
+    matchingEtag = findMatchingPollEtag(request.headers, 'images', imageVersion, imageQueryArgs)
+    if matchingEtag:
+        return makeNotModifiedResponse(matchingEtag)
+
     # Query Firestore for the latest image
     try:
         query = firestoreClient.collection(firestoreCollectionPrinterStatus) \
@@ -3296,50 +5928,7 @@ def getLatestPrinterImage():
             bucket = storageClient.bucket(gcsBucketName)
             blob = bucket.blob(gcsPath)
 
-            credentials = getattr(storageClient, '_credentials', None)
-            if credentials is not None:
-                signBytesMethod = getattr(credentials, 'sign_bytes', None)
-                if callable(signBytesMethod):
-                    signedUrl = blob.generate_signed_url(
-                        version='v4',
-                        expiration=timedelta(hours=1),  # 1-hour expiry for retrieval
-                        method='GET',
-                    )
-                else:
-                    if Request is None:
-                        raise ImportError('google.auth Request is required for IAM signing')
-                    requestAdapter = Request()
-                    scopedCredentials = credentials
-                    withScopesMethod = getattr(credentials, 'with_scopes_if_required', None)
-                    if callable(withScopesMethod):
-                        scopedCredentials = withScopesMethod(
-                            ['https://www.googleapis.com/auth/cloud-platform']
-                        )
-                        if scopedCredentials is None:
-                            scopedCredentials = credentials
-                    credentials = scopedCredentials
-                    credentials.refresh(requestAdapter)
-                    accessToken = getattr(credentials, 'token', None)
-                    if not accessToken:
-                        raise AttributeError('Credentials missing access token required for IAM signing')
-                    serviceAccountEmail = getattr(credentials, 'service_account_email', None)
-                    if not serviceAccountEmail:
-                        raise AttributeError('Credentials missing service_account_email required for IAM signing')
-                    signedUrl = blob.generate_signed_url(
-                        version='v4',
-                        expiration=timedelta(hours=1),
-                        method='GET',
-                        service_account_email=serviceAccountEmail,
-                        access_token=accessToken,
-                    )
-
-            if signedUrl is None:
-                signedUrl = blob.generate_signed_url(
-                    version='v4',
-                    expiration=timedelta(hours=1),
-                    method='GET',
-                )
-
+            signedUrl = urlSigner.sign(storageClient, blob, latestImageUrlTtl)
             logging.info('Generated signed URL for latest image: %s', gcsPath)
         except Exception as error:
             logging.exception('Failed to generate signed URL for latest image')
@@ -3362,7 +5951,15 @@ def getLatestPrinterImage():
         }
 
         logging.info('Retrieved latest image for printer %s', printerSerial)
-        return makeJsonResponse(response, 200)
+        # A 304 hands the client back its cached signed URL, so stop matching
+        # well before that URL expires.
+        return attachPollEtag(
+            makeJsonResponse(response, 200),
+            'images',
+            imageVersion,
+            imageQueryArgs,
+            datetime.now(timezone.utc) + latestImageUrlTtl - latestImageEtagMargin,
+        )
 
     except Exception as error:
         logging.exception('Failed to query for latest printer image')
@@ -3403,7 +6000,7 @@ def reportPrinterEventError():
 
     # Store in Firestore
     try:
-        documentReference = firestoreClient.collection(firestoreCollectionPrinterStatus).add(errorData)
+        documentReference = addPrinterStatusRecord(firestoreClient, errorData)
         logging.info('Stored error report for recipient %s', recipientId)
     except Exception as error:
         logging.exception('Failed to store printer error report')
@@ -3422,6 +6019,43 @@ def healthCheck():
     return jsonify({'status': 'ok', 'message': 'Cloud server is running!'}), 200
 
 
+@app.route('/readyz', methods=['GET'])
+def readinessCheck():
+    startClientWarmup()
+    printerApiKeyStore.start()
+    readiness = getClientReadiness()
+    return makeJsonResponse(readiness, 200 if readiness['ready'] else 503)
+
+
+def getImportTimingReport() -> Dict[str, object]:
+    eagerTimings = [timing for timing in importTimings if timing['mode'] == 'eager']
+    return {
+        'moduleImportMs': mainModuleImportMs,
+        'eagerImportMs': round(sum(timing['ms'] for timing in eagerTimings), 2),
+        'imports': [dict(timing) for timing in importTimings],
+    }
+
+
+def formatImportTimingTable() -> str:
+    report = getImportTimingReport()
+    moduleColumnWidth = max([len('module')] + [len(timing['module']) for timing in report['imports']])
+    lines = [
+        f"{'module'.ljust(moduleColumnWidth)}  mode   {'ms':>9}",
+        f"{'-' * moduleColumnWidth}  -----  {'-' * 9}",
+    ]
+    for timing in sorted(report['imports'], key=lambda item: item['ms'], reverse=True):
+        lines.append(f"{timing['module'].ljust(moduleColumnWidth)}  {timing['mode']:<5}  {timing['ms']:>9.2f}")
+    lines.append(f"{'main (total)'.ljust(moduleColumnWidth)}  {'':<5}  {report['moduleImportMs']:>9.2f}")
+    return '\n'.join(lines)
+
+
+mainModuleImportMs = round((time.perf_counter() - moduleImportStartTime) * 1000.0, 2)
+if importTimingReportEnabled:
+    logging.info('Import timing report:\n%s', formatImportTimingTable())
+
+
 if __name__ == '__main__':
-    # For Cloud Run, use the PORT environment variable
-    app.run(debug=False, host='0.0.0.0', port=port)
\ No newline at end of file
+    # Local development only; production runs under gunicorn (see gunicorn.conf.py)
+    startClientWarmup()
+    printerApiKeyStore.start()
+    app.run(debug=False, host='0.0.0.0', port=port, threaded=True)
\ No newline at end of file
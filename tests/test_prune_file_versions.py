@@ -0,0 +1,245 @@
+import importlib.util
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+toolPath = Path(__file__).resolve().parents[1] / 'tools' / 'prune_file_versions.py'
+spec = importlib.util.spec_from_file_location('prune_file_versions', toolPath)
+pruneFileVersions = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pruneFileVersions)
+
+
+class FakePreconditionFailed(Exception):
+    pass
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, docId, data, updateTime=None):
+        self.id = docId
+        self._data = data
+        self.exists = data is not None
+        self.update_time = updateTime
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, docId):
+        self.collection = collection
+        self.docId = docId
+
+    def get(self):
+        return self.collection.snapshot(self.docId)
+
+    def update(self, data):
+        self.collection.documents[self.docId].update(data)
+        self.collection.updateTimes[self.docId] = self.collection.updateTimes.get(self.docId, 1) + 1
+
+    def delete(self):
+        self.collection.documents.pop(self.docId, None)
+
+
+class FakeCollection:
+    def __init__(self, documents=None, updateTimes=None):
+        self.documents = dict(documents or {})
+        self.updateTimes = updateTimes if updateTimes is not None else {}
+
+    def snapshot(self, docId):
+        return FakeDocumentSnapshot(docId, self.documents.get(docId), self.updateTimes.get(docId, 1))
+
+    def where(self, filter=None):  # noqa: A002 - match Firestore API
+        return FakeCollection(
+            {
+                docId: data
+                for docId, data in self.documents.items()
+                if data.get(filter.field_path) == filter.value
+            },
+            self.updateTimes,
+        )
+
+    def select(self, _fieldPaths):
+        return self
+
+    def stream(self):
+        return [self.snapshot(docId) for docId in self.documents]
+
+    def document(self, docId):
+        return FakeDocumentReference(self, docId)
+
+
+class FakeWriteBatch:
+    def __init__(self):
+        self.deletes = []
+
+    def delete(self, reference, option=None):
+        self.deletes.append((reference, option))
+
+    def commit(self):
+        for reference, option in self.deletes:
+            currentTime = reference.collection.updateTimes.get(reference.docId, 1)
+            if option is not None and option.last_update_time != currentTime:
+                raise FakePreconditionFailed(reference.docId)
+        for reference, _option in self.deletes:
+            reference.delete()
+
+
+class FakeFirestoreClient:
+    def __init__(self, files, pointers=None):
+        self.collections = {
+            'files': FakeCollection(files),
+            'products': FakeCollection(pointers),
+            'fetch_tokens': FakeCollection(),
+        }
+
+    def collection(self, name):
+        return self.collections[name]
+
+    def batch(self):
+        return FakeWriteBatch()
+
+    @staticmethod
+    def write_option(**kwargs):
+        return SimpleNamespace(**kwargs)
+
+
+class FakeBucket:
+    def __init__(self, objectNames):
+        self.objectNames = set(objectNames)
+        self.deleted = []
+
+    def delete_blob(self, objectName):
+        self.deleted.append(objectName)
+        self.objectNames.discard(objectName)
+
+
+class FakeStorageClient:
+    def __init__(self, bucket):
+        self.bucketInstance = bucket
+
+    def bucket(self, _name):
+        return self.bucketInstance
+
+    @contextmanager
+    def batch(self, raise_exception=True):  # pylint: disable=unused-argument
+        yield
+
+
+fakeService = SimpleNamespace(
+    firestoreCollectionFiles='files',
+    FailedPrecondition=FakePreconditionFailed,
+    FieldFilter=lambda field, op, value: SimpleNamespace(field_path=field, op_string=op, value=value),
+    getLatestFilePointerReference=lambda client, productId: client.collection('products').document(productId),
+    getFetchTokenIndexReference=lambda client, token: client.collection('fetch_tokens').document(token),
+    isSignedFetchToken=lambda token: False,
+)
+
+
+def buildFile(productId, ageMinutes, gcsPath, **overrides):
+    fileData = {
+        'productId': productId,
+        'timestamp': datetime.now(timezone.utc) - timedelta(minutes=ageMinutes),
+        'gcsPath': gcsPath,
+        'status': 'printed',
+        'fetchTokenConsumed': True,
+    }
+    fileData.update(overrides)
+    return fileData
+
+
+def buildClients(files, objectNames, pointers=None):
+    bucket = FakeBucket(objectNames)
+    clients = SimpleNamespace(
+        firestoreClient=FakeFirestoreClient(files, pointers),
+        storageClient=FakeStorageClient(bucket),
+        gcsBucketName='test-bucket',
+    )
+    return clients, bucket
+
+
+def testPlanRetentionKeepsObjectNamesOfKeptAndProtectedFiles():
+    sharedPath = 'recipient-1/product-1_part.gcode'
+    files = {
+        'new': buildFile('product-1', 1, sharedPath),
+        'old-1': buildFile('product-1', 10, sharedPath),
+        'old-2': buildFile('product-1', 20, 'recipient-1/product-1_renamed.gcode'),
+        'printing': buildFile('product-1', 30, 'recipient-1/product-1_printing.gcode', status='printing'),
+    }
+    clients, _bucket = buildClients(files, [])
+
+    plan = pruneFileVersions.planRetention(fakeService, clients.firestoreClient, keepVersions=1)
+
+    assert sorted(fileSnapshot.id for fileSnapshot in plan['deletions']) == ['old-1', 'old-2']
+    assert plan['retainedObjectNames'] == {sharedPath, 'recipient-1/product-1_printing.gcode'}
+    assert plan['protected'] == {'active': 1}
+
+
+def testPruneFileVersionsKeepsObjectSharedWithNewestVersion():
+    sharedPath = 'recipient-1/product-1_part.gcode'
+    files = {
+        'new': buildFile('product-1', 1, sharedPath, fetchTokenConsumed=False,
+                         fetchTokenExpiry=datetime.now(timezone.utc) + timedelta(minutes=5)),
+        'old-1': buildFile('product-1', 10, sharedPath),
+        'old-2': buildFile('product-1', 20, sharedPath),
+        'old-3': buildFile('product-1', 30, 'recipient-1/product-1_renamed.gcode'),
+    }
+    clients, bucket = buildClients(files, [sharedPath, 'recipient-1/product-1_renamed.gcode'])
+
+    report = pruneFileVersions.pruneFileVersions(
+        fakeService, clients, keepVersions=1, maxDeletesPerSecond=0
+    )
+
+    assert report['documentsDeleted'] == 3
+    assert report['objectsDeleted'] == 1
+    assert report['objectsShared'] == 2
+    assert bucket.deleted == ['recipient-1/product-1_renamed.gcode']
+    assert sharedPath in bucket.objectNames
+    assert list(clients.firestoreClient.collection('files').documents) == ['new']
+
+
+def testDeleteFileVersionsDeletesSharedObjectOnceWhenNoFileKeepsIt():
+    sharedPath = 'recipient-1/product-1_part.gcode'
+    files = {
+        'old-1': buildFile('product-1', 10, sharedPath),
+        'old-2': buildFile('product-1', 20, sharedPath),
+    }
+    clients, bucket = buildClients(files, [sharedPath])
+    fileSnapshots = clients.firestoreClient.collection('files').stream()
+
+    counts = pruneFileVersions.deleteFileVersions(
+        fakeService, clients, fileSnapshots, 1, pruneFileVersions.DeletionThrottle(0), retainedObjectNames=set()
+    )
+
+    assert counts == {
+        'documentsDeleted': 2,
+        'documentsChanged': 0,
+        'objectsDeleted': 1,
+        'objectsShared': 1,
+        'failedBatches': 0,
+    }
+    assert bucket.deleted == [sharedPath]
+
+
+def testDeleteFileVersionsKeepsFileChangedSinceThePlanAndItsObject():
+    sharedPath = 'recipient-1/product-1_part.gcode'
+    files = {
+        'old-1': buildFile('product-1', 10, sharedPath),
+        'old-2': buildFile('product-1', 20, sharedPath),
+        'old-3': buildFile('product-1', 30, 'recipient-1/product-1_renamed.gcode'),
+    }
+    clients, bucket = buildClients(files, [sharedPath, 'recipient-1/product-1_renamed.gcode'])
+    filesCollection = clients.firestoreClient.collection('files')
+    fileSnapshots = filesCollection.stream()
+    filesCollection.document('old-1').update({'status': 'handshake-download'})
+
+    counts = pruneFileVersions.deleteFileVersions(
+        fakeService, clients, fileSnapshots, 10, pruneFileVersions.DeletionThrottle(0), retainedObjectNames=set()
+    )
+
+    assert counts['documentsDeleted'] == 2
+    assert counts['documentsChanged'] == 1
+    assert counts['failedBatches'] == 0
+    assert list(filesCollection.documents) == ['old-1']
+    assert bucket.deleted == ['recipient-1/product-1_renamed.gcode']
+    assert sharedPath in bucket.objectNames
@@ -0,0 +1,126 @@
+"""Backfill the per-product ``latestFileId`` pointers in the products collection.
+
+Uploads keep the pointer current on their own; this only matters for products
+whose files were written before pointers existed. The files collection is
+streamed once (projected to ``productId``, ``recipientId`` and ``timestamp``),
+the newest file per product is picked the same way the handshake used to pick
+it, and each pointer is written with a precondition so a concurrent upload is
+never rolled back. Pointers that already name a file at least as new are left
+alone.
+
+Usage::
+
+    GCP_PROJECT_ID=my-project python tools/backfill_latest_file_pointers.py --dry-run
+    GCP_PROJECT_ID=my-project python tools/backfill_latest_file_pointers.py --product-id <uuid>
+
+The report is JSON.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+repositoryRoot = Path(__file__).resolve().parent.parent
+
+
+def collectLatestFiles(main, firestoreClient, productId: Optional[str] = None) -> Dict[str, object]:
+    fileQuery = firestoreClient.collection(main.firestoreCollectionFiles)
+    if productId:
+        fileQuery = fileQuery.where(filter=main.FieldFilter('productId', '==', productId))
+    fileQuery = fileQuery.select(['productId', 'recipientId', 'timestamp'])
+
+    latestFiles: Dict[str, object] = {}
+    for fileSnapshot in fileQuery.stream():
+        fileProductId = (fileSnapshot.to_dict() or {}).get('productId')
+        if not fileProductId:
+            continue
+        currentSnapshot = latestFiles.get(fileProductId)
+        if currentSnapshot is None:
+            latestFiles[fileProductId] = fileSnapshot
+        else:
+            latestFiles[fileProductId] = main.pickLatestDocumentByTimestamp([currentSnapshot, fileSnapshot])
+    return latestFiles
+
+
+def _pointerIsCurrent(pointerSnapshot, fileSnapshot) -> bool:
+    if not pointerSnapshot.exists:
+        return False
+    pointerData = pointerSnapshot.to_dict() or {}
+    if pointerData.get('latestFileId') == fileSnapshot.id:
+        return True
+    pointerTimestamp = pointerData.get('latestFileTimestamp')
+    fileTimestamp = (fileSnapshot.to_dict() or {}).get('timestamp')
+    return (
+        isinstance(pointerTimestamp, datetime)
+        and isinstance(fileTimestamp, datetime)
+        and pointerTimestamp >= fileTimestamp
+    )
+
+
+def backfillLatestFilePointers(
+    main, firestoreClient, productId: Optional[str] = None, dryRun: bool = False
+) -> Dict[str, object]:
+    latestFiles = collectLatestFiles(main, firestoreClient, productId)
+    counts = {'products': len(latestFiles), 'unchanged': 0, 'written': 0, 'skipped': 0}
+    pendingProductIds: List[str] = []
+
+    for fileProductId, fileSnapshot in sorted(latestFiles.items()):
+        pointerSnapshot = main.getLatestFilePointerReference(firestoreClient, fileProductId).get()
+        if _pointerIsCurrent(pointerSnapshot, fileSnapshot):
+            counts['unchanged'] += 1
+            continue
+        if dryRun:
+            pendingProductIds.append(fileProductId)
+            continue
+        if main.repairLatestFilePointer(firestoreClient, fileProductId, pointerSnapshot, fileSnapshot):
+            counts['written'] += 1
+        else:
+            # A concurrent upload moved the pointer; it is newer than this backfill.
+            counts['skipped'] += 1
+
+    report: Dict[str, object] = {'dryRun': dryRun, **counts}
+    if dryRun:
+        report['pendingProductIds'] = pendingProductIds
+    return report
+
+
+def parseArguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--product-id', help='only backfill this product')
+    parser.add_argument('--dry-run', action='store_true', help='report the pointers that would change')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arguments = parseArguments(argv)
+    gcpProjectId = os.environ.get('GCP_PROJECT_ID')
+    if not gcpProjectId:
+        sys.stderr.write('GCP_PROJECT_ID must be set\n')
+        return 2
+
+    sys.path.insert(0, str(repositoryRoot))
+    import main as service  # pylint: disable=import-outside-toplevel
+
+    firestoreClient = service.firestore.Client(project=gcpProjectId)
+    report = {
+        'tool': 'backfill_latest_file_pointers',
+        'generatedAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        **backfillLatestFilePointers(service, firestoreClient, arguments.product_id, arguments.dry_run),
+    }
+
+    reportText = json.dumps(report, indent=2)
+    if arguments.output:
+        Path(arguments.output).write_text(reportText + '\n', encoding='utf-8')
+    else:
+        sys.stdout.write(reportText + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,334 @@
+"""Delete superseded file versions, keeping the newest ``--keep`` per product.
+
+Every upload adds a ``files`` document and a Cloud Storage object, and nothing
+else removes the ones a newer upload replaced. This streams the files
+collection once, ranks each product's files by ``timestamp`` and deletes the
+older ones in bulk: Firestore documents (and their fetch token index entries)
+in write batches, then the objects in Cloud Storage batch requests.
+
+A superseded file is kept anyway while it may still be in use: its fetch token
+is unconsumed and unexpired, it is printing or mid-handshake, it is the file
+named by the product's latest-file pointer, or it has no timestamp to rank it
+by. Each document is deleted only if it is unchanged since it was ranked.
+Uploads of the same product and filename reuse one object name, so an object
+is only deleted when its document delete committed and no remaining file
+document refers to it. Deletions are throttled to ``--max-deletes-per-second``.
+
+Usage::
+
+    python tools/prune_file_versions.py --keep 3 --dry-run
+    python tools/prune_file_versions.py --keep 3 --max-deletes-per-second 20 --limit 5000
+
+Needs the service's environment (GCP_PROJECT_ID, GCS_BUCKET_NAME and the KMS
+settings checked by getClients). The report is JSON.
+"""
+
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+repositoryRoot = Path(__file__).resolve().parent.parent
+
+retentionFieldPaths = [
+    'productId',
+    'timestamp',
+    'gcsPath',
+    'status',
+    'fetchToken',
+    'fetchTokenConsumed',
+    'fetchTokenExpiry',
+]
+activeFileStatuses = {'printing', 'handshake-download', 'handshake-metadata'}
+firestoreBatchLimit = 500
+storageBatchLimit = 100
+
+
+def _protectionReason(fileMetadata: Dict[str, object], pointerFileId: Optional[str], fileId: str, now: datetime):
+    if fileId == pointerFileId:
+        return 'latestPointer'
+    if not isinstance(fileMetadata.get('timestamp'), datetime):
+        return 'noTimestamp'
+    if fileMetadata.get('status') in activeFileStatuses:
+        return 'active'
+    fetchTokenExpiry = fileMetadata.get('fetchTokenExpiry')
+    if (
+        fileMetadata.get('fetchTokenConsumed') is False
+        and isinstance(fetchTokenExpiry, datetime)
+        and fetchTokenExpiry > now
+    ):
+        return 'liveFetchToken'
+    return None
+
+
+def _newestFirstKey(fileSnapshot):
+    timestamp = (fileSnapshot.to_dict() or {}).get('timestamp')
+    if not isinstance(timestamp, datetime):
+        # Unranked files sort last and are then protected.
+        return (1, 0.0)
+    return (0, -timestamp.timestamp())
+
+
+def _objectName(fileSnapshot) -> Optional[str]:
+    return (fileSnapshot.to_dict() or {}).get('gcsPath')
+
+
+def planRetention(main, firestoreClient, keepVersions: int, productId: Optional[str] = None) -> Dict[str, object]:
+    """Return the superseded files to delete, the object names kept files still
+    use, and how many files were kept for each protection reason."""
+    fileQuery = firestoreClient.collection(main.firestoreCollectionFiles)
+    if productId:
+        fileQuery = fileQuery.where(filter=main.FieldFilter('productId', '==', productId))
+    fileQuery = fileQuery.select(retentionFieldPaths)
+
+    productFiles: Dict[str, List[object]] = defaultdict(list)
+    retainedObjectNames: Set[str] = set()
+    for fileSnapshot in fileQuery.stream():
+        fileProductId = (fileSnapshot.to_dict() or {}).get('productId')
+        if fileProductId:
+            productFiles[fileProductId].append(fileSnapshot)
+        elif _objectName(fileSnapshot):
+            retainedObjectNames.add(_objectName(fileSnapshot))
+
+    now = datetime.now(timezone.utc)
+    deletions: List[object] = []
+    protectedCounts: Dict[str, int] = defaultdict(int)
+    for fileProductId, fileSnapshots in sorted(productFiles.items()):
+        if len(fileSnapshots) <= keepVersions:
+            retainedObjectNames.update(filter(None, map(_objectName, fileSnapshots)))
+            continue
+        fileSnapshots.sort(key=_newestFirstKey)
+        retainedObjectNames.update(filter(None, map(_objectName, fileSnapshots[:keepVersions])))
+        pointerSnapshot = main.getLatestFilePointerReference(firestoreClient, fileProductId).get()
+        pointerFileId = (pointerSnapshot.to_dict() or {}).get('latestFileId') if pointerSnapshot.exists else None
+        for fileSnapshot in fileSnapshots[keepVersions:]:
+            reason = _protectionReason(fileSnapshot.to_dict() or {}, pointerFileId, fileSnapshot.id, now)
+            if reason:
+                protectedCounts[reason] += 1
+                if _objectName(fileSnapshot):
+                    retainedObjectNames.add(_objectName(fileSnapshot))
+            else:
+                deletions.append(fileSnapshot)
+
+    return {
+        'products': len(productFiles),
+        'deletions': deletions,
+        'retainedObjectNames': retainedObjectNames,
+        'protected': dict(protectedCounts),
+    }
+
+
+class DeletionThrottle:
+    """Spaces deletions so no more than ``maxPerSecond`` are issued on average."""
+
+    def __init__(self, maxPerSecond: float):
+        self.maxPerSecond = maxPerSecond
+        self.startTime = time.monotonic()
+        self.issued = 0
+
+    def wait(self, count: int) -> None:
+        if self.maxPerSecond > 0:
+            earliestStart = self.startTime + self.issued / self.maxPerSecond
+            delay = earliestStart - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.issued += count
+
+
+def _commitDocumentDeletes(main, firestoreClient, fileSnapshots: List[object]) -> None:
+    writeBatch = firestoreClient.batch()
+    for fileSnapshot in fileSnapshots:
+        fileMetadata = fileSnapshot.to_dict() or {}
+        # The plan was made from this snapshot; a file claimed, handshaken or
+        # re-pointed since then must not be deleted from it.
+        writeBatch.delete(
+            firestoreClient.collection(main.firestoreCollectionFiles).document(fileSnapshot.id),
+            option=firestoreClient.write_option(last_update_time=fileSnapshot.update_time),
+        )
+        fetchToken = fileMetadata.get('fetchToken')
+        if fetchToken and not main.isSignedFetchToken(fetchToken):
+            writeBatch.delete(main.getFetchTokenIndexReference(firestoreClient, fetchToken))
+    writeBatch.commit()
+
+
+def deleteFileVersions(
+    main,
+    clients,
+    fileSnapshots: List[object],
+    batchSize: int,
+    throttle: DeletionThrottle,
+    retainedObjectNames: Optional[Set[str]] = None,
+):
+    """Delete the documents, then the objects no remaining file refers to.
+
+    ``retainedObjectNames`` must hold the ``gcsPath`` of every file that is not
+    being deleted: a newer version of the same product and filename is stored
+    under the same object name. Objects are only deleted once every document
+    batch has run, and only for documents whose delete committed.
+    """
+    firestoreClient = clients.firestoreClient
+    bucket = clients.storageClient.bucket(clients.gcsBucketName)
+    # Copied, so an object shared by two deleted versions goes only once.
+    skippedObjectNames = set(retainedObjectNames or ())
+    counts = {
+        'documentsDeleted': 0,
+        'documentsChanged': 0,
+        'objectsDeleted': 0,
+        'objectsShared': 0,
+        'failedBatches': 0,
+    }
+
+    # Documents go first: once they are gone the API no longer serves the
+    # version, and an object left behind by a failed storage batch is
+    # harmless.
+    deletedSnapshots: List[object] = []
+    for batchStart in range(0, len(fileSnapshots), batchSize):
+        batchSnapshots = fileSnapshots[batchStart:batchStart + batchSize]
+        throttle.wait(len(batchSnapshots))
+        try:
+            _commitDocumentDeletes(main, firestoreClient, batchSnapshots)
+            deletedSnapshots.extend(batchSnapshots)
+            continue
+        except main.FailedPrecondition:
+            pass
+        except Exception as error:  # pylint: disable=broad-except
+            sys.stderr.write(f'Firestore delete batch failed: {error}\n')
+            counts['failedBatches'] += 1
+            skippedObjectNames.update(filter(None, map(_objectName, batchSnapshots)))
+            continue
+
+        # A batch is atomic, so one changed file fails it; retry the rest one by one.
+        for fileSnapshot in batchSnapshots:
+            try:
+                _commitDocumentDeletes(main, firestoreClient, [fileSnapshot])
+                deletedSnapshots.append(fileSnapshot)
+                continue
+            except main.FailedPrecondition:
+                counts['documentsChanged'] += 1
+            except Exception as error:  # pylint: disable=broad-except
+                sys.stderr.write(f'Firestore delete of file {fileSnapshot.id} failed: {error}\n')
+                counts['failedBatches'] += 1
+            if _objectName(fileSnapshot):
+                skippedObjectNames.add(_objectName(fileSnapshot))
+    counts['documentsDeleted'] = len(deletedSnapshots)
+
+    objectNames = []
+    for fileSnapshot in deletedSnapshots:
+        objectName = _objectName(fileSnapshot)
+        if not objectName:
+            continue
+        if objectName in skippedObjectNames:
+            counts['objectsShared'] += 1
+            continue
+        skippedObjectNames.add(objectName)
+        objectNames.append(objectName)
+
+    for batchStart in range(0, len(objectNames), storageBatchLimit):
+        batchObjectNames = objectNames[batchStart:batchStart + storageBatchLimit]
+        try:
+            # Missing objects are not an error; the document is already gone.
+            with clients.storageClient.batch(raise_exception=False):
+                for objectName in batchObjectNames:
+                    bucket.delete_blob(objectName)
+        except Exception as error:  # pylint: disable=broad-except
+            sys.stderr.write(f'Cloud Storage delete batch failed: {error}\n')
+            counts['failedBatches'] += 1
+            continue
+        counts['objectsDeleted'] += len(batchObjectNames)
+
+    return counts
+
+
+def pruneFileVersions(
+    main,
+    clients,
+    keepVersions: int,
+    productId: Optional[str] = None,
+    dryRun: bool = False,
+    limit: int = 0,
+    batchSize: int = storageBatchLimit,
+    maxDeletesPerSecond: float = 50.0,
+) -> Dict[str, object]:
+    plan = planRetention(main, clients.firestoreClient, keepVersions, productId)
+    deletions = plan['deletions'][:limit] if limit > 0 else plan['deletions']
+    # Files left over by --limit stay too, and so do their objects.
+    retainedObjectNames = set(plan['retainedObjectNames'])
+    retainedObjectNames.update(filter(None, map(_objectName, plan['deletions'][len(deletions):])))
+    report: Dict[str, object] = {
+        'dryRun': dryRun,
+        'keepVersions': keepVersions,
+        'products': plan['products'],
+        'superseded': len(plan['deletions']),
+        'selected': len(deletions),
+        'protected': plan['protected'],
+    }
+    if dryRun:
+        report['fileIds'] = [fileSnapshot.id for fileSnapshot in deletions]
+        return report
+
+    # Each file can add a token index delete, so a Firestore batch holds at
+    # most half the write limit in files.
+    batchSize = max(1, min(batchSize, storageBatchLimit, firestoreBatchLimit // 2))
+    report.update(
+        deleteFileVersions(
+            main, clients, deletions, batchSize, DeletionThrottle(maxDeletesPerSecond), retainedObjectNames
+        )
+    )
+    return report
+
+
+def parseArguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--keep', type=int, default=3, help='newest versions to keep per product')
+    parser.add_argument('--product-id', help='only prune this product')
+    parser.add_argument('--dry-run', action='store_true', help='report what would be deleted')
+    parser.add_argument('--limit', type=int, default=0, help='delete at most this many files (0 = no limit)')
+    parser.add_argument('--batch-size', type=int, default=storageBatchLimit, help='files per delete batch')
+    parser.add_argument(
+        '--max-deletes-per-second', type=float, default=50.0, help='average file deletion rate (0 = unthrottled)'
+    )
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arguments = parseArguments(argv)
+    if arguments.keep < 1:
+        sys.stderr.write('--keep must be at least 1\n')
+        return 2
+
+    sys.path.insert(0, str(repositoryRoot))
+    import main as service  # pylint: disable=import-outside-toplevel
+
+    startTime = time.monotonic()
+    results = pruneFileVersions(
+        service,
+        service.getClients(),
+        arguments.keep,
+        productId=arguments.product_id,
+        dryRun=arguments.dry_run,
+        limit=arguments.limit,
+        batchSize=arguments.batch_size,
+        maxDeletesPerSecond=arguments.max_deletes_per_second,
+    )
+    report = {
+        'tool': 'prune_file_versions',
+        'generatedAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'elapsedSeconds': round(time.monotonic() - startTime, 3),
+        **results,
+    }
+
+    reportText = json.dumps(report, indent=2)
+    if arguments.output:
+        Path(arguments.output).write_text(reportText + '\n', encoding='utf-8')
+    else:
+        sys.stdout.write(reportText + '\n')
+    return 1 if report.get('failedBatches') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())